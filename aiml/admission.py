@@ -0,0 +1,174 @@
+""" Admission control for the inference endpoints.
+
+    All YOLO/CNN work goes through one AdmissionController. It keeps a small
+    number of inference slots (run on a dedicated thread pool so the event loop
+    stays responsive), hands free slots out by priority class, and refuses new
+    work when the queue is too deep or recent latency is over the SLO. Callers
+    turn a refusal into a 503 + Retry-After (HTTP) or a `throttle` message
+    (WebSocket).
+
+    Background jobs do not pass through here: they run in their own worker
+    processes (jobs.py), with their own share of the cores (cpu_config.py),
+    at a lower scheduling priority (JOB_WORKER_NICE) so that request-path
+    inference wins whenever the two compete for a core.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from profiling import profiler
+
+# Priority classes, lower value is served first
+INTERACTIVE = 0   # single-image /detect
+STREAM = 1        # /ws/video and /process_video_frame frames
+BULK = 2          # multi-crop /predict_with_sensor/batch uploads
+
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', STREAM: 'stream', BULK: 'bulk'}
+
+# Share of the maximum queue depth each class may fill before it is shed,
+# so bulk work is turned away long before single-item requests are.
+CLASS_SHARE = {INTERACTIVE: 1.0, STREAM: 0.6, BULK: 0.3}
+
+
+class Overloaded(Exception):
+    def __init__(self, priority, retry_after, reason):
+        super().__init__(reason)
+        self.priority = priority
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class _PrioritySlots:
+    """An asyncio semaphore whose waiters are woken in priority order."""
+
+    def __init__(self, slots):
+        self._free = slots
+        self._waiters = []
+        self._seq = itertools.count()
+
+    def waiting(self, priority=None):
+        return sum(1 for p, _, fut in self._waiters
+                   if not fut.done() and (priority is None or p == priority))
+
+    async def acquire(self, priority):
+        if self._free > 0 and not self.waiting():
+            self._free -= 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            # The slot may have been handed over just before the cancel landed
+            if fut.done() and not fut.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self._free += 1
+
+
+class AdmissionController:
+    def __init__(self, slots=None, max_queue_depth=None, slo_ms=None, window=200):
+        self.slots = slots or int(os.getenv("INFERENCE_SLOTS", "1"))
+        self.max_queue_depth = max_queue_depth or int(os.getenv("INFERENCE_MAX_QUEUE", "16"))
+        self.slo_ms = slo_ms or float(os.getenv("INFERENCE_SLO_MS", "1000"))
+        self.executor = ThreadPoolExecutor(max_workers=self.slots, thread_name_prefix="inference")
+        self._slots = None
+        self._running = 0
+        self._queued = {p: 0 for p in PRIORITY_NAMES}
+        self._latencies = deque(maxlen=window)      # end-to-end ms, queue wait included
+        self._service_times = deque(maxlen=window)  # ms spent holding a slot
+        self.admitted = {p: 0 for p in PRIORITY_NAMES}
+        self.rejected = {p: 0 for p in PRIORITY_NAMES}
+
+    @property
+    def depth(self):
+        return self._running + sum(self._queued.values())
+
+    def recent_p95_ms(self):
+        if not self._latencies:
+            return 0.0
+        return float(np.percentile(np.fromiter(self._latencies, dtype=np.float64), 95))
+
+    def mean_service_ms(self):
+        if not self._service_times:
+            return 0.0
+        return sum(self._service_times) / len(self._service_times)
+
+    def retry_after_seconds(self):
+        """Rough time for the current queue to drain, at least one second."""
+        drain_ms = self.depth * self.mean_service_ms() / self.slots
+        return max(1, math.ceil(drain_ms / 1000))
+
+    def suggested_fps(self):
+        """Frame rate one stream can sustain given the recent service time and queue."""
+        service_ms = self.mean_service_ms()
+        if service_ms <= 0:
+            return None
+        per_slot = 1000.0 / service_ms * self.slots
+        return round(max(0.5, per_slot / max(1, self.depth)), 1)
+
+    def check(self, priority):
+        """Raise Overloaded if a request of this class should be shed right now."""
+        limit = self.max_queue_depth * CLASS_SHARE[priority]
+        over_slo = self.recent_p95_ms() > self.slo_ms
+        if over_slo and priority != INTERACTIVE:
+            # Latency already out of budget: keep lower classes to a trickle
+            limit = min(limit, self.slots)
+        if self.depth >= limit:
+            self.rejected[priority] += 1
+            reason = "latency over SLO" if over_slo else "inference queue full"
+            raise Overloaded(priority, self.retry_after_seconds(), reason)
+
+    async def run(self, priority, fn, *args):
+        """Admit, wait for a slot by priority, and run `fn(*args)` on the inference pool."""
+        self.check(priority)
+        if self._slots is None:
+            self._slots = _PrioritySlots(self.slots)
+        self.admitted[priority] += 1
+        enqueued = time.perf_counter()
+        self._queued[priority] += 1
+        try:
+            await self._slots.acquire(priority)
+        finally:
+            self._queued[priority] -= 1
+        self._running += 1
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, profiler.bind(fn), *args)
+        finally:
+            finished = time.perf_counter()
+            self._running -= 1
+            self._slots.release()
+            self._service_times.append((finished - started) * 1000)
+            self._latencies.append((finished - enqueued) * 1000)
+
+    def stats(self):
+        return {
+            "slots": self.slots,
+            "max_queue_depth": self.max_queue_depth,
+            "slo_ms": self.slo_ms,
+            "running": self._running,
+            "queued": {PRIORITY_NAMES[p]: n for p, n in self._queued.items()},
+            "recent_p95_ms": round(self.recent_p95_ms(), 2),
+            "mean_service_ms": round(self.mean_service_ms(), 2),
+            "admitted": {PRIORITY_NAMES[p]: n for p, n in self.admitted.items()},
+            "rejected": {PRIORITY_NAMES[p]: n for p, n in self.rejected.items()},
+        }
+
+
+admission = AdmissionController()
@@ -1,18 +1,23 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, File, UploadFile, HTTPException, WebSocket, WebSocketDisconnect, Header, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, ORJSONResponse, StreamingResponse
 from PIL import Image
 import torch
 import numpy as np
 import cv2
 from torchvision import models, transforms
+import asyncio
+import shutil
 import random
 import math
 import datetime
+import time
 import os
 import base64
 import json
 import hashlib
-from typing import List
+import hmac
+from typing import List, Optional
 import hashlib 
 from pydantic import BaseModel
 import os, requests
@@ -21,11 +26,44 @@ from dotenv import load_dotenv
 from ultralytics import YOLO
 from typing import List
 
+load_dotenv()
+
+# Split the cores between workers and thread pools before any model or pool starts
+from cpu_config import cpu_config
+cpu_config.apply()
+
+from profiling import profiler, ProfilingMiddleware
+from admission import admission, Overloaded, INTERACTIVE, STREAM, BULK
+from rate_control import StreamRateController
+from decoding import decoder, LETTERBOX
+from serialization import ResultEncoder, orjson
+from connections import ConnectionManager
+from channels import ChannelRegistry
+from mjpeg import MjpegOutput, BOUNDARY
+from ingest import StreamManager
+from freshness import FRESHNESS_THRESHOLD
+from apple_models import (detectors, classifiers, model_registries, crop_cache, load_models, model_version,
+                          weights_path, DETECT_DECODE_SIDE)
+from shared_weights import memory_report
+from telemetry import telemetry
+from shelf_life import forecaster
+from pricing import (inventory, pricing_rules, DEFAULT_STORE, APPLE_SKU, APPLE_SENSORS, apple_sensor_reading,
+                     dynamic_apple_price_engine, apple_detections, scale_box_to_source, simulate_milk_spoilage_data,
+                     milk_business_context, _predict_milk_spoilage, dynamic_milk_price_engine,
+                     generate_explanation_message)
+from pricing_rules import RuleError
+from sku_catalog import catalog, CatalogError
+from event_log import event_log
+from job_handlers import jobs
+from single_flight import SingleFlight
+from pipeline import (Pipeline, FrameRequest, AppleItem, DetectStage, WholeImageStage, ClassifyStage,
+                      SensorStage, PricingStage, safe_crop_box)
+
 """ well if u want to run the yolo model locally u can use the archive scripts.
     Here the yolo model is added in same fastapi for integrating it with frontend.
 """
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse if orjson is not None else JSONResponse)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -33,557 +71,1059 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(ProfilingMiddleware, profiler=profiler)
 
-# WebSocket connection manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
-
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
-
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except:
-                # Remove disconnected clients
-                self.active_connections.remove(connection)
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Admin endpoints need X-Admin-Token to match ADMIN_TOKEN, and are closed when it is unset."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (ADMIN_TOKEN is not set)")
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
 
+# WebSocket connection manager
 manager = ConnectionManager()
 
-# Initialize models with error handling
-yolo_model = None
-model = None
-device = torch.device('cpu')
-
-try:
-    print("Loading YOLO model...")
-    yolo_model = YOLO('models/trained/yolo_apple.pt')
-    print("YOLO model loaded successfully")
-except Exception as e:
-    print(f"Error loading YOLO model: {e}")
-    yolo_model = None
-
-try:
-    print("Loading CNN model...")
-    model = models.resnet50(weights=None)
-    model.fc = torch.nn.Sequential(
-        torch.nn.Linear(model.fc.in_features, 128),
-        torch.nn.ReLU(),
-        torch.nn.Linear(128, 1),
-        torch.nn.Sigmoid()
-    )
-    model.load_state_dict(torch.load('models/trained/spoilage_cnn.pth', map_location=device))
-    model.eval()
-    model = model.to(device)
-    print("CNN model loaded successfully")
-except Exception as e:
-    print(f"Error loading CNN model: {e}")
-    model = None
-
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-])
-
-def simulate_apple_sensor_data(prediction, confidence, box):
-
-    # using bounding box and prediction as seed
-    seed_str = f"{box}-{prediction}"
-    seed = int(hashlib.md5(seed_str.encode()).hexdigest(), 16) % (2**32)
-    random.seed(seed)
-
-    if prediction == 'rottenapples':
-        ethylene = round(5.0 + (confidence * 5) + random.uniform(-0.5, 0.5), 2)
-        ethylene = max(1.0, min(ethylene, 10.0))
-        temp = round(27.0 + random.uniform(-1.0, 1.0), 1)
-        humidity = round(75.0 + random.uniform(-2.0, 2.0), 1)
-    else:
-        ethylene = round(0.5 + (confidence * 0.5) + random.uniform(-0.1, 0.1), 2)
-        ethylene = max(0.1, min(ethylene, 1.5))
-        temp = round(22.0 + random.uniform(-1.0, 1.0), 1)
-        humidity = round(65.0 + random.uniform(-2.0, 2.0), 1)
+# Models are served from versioned registries so new weights can be swapped in without a restart
+load_models()
 
-    return {
-        'ethylene_ppm': ethylene,
-        'temperature_c': temp,
-        'humidity_percent': humidity
-    }
-
-def simulate_business_context():
-    """
-    Simulate daily sales, stock, and shelf life.
-    """
-    daily_sales_rate = random.choice([15,20, 30, 50, 70])
-    stock_level = random.choice([60, 85, 100, 150, 180])
-    shelf_life_days = 14
+def apple_sensor_data(prediction, confidence, box, lot=None):
+    """Live rolling readings for the lot when it has fresh telemetry, else simulated ones."""
+    return apple_sensor_reading(prediction, confidence, box, telemetry.current(lot, APPLE_SENSORS))
 
-    days_in_stock = random.randint(0, shelf_life_days)
-    estimated_shelf_life_days = shelf_life_days - days_in_stock
+def class_label(class_id):
+    # Get class name (assuming apple detection)
+    return "apple" if class_id == 0 else f"object_{class_id}"
 
-    return {
-        'daily_sales_rate': daily_sales_rate,
-        'stock_level': stock_level,
-        'estimated_shelf_life_days': estimated_shelf_life_days
-    }
+def overloaded_error(e: Overloaded):
+    return HTTPException(status_code=503, detail=f"Server busy: {e.reason}", headers={"Retry-After": str(e.retry_after)})
 
+def apple_shelf_life(lot, scores):
+    """The frame's spoilage scores are a label for the lot's shelf-life model; returns its remaining days."""
+    forecaster.observe_label(lot, sum(scores) / len(scores), kind='apple')
+    forecast = forecaster.forecast(lot)
+    return forecast['remaining_days'] if forecast is not None else None
 
-def dynamic_apple_price_engine(prediction, confidence, sensor_data, daily_sales_rate=100, stock_level=500, estimated_shelf_life_days=10):
-    base_price = 1.00
-    ethylene = sensor_data['ethylene_ppm']
-
-    context = simulate_business_context()
-    daily_sales_rate = context['daily_sales_rate']
-    stock_level = context['stock_level']
-    estimated_shelf_life_days = context['estimated_shelf_life_days']
-
-    if daily_sales_rate == 0:
-        days_to_clear_stock = float('inf')
-    else:
-        days_to_clear_stock = stock_level / daily_sales_rate
-
-    if prediction == 'freshapples':
-        if days_to_clear_stock <= estimated_shelf_life_days:
-            discount_percent = 0
-        elif estimated_shelf_life_days < 3:
-            discount_percent = 30
-        else:
-            discount_percent = min((days_to_clear_stock - estimated_shelf_life_days) * 2, 15)
-
-        price = round(base_price * (1 - discount_percent / 100), 2)
-        action = 'sell'
-        message = None if discount_percent == 0 else "Discount to boost sales"
-
-    elif prediction == 'rottenapples':
-        if ethylene < 7.0:
-            action = 'donate'
-            discount_percent = 0
-            price = 0.00
-            message = 'Slightly spoiled, donate to food bank'
-        else:
-            action = 'dump'
-            discount_percent = 0
-            price = 0.00
-            message = 'Dispose safely.'
-    else:
-        action = 'sell'
-        discount_percent = 0
-        price = base_price
-        message = None
-
-    return {
-        'action': action,
-        'discount_applied': discount_percent > 0,
-        'discount_percent': round(discount_percent, 1),
-        'price_usd': price,
-        'message': message,
-        'business_context': context 
-    }
+# detect -> classify -> sensor -> pricing, composed in-process (see pipeline.py)
+apple_pricing_stages = (
+    ClassifyStage(classifiers, FRESHNESS_THRESHOLD),
+    SensorStage(apple_sensor_data),
+    # One inventory read per frame, shared by every apple in it
+    PricingStage(dynamic_apple_price_engine, lambda store: inventory.context(store, APPLE_SKU), apple_shelf_life),
+)
+apple_pipeline = Pipeline(DetectStage(detectors), *apple_pricing_stages)
+# A photo of a single apple: no detection, the whole image is classified and priced
+image_pipeline = Pipeline(WholeImageStage(), *apple_pricing_stages)
+# Crops an edge client already detected: they are the items of one frame
+crop_pipeline = Pipeline(*apple_pricing_stages)
 
-def safe_crop_box(box, frame_shape):
+def analyze_apples(frame, scale=1, full_size=None, lot=None, store=DEFAULT_STORE):
     """
-    Ensure YOLO box coordinates are valid and inside frame bounds.
-    Returns clamped (x1, y1, x2, y2).
+    YOLO + CNN + sensor/pricing for every apple in a frame. Runs on the inference pool.
+    Sensor values come from `lot`'s telemetry when available and stock from `store`'s
+    inventory. Returns (detections, model_version).
     """
-    x1, y1, x2, y2 = box
-    h, w = frame_shape[:2]
-
-    # Round coordinates
-    x1 = max(0, min(int(round(x1)), w - 1))
-    y1 = max(0, min(int(round(y1)), h - 1))
-    x2 = max(x1 + 1, min(int(round(x2)), w))
-    y2 = max(y1 + 1, min(int(round(y2)), h))
-
-    return x1, y1, x2, y2
+    return apple_detections(apple_pipeline.run(FrameRequest(frame, scale, full_size, lot, store)))
 
 @app.post("/detect")
-async def detect_apples(file: UploadFile = File(...)):
-    if yolo_model is None:
+async def detect_apples(file: UploadFile = File(...), lot: Optional[str] = None, store: str = DEFAULT_STORE):
+    if detectors.active() is None:
         raise HTTPException(status_code=503, detail="YOLO model not available. Please check server logs.")
         
     if not file.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="Invalid file type. Please upload an image.")
+
+    # Shed before reading the upload so an overloaded server does no work at all
+    try:
+        admission.check(INTERACTIVE)
+    except Overloaded as e:
+        raise overloaded_error(e)
     
     contents = await file.read()
-    # Read image to OpenCV
-    nparr = np.frombuffer(contents, np.uint8)
-    frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    # Read image to OpenCV, reduced while the long side still covers DETECT_DECODE_SIDE
+    frame, scale, full_size = await decoder.decode_async(contents, (DETECT_DECODE_SIDE, DETECT_DECODE_SIDE), LETTERBOX)
 
     if frame is None:
         raise HTTPException(status_code=400, detail="Could not decode image")
 
-    results = yolo_model(frame, conf=0.5, device='cpu')
-    response_data = []
-
-    for result in results:
-        boxes = result.boxes.xyxy.cpu().numpy()
-        for box in boxes:
-            x1, y1, x2, y2 = safe_crop_box(box[:4], frame.shape)
-            apple_crop = frame[y1:y2, x1:x2]
-
-            if apple_crop.size == 0:
-                continue
+    try:
+        response_data, version = await admission.run(INTERACTIVE, analyze_apples, frame, scale, full_size, lot, store)
+    except Overloaded as e:
+        raise overloaded_error(e)
 
-            apple_crop_rgb = cv2.cvtColor(apple_crop, cv2.COLOR_BGR2RGB)
-            pil_image = Image.fromarray(apple_crop_rgb)
+    return {"detections": response_data, "model_version": version}
 
-            image_tensor = transform(pil_image).unsqueeze(0).to(device)
-            with torch.no_grad():
-                pred = model(image_tensor).item()
-                prediction = 'rottenapples' if pred > 0.8 else 'freshapples'
+# The classifier resizes to 224x224 anyway, so a reduced decode loses nothing
+CLASSIFY_DECODE_SIZE = (224, 224)
 
-            sensor_data = simulate_apple_sensor_data(prediction, pred, box)
-            pricing = dynamic_apple_price_engine(prediction, pred, sensor_data)
+def analyze_apple_image(frame, scale, full_size, lot, store):
+    request = image_pipeline.run(FrameRequest(frame, scale, full_size, lot, store))
+    detections, version = apple_detections(request)
+    return detections[0], version
 
-            response_data.append({
-                "box": [x1, y1, x2, y2],
-                "prediction": prediction,
-                "confidence": pred,
-                "sensor_data": sensor_data,
-                "pricing": pricing
-            })
-
-    return {"detections": response_data}
-
-def deterministic_seed_from_sku(sku: str):
-    hash_bytes = hashlib.md5(sku.encode()).digest()
-    seed = int.from_bytes(hash_bytes[:4], 'big')
-    random.seed(seed)
-
-def simulate_milk_spoilage_data(sku):
-    today = datetime.datetime.today()
-    deterministic_seed_from_sku(sku)  # Seeded randomness per SKU
-
-    if sku == 'whole_milk_1gal':
-        shelf_life_days = random.randint(14, 21)
-        days_past_expiry = random.randint(0, 14)
-        pH = round(random.uniform(4.5, 6.6), 2)
-        bacterial_load = round(random.uniform(6.0, 10.0), 2)
-    elif sku == 'skim_milk_1gal':
-        shelf_life_days = random.randint(21, 28)
-        days_past_expiry = random.randint(0, 21)
-        pH = round(random.uniform(5.0, 6.6), 2)
-        bacterial_load = round(random.uniform(4.0, 9.0), 2)
-    elif sku == 'lowfat_milk_1gal':
-        shelf_life_days = random.randint(21, 28)
-        days_past_expiry = random.randint(0, 21)
-        pH = round(random.uniform(5.0, 6.6), 2)
-        bacterial_load = round(random.uniform(4.0, 9.0), 2)
-    elif sku == 'uht_milk_1qt':
-        shelf_life_days = random.randint(90, 180)
-        days_past_expiry = random.randint(0, 60)
-        pH = round(random.uniform(6.0, 6.6), 2)
-        bacterial_load = round(random.uniform(2.0, 7.0), 2)
-    else:
-        raise HTTPException(status_code=400, detail="Invalid SKU")
-
-    production_date = today - datetime.timedelta(days=shelf_life_days + days_past_expiry)
-    expiry_date = production_date + datetime.timedelta(days=shelf_life_days)
-    storage_temp = round(random.uniform(0.0, 10.0), 1)
+@app.post("/predict_with_sensor")
+async def predict_with_sensor(file: UploadFile = File(...), lot: Optional[str] = None, store: str = DEFAULT_STORE):
+    """
+    Classify and price a photo of a single apple: classify -> sensor -> pricing,
+    run in-process on the inference pool.
+    """
+    if classifiers.active() is None:
+        raise HTTPException(status_code=503, detail="CNN model not available. Please check server logs.")
+    if not file.content_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail="Invalid file type. Please upload an image.")
+    try:
+        admission.check(INTERACTIVE)
+    except Overloaded as e:
+        raise overloaded_error(e)
 
-    return {
-        'sku': sku,
-        'production_date': production_date.strftime('%Y-%m-%d'),
-        'expiry_date': expiry_date.strftime('%Y-%m-%d'),
-        'days_past_expiry': days_past_expiry,
-        'pH': pH,
-        'bacterial_load_log_cfu_ml': bacterial_load,
-        'storage_temperature_c': storage_temp
-    }
+    contents = await file.read()
+    frame, scale, full_size = await decoder.decode_async(contents, CLASSIFY_DECODE_SIZE)
+    if frame is None:
+        raise HTTPException(status_code=400, detail="Could not decode image")
 
-def simulate_milk_business_context(sku: str):
-    deterministic_seed_from_sku(sku + "biz")  # Different seed from spoilage
-    demand = random.choice(['low', 'medium', 'high'])
-    sales_rate = {
-        'low': random.randint(10, 50),
-        'medium': random.randint(50, 100),
-        'high': random.randint(100, 200)
-    }[demand]
+    try:
+        item, version = await admission.run(INTERACTIVE, analyze_apple_image, frame, scale, full_size, lot, store)
+    except Overloaded as e:
+        raise overloaded_error(e)
 
-    stock_level = random.randint(100, 1000)
     return {
-        'demand': demand,
-        'daily_sales_rate': sales_rate,
-        'stock_level': stock_level
+        'prediction': item['prediction'],
+        'confidence': item['confidence'],
+        'sensor_data': item['sensor_data'],
+        'sensor_source': item['sensor_source'],
+        'pricing': item['pricing'],
+        'model_version': version
     }
 
-def _predict_milk_spoilage(spoilage_data):
-    w1, w2, w3 = 0.5, -1.0, 0.8
-    b = -5.0
-    x1 = spoilage_data['days_past_expiry']
-    x2 = spoilage_data['pH']
-    x3 = spoilage_data['bacterial_load_log_cfu_ml']
-    z = w1 * x1 + w2 * x2 + w3 * x3 + b
-    probability = 1 / (1 + math.exp(-z))
-    prediction = 'spoiled' if probability > 0.5 else 'fresh'
-    return prediction, probability
-
-
-def dynamic_milk_price_engine(prediction, probability, spoilage_data, context):
-    sku = spoilage_data['sku']
-    base_price = 3.45 if sku in ['whole_milk_1gal', 'skim_milk_1gal', 'lowfat_milk_1gal'] else 1.50
-
-    stock = context['stock_level']
-    sales = context['daily_sales_rate']
-    shelf_life_left = max(0, 10 - spoilage_data['days_past_expiry'])  # fallback in case days_past_expiry is used differently
-    days_to_expiry = max(0, (datetime.datetime.strptime(spoilage_data['expiry_date'], "%Y-%m-%d") - datetime.datetime.now()).days)
-
-    pH_threshold = 5.0 if sku == 'whole_milk_1gal' else 5.5
-    bacteria_threshold = 9.0 if sku == 'whole_milk_1gal' else 8.0
+PREDICT_BATCH_MAX_CROPS = int(os.getenv("PREDICT_BATCH_MAX_CROPS", "64"))
 
-    # Always enforce expiry first
-    if spoilage_data['days_past_expiry'] > 0 or days_to_expiry <= 0:
-        return {
-            'action': 'dump',
-            'discount_applied': False,
-            'discount_percent': 0,
-            'price_usd': 0.0,
-            'message': 'Expired product. Must be dumped per food safety law.',
-            'business_context': context
-        }
+def analyze_apple_crops(crops, lot, store):
+    request = FrameRequest(None, lot=lot, store=store)
+    for crop in crops:
+        h, w = crop.shape[:2]
+        request.items.append(AppleItem(None, [0, 0, w, h], cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)))
+    return apple_detections(crop_pipeline.run(request))
 
-    # If predicted spoiled or bad sensor data → dump
-    if prediction == 'spoiled' or spoilage_data['pH'] < pH_threshold or spoilage_data['bacterial_load_log_cfu_ml'] > bacteria_threshold:
-        return {
-            'action': 'dump',
-            'discount_applied': False,
-            'discount_percent': 0,
-            'price_usd': 0.0,
-            'message': 'Unsafe spoilage risk. Must dump.',
-            'business_context': context
-        }
+@app.post("/predict_with_sensor/batch")
+async def predict_with_sensor_batch(files: List[UploadFile] = File(...), lot: Optional[str] = None,
+                                    store: str = DEFAULT_STORE):
+    """
+    Classify and price every apple crop of one frame in a single request (edge
+    clients that run YOLO locally). Results are in upload order; the crops share
+    one CNN call, one inventory read and one shelf-life observation, as the
+    apples of a /detect frame do. Up to PREDICT_BATCH_MAX_CROPS crops is bulk
+    work, admitted behind single-image requests and stream frames.
+    """
+    if classifiers.active() is None:
+        raise HTTPException(status_code=503, detail="CNN model not available. Please check server logs.")
+    if len(files) > PREDICT_BATCH_MAX_CROPS:
+        raise HTTPException(status_code=400, detail=f"At most {PREDICT_BATCH_MAX_CROPS} crops per request")
+    for upload in files:
+        if not (upload.content_type or '').startswith('image/'):
+            raise HTTPException(status_code=400, detail=f"Not an image: {upload.filename}")
+    try:
+        admission.check(BULK)
+    except Overloaded as e:
+        raise overloaded_error(e)
+
+    contents = [await upload.read() for upload in files]
+    decoded = await asyncio.gather(*(decoder.decode_async(data, CLASSIFY_DECODE_SIZE) for data in contents))
+    crops = [frame for frame, _, _ in decoded]
+    if any(crop is None for crop in crops):
+        raise HTTPException(status_code=400, detail="Could not decode image")
 
-    # If near expiry and stock is very high → donate some
-    if days_to_expiry <= 2 and stock > sales * 2:
-        return {
-            'action': 'donate',
-            'discount_applied': False,
-            'discount_percent': 0,
-            'price_usd': 0.0,
-            'message': 'Near expiry with surplus stock. Donate portion to community.',
-            'business_context': context
-        }
+    try:
+        results, version = await admission.run(BULK, analyze_apple_crops, crops, lot, store)
+    except Overloaded as e:
+        raise overloaded_error(e)
 
-    # Otherwise, safe to sell at full price
     return {
-        'action': 'sell',
-        'discount_applied': False,
-        'discount_percent': 0,
-        'price_usd': base_price,
-        'message': 'Product safe. Sell at full price.',
-        'business_context': context
+        "results": [{key: row[key] for key in ('prediction', 'confidence', 'sensor_data', 'sensor_source', 'pricing')}
+                    for row in results],
+        "model_version": version
     }
 
-def generate_explanation_message(spoilage_data, prediction, probability):
-    return (
-        f"The prediction for {spoilage_data['sku']} was calculated using a logistic regression model "
-        f"based on spoilage indicators: pH={spoilage_data['pH']}, days past expiry={spoilage_data['days_past_expiry']}, "
-        f"and bacterial load={spoilage_data['bacterial_load_log_cfu_ml']} log CFU/mL. "
-        f"Probability of spoilage: {probability:.2f}. Storage temp: {spoilage_data['storage_temperature_c']}°C. "
-        f"Recommended action: '{prediction.upper()}' based on predicted safety and shelf risk."
-    )
 
+# Identical concurrent requests (same sku, lot and store) share one computation; results are reused for MILK_CACHE_TTL_S
+MILK_CACHE_TTL_S = float(os.getenv("MILK_CACHE_TTL_S", "2"))
+milk_lookups = SingleFlight("predict_milk_spoilage", MILK_CACHE_TTL_S)
 
 @app.post("/predict_milk_spoilage")
-async def predict_milk_spoilage(sku: str = "whole_milk_1gal"):
-    if sku not in ['whole_milk_1gal', 'skim_milk_1gal', 'lowfat_milk_1gal', 'uht_milk_1qt']:
+async def predict_milk_spoilage(sku: str = "whole_milk_1gal", lot: Optional[str] = None, store: str = DEFAULT_STORE):
+    if catalog.get(sku, 'milk') is None:
         raise HTTPException(status_code=400, detail="Invalid SKU.")
+    return await milk_lookups.run((sku, lot, store), milk_spoilage_report, sku, lot, store)
 
+def milk_spoilage_report(sku, lot, store):
     spoilage_data = simulate_milk_spoilage_data(sku)
+    # Measured pH and storage temperature replace the simulated ones when the lot reports them
+    sensor_source = 'simulated'
+    readings = telemetry.current(lot, ('pH',))
+    if readings is not None:
+        spoilage_data['pH'] = round(readings['pH'], 2)
+        sensor_source = 'telemetry'
+    readings = telemetry.current(lot, ('temperature_c',))
+    if readings is not None:
+        spoilage_data['storage_temperature_c'] = round(readings['temperature_c'], 1)
+        sensor_source = 'telemetry'
+    # A lot tracked as another product keeps its history and gets no milk forecast
+    shelf_life = forecaster.ensure(lot, 'milk') if lot is not None else None
     prediction, probability = _predict_milk_spoilage(spoilage_data)
-    context = simulate_milk_business_context(sku)
+    context = milk_business_context(sku, store)
     pricing = dynamic_milk_price_engine(prediction, probability, spoilage_data, context)
     explanation = generate_explanation_message(spoilage_data, prediction, probability)
+    event_log.record(
+        'milk_decision', store=store, sku=sku, lot=lot, prediction=prediction,
+        probability=probability, spoilage_data=spoilage_data, sensor_source=sensor_source,
+        action=pricing['action'], discount_percent=pricing['discount_percent'],
+        price_usd=pricing['price_usd'], rules_version=pricing['rules_version']
+    )
 
     return {
         'sku': sku,
         'spoilage_data': spoilage_data,
+        'sensor_source': sensor_source,
+        'shelf_life_forecast': shelf_life,
         'prediction': prediction,
         'probability': round(probability, 3),
         'pricing': pricing,
         'explanation': explanation
     }
 
+""" Sensor telemetry: real readings per lot, used by the pricing engines instead
+    of simulated values while they are fresh.
+"""
+
+def parse_telemetry(raw):
+    try:
+        message = orjson.loads(raw) if orjson is not None else json.loads(raw)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    if not isinstance(message, dict):
+        raise HTTPException(status_code=400, detail="Expected an object with 'readings' and/or 'series'")
+    return message
+
+@app.post("/telemetry")
+async def ingest_telemetry(request: Request):
+    """
+    Batch ingest. Body: {"readings": [{"lot", "sensor", "value", "ts"}]} and/or
+    {"series": [{"lot", "sensor", "ts": [...], "values": [...]}]}. Parsed without
+    pydantic so large batches stay cheap.
+    """
+    accepted, rejected = telemetry.ingest(parse_telemetry(await request.body()))
+    return {"accepted": accepted, "rejected": rejected}
+
+@app.websocket("/ws/telemetry")
+async def telemetry_websocket(websocket: WebSocket):
+    """Same message format as POST /telemetry; messages with an "id" are acknowledged."""
+    await websocket.accept()
+    try:
+        while True:
+            try:
+                message = parse_telemetry(await websocket.receive_text())
+            except HTTPException as e:
+                await websocket.send_text(json.dumps({"type": "error", "message": e.detail}))
+                continue
+            if message.get("type") == "ping":
+                await websocket.send_text(json.dumps({"type": "pong"}))
+                continue
+            accepted, rejected = telemetry.ingest(message)
+            if "id" in message:
+                await websocket.send_text(json.dumps({
+                    "type": "ack", "id": message["id"], "accepted": accepted, "rejected": rejected
+                }))
+    except WebSocketDisconnect:
+        pass
+
+""" Shelf-life forecasts per lot, updated with every reading and detection.
+"""
+
+telemetry.subscribe(forecaster.observe_reading)
+
+class ShelfLifeLot(BaseModel):
+    lot: str
+    kind: str = "apple"
+    nominal_days: Optional[float] = None
+    started_at: Optional[float] = None
+
+class ShelfLifeObservation(BaseModel):
+    spoilage: float
+    ts: Optional[float] = None
+
+""" Inventory: stock and sales feeds per store and SKU.
+"""
+
+@app.post("/inventory")
+async def upsert_inventory(request: Request):
+    """
+    Batch upsert from a sales feed. Body: {"rows": [{"store", "sku", "stock_level",
+    "sold", "period_days", "daily_sales_rate", "shelf_life_days", "received_at"}]},
+    every field but store and sku optional.
+    """
+    raw = await request.body()
+    try:
+        message = orjson.loads(raw) if orjson is not None else json.loads(raw)
+        rows = message["rows"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Expected {\"rows\": [...]}")
+    applied, rejected = inventory.upsert(rows)
+    return {"applied": applied, "rejected": rejected}
+
+@app.get("/inventory/{store}")
+async def get_store_inventory(store: str):
+    return {"store": store, "items": inventory.store_contexts(store)}
+
+@app.get("/inventory/{store}/{sku}")
+async def get_inventory_item(store: str, sku: str):
+    """A fed row, or the defaults for apples and catalog SKUs; reading never adds a row."""
+    if sku != APPLE_SKU and catalog.get(sku) is None and not inventory.known(store, sku):
+        raise HTTPException(status_code=404, detail=f"Unknown SKU '{sku}'")
+    return inventory.context(store, sku)
+
+""" Jobs: batch uploads, video files and storewide repricing run in worker
+    processes (see jobs.py) with the handlers in job_handlers.py. A worker's
+    inventory, telemetry and shelf-life stores start empty, so the serving
+    process snapshots the state a job is priced from into its params at
+    submit time. The queue is SQLite on disk, so every call into it runs off
+    the event loop.
+"""
+
+JOB_UPLOAD_CHUNK = 1 << 20
+
+def apple_job_snapshot(store, lot):
+    """The store's apple inventory, and the lot's telemetry and shelf life, as this process has them now."""
+    forecast = forecaster.forecast(lot) if lot is not None else None
+    return {
+        "context": inventory.context(store, APPLE_SKU),
+        "readings": telemetry.current(lot, APPLE_SENSORS),
+        "remaining_days": forecast['remaining_days'] if forecast is not None else None,
+    }
+
+def save_uploads(job_id, uploads):
+    """Copy (upload, name) pairs into the job's input directory. Blocking file IO."""
+    directory = jobs.input_dir(job_id)
+    for upload, name in uploads:
+        with open(os.path.join(directory, name), 'wb') as f:
+            shutil.copyfileobj(upload.file, f, JOB_UPLOAD_CHUNK)
+
+def job_response(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job["artifacts"] = jobs.artifacts(job_id)
+    return job
+
+@app.post("/jobs/images")
+async def submit_image_batch(files: List[UploadFile] = File(...), lot: Optional[str] = None, store: str = DEFAULT_STORE):
+    """Analyze a batch of images in the background. Returns the job; poll GET /jobs/{id}."""
+    for upload in files:
+        if not (upload.content_type or '').startswith('image/'):
+            raise HTTPException(status_code=400, detail=f"Not an image: {upload.filename}")
+    job_id = jobs.new_id()
+    uploads = [(upload, f"{i:05d}_{os.path.basename(upload.filename or 'image')}") for i, upload in enumerate(files)]
+    await asyncio.to_thread(save_uploads, job_id, uploads)
+    params = {"files": [name for _, name in uploads], "lot": lot, "store": store,
+              "snapshot": apple_job_snapshot(store, lot)}
+    return await asyncio.to_thread(jobs.submit, 'analyze_images', params, job_id)
+
+@app.post("/jobs/video")
+async def submit_video_analysis(file: UploadFile = File(...), sample_fps: float = 1.0,
+                                lot: Optional[str] = None, store: str = DEFAULT_STORE):
+    """Analyze a video file in the background, sampling `sample_fps` frames per second."""
+    if sample_fps <= 0:
+        raise HTTPException(status_code=400, detail="sample_fps must be positive")
+    job_id = jobs.new_id()
+    name = os.path.basename(file.filename or 'video')
+    await asyncio.to_thread(save_uploads, job_id, [(file, name)])
+    params = {"file": name, "sample_fps": sample_fps, "lot": lot, "store": store,
+              "snapshot": apple_job_snapshot(store, lot)}
+    return await asyncio.to_thread(jobs.submit, 'analyze_video', params, job_id)
+
+@app.post("/jobs/reprice/{store}")
+async def submit_store_reprice(store: str):
+    """Reprice every milk SKU in the catalog for a store, from its inventory as of now."""
+    items = [inventory.context(store, sku) for sku in catalog.skus('milk')]
+    return await asyncio.to_thread(jobs.submit, 'reprice_store', {"store": store, "items": items})
+
+@app.get("/jobs")
+async def list_jobs(status: Optional[str] = None, kind: Optional[str] = None, limit: int = 100):
+    return {"jobs": await asyncio.to_thread(jobs.list, status, kind, max(1, min(limit, 1000)))}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    return await asyncio.to_thread(job_response, job_id)
+
+def cancel_and_describe(job_id):
+    job_response(job_id)
+    jobs.cancel(job_id)
+    return job_response(job_id)
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    return await asyncio.to_thread(cancel_and_describe, job_id)
+
+def delete_job_files(job_id):
+    job_response(job_id)
+    if not jobs.delete(job_id):
+        raise HTTPException(status_code=409, detail="Job is still queued or running; cancel it first")
+
+@app.delete("/jobs/{job_id}")
+async def delete_job(job_id: str):
+    await asyncio.to_thread(delete_job_files, job_id)
+    return {"deleted": job_id}
+
+@app.get("/jobs/{job_id}/artifacts/{name}")
+async def get_job_artifact(job_id: str, name: str):
+    path = await asyncio.to_thread(jobs.artifact_path, job_id, name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Artifact not found")
+    return FileResponse(path, filename=name)
+
+@app.on_event("startup")
+async def start_job_workers():
+    await asyncio.to_thread(jobs.start_workers)
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    await asyncio.to_thread(jobs.stop_workers)
+
+""" Event log: every apple / milk pricing decision and stream frame's detections.
+"""
+
+@app.get("/events", dependencies=[Depends(require_admin)])
+async def query_events(kind: Optional[str] = None, since: Optional[float] = None, until: Optional[float] = None,
+                       store: Optional[str] = None, sku: Optional[str] = None, lot: Optional[str] = None,
+                       action: Optional[str] = None, limit: int = 1000):
+    """
+    Most recent events (oldest first). `kind` is a comma-separated list of
+    apple_decision, milk_decision, stream_detections; since/until are unix times.
+    """
+    filters = {name: value for name, value in
+               (('store', store), ('sku', sku), ('lot', lot), ('action', action)) if value is not None}
+    kinds = kind.split(',') if kind else None
+    # Reading segments is blocking file IO
+    events = await asyncio.to_thread(event_log.query, kinds, since, until, filters, max(1, min(limit, 10000)))
+    return {"count": len(events), "events": events}
+
+""" SKU catalog: base price, shelf-life ranges and spoilage thresholds per SKU.
+"""
+
+@app.get("/catalog")
+async def list_catalog(category: Optional[str] = None):
+    return {"version": catalog.snapshot.version, "skus": catalog.skus(category)}
+
+@app.get("/catalog/{sku}")
+async def get_catalog_entry(sku: str):
+    entry = catalog.get(sku)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"Unknown SKU '{sku}'")
+    return entry.as_dict()
+
+@app.post("/pricing/{category}/evaluate")
+async def evaluate_pricing(category: str, request: Request):
+    """
+    Price many items at once with a category's rule table. Body: columns of
+    equal length (scalars are broadcast), e.g. {"prediction": [...], "ethylene_ppm": [...],
+    "stock_level": 120, ...}. Returns the decision columns. With a "sku"
+    column, catalog parameters not given in the body are filled in per SKU.
+    """
+    try:
+        table = pricing_rules.get(category)
+    except RuleError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    raw = await request.body()
+    try:
+        columns = orjson.loads(raw) if orjson is not None else json.loads(raw)
+        skus = columns.get('sku')
+        if isinstance(skus, list):
+            for name, values in catalog.columns(skus).items():
+                columns.setdefault(name, values)
+        elif skus is not None:
+            entry = catalog.get(skus)
+            if entry is None:
+                raise CatalogError(f"Unknown SKU '{skus}'")
+            for name, value in entry.as_dict().items():
+                columns.setdefault(name, value)
+        result = table.evaluate_many(columns)
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise HTTPException(status_code=400, detail=f"Cannot evaluate: {e}")
+    result['discount_percent'] = np.round(result['discount_percent'], 1).tolist()
+    result['price_usd'] = result['price_usd'].tolist()
+    return result
+
+@app.get("/shelf-life")
+async def list_shelf_life(prefix: Optional[str] = None, lots: Optional[str] = None):
+    """Forecasts for every lot, or those under a prefix (e.g. a store) or in a comma-separated list."""
+    wanted = lots.split(",") if lots else None
+    return {"forecasts": forecaster.forecasts(prefix=prefix, lots=wanted)}
+
+@app.get("/shelf-life/{lot}")
+async def get_shelf_life(lot: str):
+    forecast = forecaster.forecast(lot)
+    if forecast is None:
+        raise HTTPException(status_code=404, detail="Unknown lot")
+    return forecast
+
+@app.post("/shelf-life/lots")
+async def track_lot(req: ShelfLifeLot):
+    try:
+        forecaster.track(req.lot, req.kind, req.nominal_days, req.started_at)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return forecaster.forecast(req.lot)
+
+@app.post("/shelf-life/{lot}/observations")
+async def observe_lot(lot: str, obs: ShelfLifeObservation):
+    """A measured spoilage score (0 fresh .. 1 spoiled) from a manual check."""
+    forecaster.observe_label(lot, obs.spoilage, ts=obs.ts)
+    return forecaster.forecast(lot)
+
+@app.get("/telemetry/{lot}")
+async def get_lot_telemetry(lot: str):
+    aggregates = telemetry.aggregates(lot)
+    if aggregates is None:
+        raise HTTPException(status_code=404, detail="No telemetry for this lot")
+    return {"lot": lot, "sensors": aggregates}
+
 @app.get("/")
 async def root():
     return {
         "message": "ResQCart API is running",
         "endpoints": {
             "/detect": "POST - Upload an image to detect and analyze apples",
+            "/predict_with_sensor": "POST - Classify and price a photo of a single apple",
+            "/predict_with_sensor/batch": "POST - Classify and price several apple crops of one frame",
             "/predict_milk_spoilage": "POST - Analyze milk spoilage based on SKU",
-            "/ws/video": "WebSocket - Real-time video prediction"
+            "/jobs": "POST /jobs/images, /jobs/video, /jobs/reprice/{store} - Background analysis; GET /jobs/{id} for progress and artifacts",
+            "/events": "GET - Query the decision / detection event log (admin)",
+            "/catalog": "GET - SKU catalog (?category=milk); GET /catalog/{sku} for one SKU's parameters",
+            "/inventory": "POST - Sales feed batch upsert; GET /inventory/{store} for stock and sales rates",
+            "/pricing/{category}/evaluate": "POST - Price columns of items with a category's rule table",
+            "/shelf-life": "GET - Remaining shelf-life forecasts per lot (?prefix= for one store)",
+            "/telemetry": "POST - Ingest sensor readings per lot (also /ws/telemetry); GET /telemetry/{lot} for rolling aggregates",
+            "/ws/video": "WebSocket - Real-time video prediction",
+            "/ws/camera/{name}/publish": "WebSocket - Push frames for a named camera channel",
+            "/ws/camera/{name}/subscribe": "WebSocket - Receive a camera channel's detection results",
+            "/cameras": "GET - List camera channels",
+            "/cameras/{name}/mjpeg": "GET - Annotated MJPEG stream of a camera channel",
+            "/cameras/streams": "GET/POST - List or add server-pulled RTSP/MJPEG/file streams",
+            "/admin/profiling": "GET/POST - Inspect or configure request profiling",
+            "/admin/admission": "GET - Inference queue depth, latency and shed counts",
+            "/admin/models": "GET - Model versions; POST /admin/models/{kind}/versions, /promote, /rollback to hot-swap"
         },
         "status": {
-            "yolo_model_loaded": yolo_model is not None,
-            "cnn_model_loaded": model is not None
+            "yolo_model_loaded": detectors.active() is not None,
+            "cnn_model_loaded": classifiers.active() is not None,
+            "model_version": model_version(detectors.active_version(), classifiers.active_version())
         }
     }
 
-@app.websocket("/ws/video")
-async def websocket_video_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
-    print("WebSocket connection accepted")
+# Stream frames carry no lot, so they are priced from simulated sensors and the default store's stock
+stream_pricing = Pipeline(*apple_pricing_stages[1:])
+
+def price_stream_detections(detections, scores):
+    """Attach the sensor -> pricing stages' decision to every classified stream detection."""
+    request = FrameRequest(None, store=DEFAULT_STORE)
+    priced = []
+    for detection, score in zip(detections, scores):
+        if detection["prediction"] == 'unknown':
+            continue
+        item = AppleItem(detection["box"], detection["box"], None)
+        item.score = score
+        item.prediction = detection["prediction"] + 'apples'
+        request.items.append(item)
+        priced.append(detection)
+    stream_pricing.run(request)
+    for detection, item in zip(priced, request.items):
+        detection["pricing"] = item.pricing
+
+def analyze_stream_frame(frame):
+    """
+    YOLO + CNN freshness and pricing for one video frame, resized to 640x640.
+    Runs on the inference pool. Returns (detections, model_version).
+    """
+    yolo_model, yolo_version = detectors.snapshot()
+    classifier, cnn_version = classifiers.snapshot()
+    # Resize frame to 640x640 for YOLO
+    frame_resized = cv2.resize(frame, (640, 640))
+    # (Optional) Convert to RGB if your YOLO model expects RGB
+    frame_resized = cv2.cvtColor(frame_resized, cv2.COLOR_BGR2RGB)
+
+    results = yolo_model(frame_resized, conf=0.2, device='cpu', verbose=False)
+    detections = []
+    crops = []
+
+    for result in results:
+        boxes = result.boxes.xyxy.cpu().numpy()
+        confidences = result.boxes.conf.cpu().numpy()
+        class_ids = result.boxes.cls.cpu().numpy()
+
+        for i, box in enumerate(boxes):
+            x1, y1, x2, y2 = safe_crop_box(box[:4], frame_resized.shape)
+            height, width, _ = frame_resized.shape
+            x1, y1 = max(0, x1), max(0, y1)
+            x2, y2 = min(width, x2), min(height, y2)
+            confidence = float(confidences[i])
+            class_id = int(class_ids[i])
+
+            # Crop detected object for further analysis
+            if x2 > x1 and y2 > y1:
+                object_crop = frame_resized[y1:y2, x1:x2]
+                if object_crop.size > 0:
+                    crops.append(cv2.cvtColor(object_crop, cv2.COLOR_BGR2RGB))
+
+                    # Timestamps and labels are added per frame by the connection's ResultEncoder
+                    detections.append({
+                        "box": [x1, y1, x2, y2],
+                        "class_id": class_id,
+                        "confidence": confidence,
+                        "prediction": 'unknown'
+                    })
+
+    # Score all crops of the frame in one batch
+    scores = []
     try:
-        while True:
-            # Receive base64 encoded frame from client
-            data = await websocket.receive_text()
-            print(f"Got data: {len(data)} chars")
-            frame_data = json.loads(data)
-            # print("Received raw data:", data)
-            # print("Parsed frame_data:", frame_data)
+        scores = classifier.score(crops)
+        for detection, pred in zip(detections, scores):
+            detection["prediction"] = 'rotten' if pred > FRESHNESS_THRESHOLD else 'fresh'
+    except Exception as e:
+        print(f"Error in CNN prediction: {e}")
+    price_stream_detections(detections, scores)
+
+    version = model_version(yolo_version, cnn_version)
+    event_log.record('stream_detections', model_version=version, detections=[
+        [d["class_id"], d["prediction"], round(d["confidence"], 3)] for d in detections
+    ])
+    return detections, version
+
+async def serve_frame_stream(websocket: WebSocket, encoder: ResultEncoder, on_result=None):
+    """
+    Receive frames on an accepted socket, run them through the stream pipeline
+    and reply with results until the client goes away. `on_result(detections,
+    frame_count, model_version, frame)` is awaited after each processed frame
+    (used by camera channels).
+    """
+    rate = StreamRateController()
+    schema = encoder.schema_message()
+    if schema is not None:
+        await manager.send_personal_message(schema, websocket, keep=True)
+    while True:
+        # Receive base64 encoded frame from client
+        data = await websocket.receive_text()
+        frame_data = json.loads(data)
+        
+        if frame_data.get("type") == "frame":
+            started = time.perf_counter()
+            # Decode base64 frame, at reduced resolution if the client sends more than we use
+            frame_bytes = base64.b64decode(frame_data["frame"])
+            frame, scale, full_size = await decoder.decode_async(frame_bytes, rate.decode_target())
             
-            if frame_data.get("type") == "frame":
-                print("Got frame!")
-                # Decode base64 frame
-                frame_bytes = base64.b64decode(frame_data["frame"])
-                nparr = np.frombuffer(frame_bytes, np.uint8)
-                frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-                print(f"Received frame: shape={frame.shape if frame is not None else None}, dtype={frame.dtype if frame is not None else None}")
+            if frame is not None:
+                if detectors.active() is None:
+                    await manager.send_personal_message(encoder.encode({
+                        "type": "error",
+                        "message": "YOLO model not available"
+                    }), websocket)
+                    continue
                 
-                if frame is not None:
-                    if yolo_model is None:
-                        print("YOLO model not available")
-                        await manager.send_personal_message(json.dumps({
-                            "type": "error",
-                            "message": "YOLO model not available"
-                        }), websocket)
-                        continue
-                        
-                    # Resize frame to 640x640 for YOLO
-                    frame_resized = cv2.resize(frame, (640, 640))
-                    # (Optional) Convert to RGB if your YOLO model expects RGB
-                    frame_resized = cv2.cvtColor(frame_resized, cv2.COLOR_BGR2RGB)
+                try:
+                    detections, version = await admission.run(STREAM, analyze_stream_frame, frame)
+                    frame_count = frame_data.get("frame_count", 0)
                     
-                    try:
-                        results = yolo_model(frame_resized, conf=0.2, device='cpu')
-                        print(f"YOLO results: {len(results)} detections")
-                        detections = []
-                        
-                        for result in results:
-                            boxes = result.boxes.xyxy.cpu().numpy()
-                            confidences = result.boxes.conf.cpu().numpy()
-                            class_ids = result.boxes.cls.cpu().numpy()
-                            
-                            for i, box in enumerate(boxes):
-                                x1, y1, x2, y2 = safe_crop_box(box[:4], frame.shape)
-                                height, width, _ = frame_resized.shape
-                                x1, y1 = max(0, x1), max(0, y1)
-                                x2, y2 = min(width, x2), min(height, y2)
-                                confidence = float(confidences[i])
-                                class_id = int(class_ids[i])
-                                
-                                # Get class name (assuming apple detection)
-                                class_name = "apple" if class_id == 0 else f"object_{class_id}"
-                                
-                                # Crop detected object for further analysis
-                                if x2 > x1 and y2 > y1:
-                                    object_crop = frame_resized[y1:y2, x1:x2]
-                                    if object_crop.size > 0:
-                                        object_crop_rgb = cv2.cvtColor(object_crop, cv2.COLOR_BGR2RGB)
-                                        pil_image = Image.fromarray(object_crop_rgb)
-                                        
-                                        try:
-                                            image_tensor = transform(pil_image).unsqueeze(0).to(device)
-                                            with torch.no_grad():
-                                                pred = model(image_tensor).item()
-                                                prediction = 'rotten' if pred > 0.8 else 'fresh'
-                                        except Exception as e:
-                                            print(f"Error in CNN prediction: {e}")
-                                            prediction = 'unknown'
-                                        
-                                        detections.append({
-                                            "box": [x1, y1, x2, y2],
-                                            "class": class_name,
-                                            "confidence": confidence,
-                                            "prediction": prediction,
-                                            "timestamp": datetime.datetime.now().isoformat()
-                                        })
-                        
-                        # Send results back to client
-                        response = {
-                            "type": "detection_results",
-                            "detections": detections,
-                            "frame_count": frame_data.get("frame_count", 0),
-                            "timestamp": datetime.datetime.now().isoformat()
-                        }
-                        
-                        await manager.send_personal_message(json.dumps(response), websocket)
-                        
-                    except Exception as e:
-                        print(f"Error in YOLO processing: {e}")
-                        await manager.send_personal_message(json.dumps({
-                            "type": "error",
-                            "message": f"Processing error: {str(e)}"
-                        }), websocket)
-            
-            elif frame_data.get("type") == "ping":
-                # Keep connection alive
-                await manager.send_personal_message(json.dumps({"type": "pong"}), websocket)
+                    # Send results back to client
+                    response = encoder.encode_results(detections, frame_count, class_label, version)
+                    
+                    await manager.send_personal_message(response, websocket, chain=encoder.delta)
+                    if on_result is not None:
+                        await on_result(detections, frame_count, version, frame)
+
+                    rate.record_frame(full_size, scale, len(frame_data["frame"]), (time.perf_counter() - started) * 1000)
+                    hint = rate.maybe_hint(admission.suggested_fps())
+                    if hint is not None:
+                        await manager.send_personal_message(encoder.encode(hint), websocket)
                 
+                except Overloaded as e:
+                    # Drop this frame and ask the client to slow down
+                    await manager.send_personal_message(encoder.encode({
+                        "type": "throttle",
+                        "reason": e.reason,
+                        "retry_after_ms": e.retry_after * 1000,
+                        "suggested_fps": admission.suggested_fps(),
+                        "frame_count": frame_data.get("frame_count", 0)
+                    }), websocket)
+                    
+                except Exception as e:
+                    print(f"Error in YOLO processing: {e}")
+                    await manager.send_personal_message(encoder.encode({
+                        "type": "error",
+                        "message": f"Processing error: {str(e)}"
+                    }), websocket)
+        
+        elif frame_data.get("type") == "ping":
+            # Keep connection alive
+            await manager.send_personal_message(encoder.encode({"type": "pong"}), websocket)
+
+@app.websocket("/ws/video")
+async def websocket_video_endpoint(websocket: WebSocket):
+    await manager.connect(websocket)
+    print("WebSocket connection accepted")
+    try:
+        await serve_frame_stream(websocket, ResultEncoder.from_query(websocket.query_params))
     except WebSocketDisconnect:
         manager.disconnect(websocket)
     except Exception as e:
         print(f"WebSocket error: {str(e)}")
         manager.disconnect(websocket)
 
+""" Camera channels: one producer pushes frames, inference runs once and every
+    subscriber receives the results.
+"""
+
+# Stream boxes are found on the 640x640 resize in analyze_stream_frame
+mjpeg = MjpegOutput(class_label, box_size=(640, 640))
+channels = ChannelRegistry(manager, class_label, mjpeg)
+
+@app.websocket("/ws/camera/{name}/publish")
+async def camera_publish_endpoint(websocket: WebSocket, name: str):
+    await websocket.accept()
+    if not channels.claim_producer(name, "websocket"):
+        await websocket.send_text(json.dumps({
+            "type": "error",
+            "message": f"Channel '{name}' already has a producer"
+        }))
+        await websocket.close(code=1008)
+        return
+    manager.register(websocket)
+    print(f"Camera channel '{name}' producer connected")
+
+    async def publish(detections, frame_count, version, frame):
+        await channels.publish(name, detections, frame_count, version, frame)
+
+    try:
+        await serve_frame_stream(websocket, ResultEncoder.from_query(websocket.query_params), on_result=publish)
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"Camera producer error on '{name}': {str(e)}")
+    finally:
+        manager.disconnect(websocket)
+        channels.release_producer(name)
+
+@app.websocket("/ws/camera/{name}/subscribe")
+async def camera_subscribe_endpoint(websocket: WebSocket, name: str):
+    await manager.connect(websocket)
+    # Payloads are shared between subscribers, so per-connection delta state is not offered here
+    params = websocket.query_params
+    encoder = ResultEncoder(fmt=params.get("format", "json"), schema=params.get("schema", "verbose"))
+    await channels.subscribe(name, websocket, encoder)
+    try:
+        while True:
+            message = json.loads(await websocket.receive_text())
+            if message.get("type") == "ping":
+                await manager.send_personal_message(encoder.encode({"type": "pong"}), websocket)
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"Camera subscriber error on '{name}': {str(e)}")
+    finally:
+        manager.disconnect(websocket)
+        channels.unsubscribe(name, websocket)
+
+@app.get("/cameras")
+async def list_cameras():
+    return {"channels": channels.status(), "streams": streams.status()}
+
+@app.get("/cameras/{name}/mjpeg")
+async def camera_mjpeg(name: str):
+    """The channel's frames with boxes, freshness and price labels drawn in, as an MJPEG stream."""
+    if not mjpeg.enabled:
+        raise HTTPException(status_code=404, detail="Annotated output is disabled (MJPEG_ENABLED=0)")
+    feed = channels.add_viewer(name)
+
+    async def body():
+        try:
+            async for part in mjpeg.parts(feed):
+                yield part
+        finally:
+            channels.remove_viewer(name)
+
+    return StreamingResponse(body(), media_type=f"multipart/x-mixed-replace; boundary={BOUNDARY}",
+                             headers={"Cache-Control": "no-cache"})
+
+""" Server-side stream ingestion: the service pulls RTSP / HTTP-MJPEG / file
+    sources itself and publishes results to the camera channel of the same name.
+"""
+
+streams = StreamManager(channels, admission, analyze_stream_frame)
+
+class StreamRequest(BaseModel):
+    name: str
+    url: str
+    sample_fps: float = 2.0
+    loop: bool = True
+
+@app.post("/cameras/streams", dependencies=[Depends(require_admin)])
+async def add_stream(req: StreamRequest):
+    if detectors.active() is None:
+        raise HTTPException(status_code=503, detail="YOLO model not available")
+    try:
+        worker = streams.add(req.name, req.url, req.sample_fps, req.loop)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return worker.status()
+
+@app.get("/cameras/streams")
+async def list_streams():
+    return {"streams": streams.status()}
+
+@app.delete("/cameras/streams/{name}", dependencies=[Depends(require_admin)])
+async def remove_stream(name: str):
+    if not streams.remove(name):
+        raise HTTPException(status_code=404, detail="Stream not found")
+    return {"removed": name}
+
+@app.on_event("shutdown")
+async def stop_streams():
+    streams.stop_all()
+
+@app.on_event("shutdown")
+async def close_event_log():
+    event_log.close()
+
+def detect_objects(frame, scale=1, full_size=None):
+    """YOLO boxes only, no freshness classification. Runs on the inference pool."""
+    yolo_model, yolo_version = detectors.snapshot()
+    results = yolo_model(frame, conf=0.5, device='cpu')
+    detections = []
+    
+    for result in results:
+        boxes = result.boxes.xyxy.cpu().numpy()
+        confidences = result.boxes.conf.cpu().numpy()
+        class_ids = result.boxes.cls.cpu().numpy()
+        
+        for i, box in enumerate(boxes):
+            x1, y1, x2, y2 = safe_crop_box(box[:4], frame.shape)
+            confidence = float(confidences[i])
+            class_id = int(class_ids[i])
+            class_name = class_label(class_id)
+            
+            detections.append({
+                "box": scale_box_to_source([x1, y1, x2, y2], scale, full_size),
+                "class": class_name,
+                "confidence": confidence,
+                "timestamp": datetime.datetime.now().isoformat()
+            })
+    
+    return detections, f"yolo@{yolo_version}"
+
 @app.post("/process_video_frame")
 async def process_video_frame(frame_data: dict):
     """Alternative HTTP endpoint for video frame processing"""
-    if yolo_model is None:
+    if detectors.active() is None:
         raise HTTPException(status_code=503, detail="YOLO model not available")
     
     try:
         # Decode base64 frame
         frame_bytes = base64.b64decode(frame_data["frame"])
-        nparr = np.frombuffer(frame_bytes, np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        frame, scale, full_size = await decoder.decode_async(frame_bytes, (640, 640), LETTERBOX)
         
         if frame is None:
             raise HTTPException(status_code=400, detail="Could not decode frame")
         
         # Process with YOLO
-        results = yolo_model(frame, conf=0.5, device='cpu')
-        detections = []
-        
-        for result in results:
-            boxes = result.boxes.xyxy.cpu().numpy()
-            confidences = result.boxes.conf.cpu().numpy()
-            class_ids = result.boxes.cls.cpu().numpy()
-            
-            for i, box in enumerate(boxes):
-                x1, y1, x2, y2 = safe_crop_box(box[:4], frame.shape)
-                confidence = float(confidences[i])
-                class_id = int(class_ids[i])
-                class_name = "apple" if class_id == 0 else f"object_{class_id}"
-                
-                detections.append({
-                    "box": [x1, y1, x2, y2],
-                    "class": class_name,
-                    "confidence": confidence,
-                    "timestamp": datetime.datetime.now().isoformat()
-                })
+        detections, version = await admission.run(STREAM, detect_objects, frame, scale, full_size)
         
         return {
             "detections": detections,
+            "model_version": version,
             "frame_count": frame_data.get("frame_count", 0),
             "timestamp": datetime.datetime.now().isoformat()
         }
-        
+    
+    except HTTPException:
+        raise
+    except Overloaded as e:
+        raise overloaded_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
 
+@app.get("/admin/admission", dependencies=[Depends(require_admin)])
+async def get_admission():
+    return admission.stats()
+
+@app.get("/admin/connections", dependencies=[Depends(require_admin)])
+async def get_connections():
+    return manager.stats()
+
+@app.get("/admin/classifier", dependencies=[Depends(require_admin)])
+async def get_classifier_stats():
+    classifier = classifiers.active()
+    if classifier is None:
+        raise HTTPException(status_code=503, detail="CNN model not available")
+    return classifier.stats()
+
+@app.delete("/admin/classifier/cache", dependencies=[Depends(require_admin)])
+async def clear_classifier_cache():
+    if crop_cache is None:
+        raise HTTPException(status_code=404, detail="Crop cache not enabled")
+    crop_cache.clear()
+    return crop_cache.stats()
+
+class ModelVersionRequest(BaseModel):
+    path: str
+    version: Optional[str] = None
+    promote: bool = True
+
+class PromoteRequest(BaseModel):
+    version: str
+
+def get_registry(kind: str):
+    registry = model_registries.get(kind)
+    if registry is None:
+        raise HTTPException(status_code=404, detail=f"Unknown model '{kind}'")
+    return registry
+
+@app.get("/admin/models", dependencies=[Depends(require_admin)])
+async def list_models():
+    return {kind: registry.status() for kind, registry in model_registries.items()}
+
+@app.post("/admin/models/{kind}/versions", status_code=202, dependencies=[Depends(require_admin)])
+async def add_model_version(kind: str, req: ModelVersionRequest):
+    """Load new weights in the background; they are promoted once warmed up unless promote is false."""
+    registry = get_registry(kind)
+    try:
+        path = weights_path(req.path)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        entry = registry.register(path, req.version, req.promote)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return entry.info()
+
+@app.post("/admin/models/{kind}/promote", dependencies=[Depends(require_admin)])
+async def promote_model_version(kind: str, req: PromoteRequest):
+    registry = get_registry(kind)
+    try:
+        registry.promote(req.version)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return registry.status()
+
+@app.post("/admin/models/{kind}/rollback", dependencies=[Depends(require_admin)])
+async def rollback_model_version(kind: str):
+    registry = get_registry(kind)
+    try:
+        registry.rollback()
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return registry.status()
+
+@app.get("/admin/memory", dependencies=[Depends(require_admin)])
+async def get_memory():
+    """RSS/PSS of this worker and its sibling workers, and how much of it is mapped weights."""
+    return memory_report()
+
+@app.get("/admin/pricing", dependencies=[Depends(require_admin)])
+async def get_pricing_rules():
+    return pricing_rules.status()
+
+@app.post("/admin/pricing/reload", dependencies=[Depends(require_admin)])
+async def reload_pricing_rules():
+    """Recompile every rule table now instead of waiting for the mtime check."""
+    loaded = pricing_rules.reload(force=True)
+    return dict(pricing_rules.status(), reloaded=loaded)
+
+@app.get("/admin/coalescing", dependencies=[Depends(require_admin)])
+async def get_coalescing_stats():
+    return {lookups.name: lookups.stats() for lookups in (milk_lookups, ngo_lookups)}
+
+@app.delete("/admin/coalescing", dependencies=[Depends(require_admin)])
+async def clear_coalescing_caches():
+    for lookups in (milk_lookups, ngo_lookups):
+        lookups.clear()
+    return {"cleared": [milk_lookups.name, ngo_lookups.name]}
+
+@app.get("/admin/jobs", dependencies=[Depends(require_admin)])
+async def get_job_stats():
+    return await asyncio.to_thread(jobs.stats)
+
+@app.get("/admin/events", dependencies=[Depends(require_admin)])
+async def get_event_log_stats():
+    return event_log.stats()
+
+@app.get("/admin/catalog", dependencies=[Depends(require_admin)])
+async def get_catalog_stats():
+    return catalog.stats()
+
+@app.post("/admin/catalog", dependencies=[Depends(require_admin)])
+async def upsert_catalog(request: Request):
+    """Add or replace SKUs. Body: {"rows": [{"sku", "category", "base_price", ...}]}; all or nothing."""
+    raw = await request.body()
+    try:
+        message = orjson.loads(raw) if orjson is not None else json.loads(raw)
+        catalog.upsert(message["rows"])
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise HTTPException(status_code=400, detail=f"Catalog not updated: {e}")
+    return catalog.stats()
+
+@app.post("/admin/catalog/reload", dependencies=[Depends(require_admin)])
+async def reload_catalog():
+    """Re-read the catalog file, replacing in-memory upserts."""
+    try:
+        catalog.reload()
+    except CatalogError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return catalog.stats()
+
+@app.get("/admin/inventory", dependencies=[Depends(require_admin)])
+async def get_inventory_stats():
+    return inventory.stats()
+
+@app.get("/admin/shelf-life", dependencies=[Depends(require_admin)])
+async def get_shelf_life_stats():
+    return forecaster.stats()
+
+@app.get("/admin/telemetry", dependencies=[Depends(require_admin)])
+async def get_telemetry_stats():
+    return telemetry.stats()
+
+@app.get("/admin/cpu", dependencies=[Depends(require_admin)])
+async def get_cpu_config():
+    return cpu_config.status()
+
+@app.get("/admin/mjpeg", dependencies=[Depends(require_admin)])
+async def get_mjpeg_stats():
+    return mjpeg.stats()
+
+@app.get("/admin/decode", dependencies=[Depends(require_admin)])
+async def get_decode_stats():
+    return decoder.stats()
+
+class ProfilingConfig(BaseModel):
+    sample_rate: Optional[float] = None
+    allow_header: Optional[bool] = None
+    use_torch: Optional[bool] = None
+    max_traces: Optional[int] = None
+
+@app.get("/admin/profiling", dependencies=[Depends(require_admin)])
+async def get_profiling():
+    return profiler.status()
+
+@app.post("/admin/profiling", dependencies=[Depends(require_admin)])
+async def configure_profiling(config: ProfilingConfig):
+    return profiler.configure(**config.dict())
+
+@app.get("/admin/profiling/traces/{name}", dependencies=[Depends(require_admin)])
+async def download_trace(name: str):
+    path = profiler.trace_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return FileResponse(path, filename=name)
+
 """ for resq cart -> route optimization to nearby ngo's"""
 
-load_dotenv()
 API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
 # Don't raise error if API key is not available - we'll provide mock data instead
 
@@ -604,16 +1144,27 @@ class RouteRequest(BaseModel):
     dest_lat: float
     dest_lng: float
 
+# Devices at the same store ask for the same coordinates; round them so their lookups coalesce and share the cache
+NGO_CACHE_TTL_S = float(os.getenv("NGO_CACHE_TTL_S", "300"))
+NGO_COORD_DECIMALS = int(os.getenv("NGO_COORD_DECIMALS", "4"))
+# Mock data served after an API error is not cached, so the next call retries the API
+ngo_lookups = SingleFlight("nearby_ngos", NGO_CACHE_TTL_S,
+                           cacheable=lambda result: "API error" not in result.get("note", ""))
+
 @app.post("/nearby-ngos")
-def nearby_ngos(loc: Location):
+async def nearby_ngos(loc: Location):
+    key = (round(loc.lat, NGO_COORD_DECIMALS), round(loc.lng, NGO_COORD_DECIMALS))
+    return await ngo_lookups.run(key, find_nearby_ngos, *key)
+
+def find_nearby_ngos(lat, lng):
     if not API_KEY:
         # Provide mock data when API key is not available
         mock_ngos = [
             {
                 "name": "Community Food Bank",
                 "address": "123 Main Street, Downtown",
-                "lat": loc.lat + 0.01,
-                "lng": loc.lng + 0.01,
+                "lat": lat + 0.01,
+                "lng": lng + 0.01,
                 "place_id": "mock_place_1",
                 "rating": 4.5,
                 "types": ["food", "charity"]
@@ -621,8 +1172,8 @@ def nearby_ngos(loc: Location):
             {
                 "name": "Hope Kitchen",
                 "address": "456 Oak Avenue, Westside",
-                "lat": loc.lat - 0.008,
-                "lng": loc.lng + 0.015,
+                "lat": lat - 0.008,
+                "lng": lng + 0.015,
                 "place_id": "mock_place_2",
                 "rating": 4.2,
                 "types": ["food", "charity"]
@@ -630,8 +1181,8 @@ def nearby_ngos(loc: Location):
             {
                 "name": "Second Harvest Food Bank",
                 "address": "789 Pine Street, Eastside",
-                "lat": loc.lat + 0.012,
-                "lng": loc.lng - 0.005,
+                "lat": lat + 0.012,
+                "lng": lng - 0.005,
                 "place_id": "mock_place_3",
                 "rating": 4.7,
                 "types": ["food", "charity"]
@@ -639,8 +1190,8 @@ def nearby_ngos(loc: Location):
             {
                 "name": "Neighborhood Pantry",
                 "address": "321 Elm Street, Northside",
-                "lat": loc.lat - 0.015,
-                "lng": loc.lng - 0.008,
+                "lat": lat - 0.015,
+                "lng": lng - 0.008,
                 "place_id": "mock_place_4",
                 "rating": 4.0,
                 "types": ["food", "charity"]
@@ -664,8 +1215,8 @@ def nearby_ngos(loc: Location):
             "locationRestriction": {
                 "circle": {
                     "center": {
-                        "latitude": loc.lat,
-                        "longitude": loc.lng
+                        "latitude": lat,
+                        "longitude": lng
                     },
                     "radius": 15000.0
                 }
@@ -701,8 +1252,8 @@ def nearby_ngos(loc: Location):
             {
                 "name": "Community Food Bank",
                 "address": "123 Main Street, Downtown",
-                "lat": loc.lat + 0.01,
-                "lng": loc.lng + 0.01,
+                "lat": lat + 0.01,
+                "lng": lng + 0.01,
                 "place_id": "mock_place_1",
                 "rating": 4.5,
                 "types": ["food", "charity"]
@@ -710,8 +1261,8 @@ def nearby_ngos(loc: Location):
             {
                 "name": "Hope Kitchen",
                 "address": "456 Oak Avenue, Westside",
-                "lat": loc.lat - 0.008,
-                "lng": loc.lng + 0.015,
+                "lat": lat - 0.008,
+                "lng": lng + 0.015,
                 "place_id": "mock_place_2",
                 "rating": 4.2,
                 "types": ["food", "charity"]
@@ -719,8 +1270,8 @@ def nearby_ngos(loc: Location):
             {
                 "name": "Second Harvest Food Bank",
                 "address": "789 Pine Street, Eastside",
-                "lat": loc.lat + 0.012,
-                "lng": loc.lng - 0.005,
+                "lat": lat + 0.012,
+                "lng": lng - 0.005,
                 "place_id": "mock_place_3",
                 "rating": 4.7,
                 "types": ["food", "charity"]
@@ -728,8 +1279,8 @@ def nearby_ngos(loc: Location):
             {
                 "name": "Neighborhood Pantry",
                 "address": "321 Elm Street, Northside",
-                "lat": loc.lat - 0.015,
-                "lng": loc.lng - 0.008,
+                "lat": lat - 0.015,
+                "lng": lng - 0.008,
                 "place_id": "mock_place_4",
                 "rating": 4.0,
                 "types": ["food", "charity"]
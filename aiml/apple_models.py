@@ -0,0 +1,110 @@
+""" The apple detector and spoilage classifier.
+
+    Both models are served from versioned registries (model_registry.py) so
+    new weights can be swapped in without a restart. Importing this module
+    only builds the registries; load_models() loads the cascade model and the
+    initial YOLO_MODEL_PATH / CNN_MODEL_PATH versions. The service calls it at
+    startup, job workers (job_handlers.py) on their first image or video job,
+    so a worker that only reprices never loads a model.
+"""
+import os
+
+import numpy as np
+import torch
+from torchvision import models, transforms
+from ultralytics import YOLO
+
+from crop_cache import CropCache
+from freshness import FreshnessClassifier, spoilage_head, load_small_model
+from model_registry import ModelRegistry
+from shared_weights import load_state_dict, share_module
+
+device = torch.device('cpu')
+MODEL_DIR = os.getenv("MODEL_DIR", 'models/trained')
+YOLO_MODEL_PATH = os.getenv("YOLO_MODEL_PATH", 'models/trained/yolo_apple.pt')
+CNN_MODEL_PATH = os.getenv("CNN_MODEL_PATH", 'models/trained/spoilage_cnn.pth')
+# Crops for the CNN come from the decoded frame, so keep more than YOLO's 640 px here
+DETECT_DECODE_SIDE = int(os.getenv("DETECT_DECODE_SIDE", "1280"))
+
+transform = transforms.Compose([
+    transforms.Resize((224, 224)),
+    transforms.ToTensor(),
+    transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+])
+
+# Shared by every classifier version; entries are keyed by model version
+small_model = None
+crop_cache = CropCache() if os.getenv("CROP_CACHE_ENABLED", "1") == "1" else None
+_loaded = False
+
+
+def weights_path(path):
+    """
+    Resolve a weights file named over the admin API: a file name in MODEL_DIR
+    or a path inside it. Weights files are unpickled when loaded, so anything
+    outside MODEL_DIR (an upload directory, say) raises ValueError.
+    """
+    root = os.path.realpath(MODEL_DIR)
+    candidate = path if os.path.dirname(path) else os.path.join(root, path)
+    resolved = os.path.realpath(candidate)
+    if os.path.commonpath([root, resolved]) != root or resolved == root:
+        raise ValueError(f"Weights must be a file in {MODEL_DIR}")
+    return resolved
+
+
+def load_detector(path, version):
+    detector = YOLO(path)
+    # Fuse conv+bn now rather than on first predict, so the mapped weights are the ones served
+    detector.model.fuse(verbose=False)
+    share_module(detector.model, f"yolo-{version}")
+    return detector
+
+
+def warm_detector(detector):
+    detector(np.zeros((640, 640, 3), dtype=np.uint8), conf=0.5, device='cpu', verbose=False)
+
+
+def load_classifier(path, version):
+    model = models.resnet50(weights=None)
+    model.fc = spoilage_head(model.fc.in_features)
+    load_state_dict(model, path, device)
+    model.eval()
+    # Batched crop scoring; cascades through a small model first when one is available
+    return FreshnessClassifier(
+        model.to(device), transform, device,
+        small_model=small_model,
+        cache=crop_cache,
+        model_version=f"spoilage_cnn@{version}"
+    )
+
+
+detectors = ModelRegistry("yolo", load_detector, warm_detector)
+classifiers = ModelRegistry("spoilage_cnn", load_classifier, lambda classifier: classifier.warmup())
+model_registries = {"yolo": detectors, "spoilage_cnn": classifiers}
+
+
+def load_models():
+    """Load the cascade model and the initial detector and classifier versions, once per process."""
+    global small_model, _loaded
+    if _loaded:
+        return
+    _loaded = True
+    small_model = load_small_model(device=device)
+
+    # Initialize models with error handling
+    try:
+        print("Loading YOLO model...")
+        detectors.register(YOLO_MODEL_PATH, background=False)
+    except Exception as e:
+        print(f"Error loading YOLO model: {e}")
+
+    try:
+        print("Loading CNN model...")
+        classifiers.register(CNN_MODEL_PATH, background=False)
+    except Exception as e:
+        print(f"Error loading CNN model: {e}")
+
+
+def model_version(yolo_version, cnn_version):
+    """Combined version id attached to responses, e.g. 'yolo@1a2b…+spoilage_cnn@3c4d…'."""
+    return f"yolo@{yolo_version}+spoilage_cnn@{cnn_version}"
@@ -1,69 +1,178 @@
+""" Edge client: detect apples locally, classify and price them on the service.
+
+    Runs as a pipeline of threads so the display never waits on the network:
+
+        capture  reads the camera (or a video file, paced at its fps)
+        detect   runs YOLO on the newest frame and JPEG-encodes the crops
+        request  sends all crops of a frame in one POST /predict_with_sensor/batch
+                 over a pooled keep-alive session (PipelineClient)
+        display  the main thread; shows every frame and draws the latest results
+
+    Each hand-off keeps only the newest item, so a slow stage skips frames
+    instead of queueing them. Boxes are drawn from the most recent answered
+    frame, which may be a frame or two behind the one on screen.
+
+    python archive/detect_predict.py [--source 0 | --source video.mp4] [--url http://localhost:8000]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
 import cv2
-import numpy as np
 from ultralytics import YOLO
-import requests
-from PIL import Image
-import io
-
-yolo_model = YOLO('models/yolo_apple.pt')
-
-url = 'http://localhost:8001/predict_with_sensor'
-
-cap = cv2.VideoCapture(0)
-if not cap.isOpened():
-    print("Error: Could not open webcam")
-    exit()
-
-while True:
-    ret, frame = cap.read()
-    if not ret:
-        print("Error: Could not read frame")
-        break
-
-    results = yolo_model(frame, conf=0.5, device='cpu')
-
-    for result in results:
-        boxes = result.boxes.xyxy.cpu().numpy()
-        for box in boxes:
-            x1, y1, x2, y2 = map(int, box[:4])
-            apple_crop = frame[y1:y2, x1:x2]
-            if apple_crop.size == 0:
-                continue
-
-            # Convert to PIL Image
-            apple_crop_rgb = cv2.cvtColor(apple_crop, cv2.COLOR_BGR2RGB)
-            pil_image = Image.fromarray(apple_crop_rgb)
-
-            img_byte_arr = io.BytesIO()
-            pil_image.save(img_byte_arr, format='JPEG')
-            img_byte_arr.seek(0)
-
-            try:
-                response = requests.post(url, files={'file': ('image.jpg', img_byte_arr, 'image/jpeg')})
-                if response.status_code == 200:
-                    result = response.json()
-                    prediction = result['prediction']
-                    confidence = result['confidence']
-                    sensor_data = result['sensor_data']
-                    pricing = result['pricing']
-                    
-                    color = (0, 255, 0) if prediction == 'freshapples' else (0, 0, 255)
-                    cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-                    text = f'{prediction} {confidence:.2f} | {pricing["action"]} ${pricing["price_usd"]:.2f}'
-                    if pricing['message']:
-                        text += f' | {pricing["message"]}'
-                    cv2.putText(frame, text, (x1, y1-10),
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.9, color, 2)
-                    print(f"Prediction: {prediction}, Confidence: {confidence:.2f}, "
-                          f"Sensor: {sensor_data}, Pricing: {pricing}")
-                else:
-                    print(f"FastAPI error: {response.status_code}")
-            except Exception as e:
-                print(f"Request error: {e}")
-
-    cv2.imshow('Apple Detection', frame)
-    if cv2.waitKey(1) & 0xFF == ord('q'):
-        break
-
-cap.release()
-cv2.destroyAllWindows()
\ No newline at end of file
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline import safe_crop_box
+from pipeline_client import PipelineClient, PipelineError, PIPELINE_URL
+
+
+class Latest:
+    """A one-item hand-off between threads: put() replaces, get() waits for something newer."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._item = None
+        self.closed = False
+
+    def put(self, item):
+        with self._cond:
+            self._seq += 1
+            self._item = item
+            self._cond.notify_all()
+
+    def get(self, after=0, timeout=None):
+        """(seq, item) once seq > after; (after, None) on timeout or close."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > after or self.closed, timeout)
+            if self._seq > after:
+                return self._seq, self._item
+            return after, None
+
+    def peek(self):
+        with self._cond:
+            return self._seq, self._item
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+def capture(cap, frames, is_file):
+    interval = 1.0 / (cap.get(cv2.CAP_PROP_FPS) or 30.0) if is_file else 0.0
+    next_at = time.perf_counter()
+    while not frames.closed:
+        ret, frame = cap.read()
+        if not ret:
+            print("End of stream" if is_file else "Error: Could not read frame")
+            break
+        if interval:
+            next_at += interval
+            time.sleep(max(0.0, next_at - time.perf_counter()))
+        frames.put(frame)
+    frames.close()
+
+
+def detect(model, conf, frames, batches):
+    seq = 0
+    while not frames.closed:
+        seq, frame = frames.get(seq, timeout=0.5)
+        if frame is None:
+            continue
+        boxes, crops = [], []
+        for box in model(frame, conf=conf, device='cpu', verbose=False)[0].boxes.xyxy.cpu().numpy():
+            x1, y1, x2, y2 = safe_crop_box(box[:4], frame.shape)
+            ok, jpeg = cv2.imencode('.jpg', frame[y1:y2, x1:x2])
+            if ok:
+                boxes.append((x1, y1, x2, y2))
+                crops.append(jpeg.tobytes())
+        batches.put((boxes, crops))
+    batches.close()
+
+
+def request(client, lot, store, batches, results):
+    seq = 0
+    while not batches.closed:
+        seq, batch = batches.get(seq, timeout=0.5)
+        if batch is None:
+            continue
+        boxes, crops = batch
+        if not crops:
+            results.put([])
+            continue
+        try:
+            response = client.classify_batch(crops, lot, store)
+        except PipelineError as e:
+            print(f"Request error: {e.status_code} {e.detail}")
+            continue
+        results.put(list(zip(boxes, response['results'])))
+        for result in response['results']:
+            print(f"Prediction: {result['prediction']}, Confidence: {result['confidence']:.2f}, "
+                  f"Sensor: {result['sensor_data']}, Pricing: {result['pricing']}")
+
+
+def draw(frame, detections):
+    for (x1, y1, x2, y2), result in detections:
+        prediction, pricing = result['prediction'], result['pricing']
+        color = (0, 255, 0) if prediction == 'freshapples' else (0, 0, 255)
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+        text = f'{prediction} {result["confidence"]:.2f} | {pricing["action"]} ${pricing["price_usd"]:.2f}'
+        if pricing['message']:
+            text += f' | {pricing["message"]}'
+        cv2.putText(frame, text, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, color, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detect apples locally and price them on the ResQCart service")
+    parser.add_argument('--source', default='0', help="camera index or video file path")
+    parser.add_argument('--url', default=PIPELINE_URL, help="service base URL")
+    parser.add_argument('--model', default='models/yolo_apple.pt')
+    parser.add_argument('--conf', type=float, default=0.5)
+    parser.add_argument('--lot', default=None)
+    parser.add_argument('--store', default=None)
+    args = parser.parse_args()
+
+    is_file = not args.source.isdigit()
+    cap = cv2.VideoCapture(args.source if is_file else int(args.source))
+    if not cap.isOpened():
+        print(f"Error: Could not open {'video file' if is_file else 'webcam'} {args.source}")
+        sys.exit(1)
+
+    model = YOLO(args.model)
+    client = PipelineClient(args.url, pool_size=2)
+    frames, batches, results = Latest(), Latest(), Latest()
+    threads = [
+        threading.Thread(target=capture, args=(cap, frames, is_file), name="capture", daemon=True),
+        threading.Thread(target=detect, args=(model, args.conf, frames, batches), name="detect", daemon=True),
+        threading.Thread(target=request, args=(client, args.lot, args.store, batches, results),
+                         name="request", daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+
+    seq = 0
+    while True:
+        seq, frame = frames.get(seq, timeout=0.5)
+        if frame is None:
+            if frames.closed:
+                break
+            continue
+        frame = frame.copy()
+        draw(frame, results.peek()[1] or [])
+        cv2.imshow('Apple Detection', frame)
+        if cv2.waitKey(1) & 0xFF == ord('q'):
+            break
+
+    frames.close()
+    for thread in threads:
+        thread.join(timeout=5)
+    cap.release()
+    client.close()
+    cv2.destroyAllWindows()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,64 +1,17 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException
-import requests
+import os
+import sys
 import random
 import math
 import datetime
 
-app = FastAPI()
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline_client import PipelineClient, PipelineError
 
-apple_predict_url = 'http://localhost:8000/predict'
+app = FastAPI()
 
-def simulate_apple_sensor_data(prediction, confidence):
-    if prediction == 'rottenapples':
-        ethylene = round(random.uniform(1.0, 10.0), 2)
-        temp = round(random.uniform(25.0, 30.0), 1)
-        humidity = round(random.uniform(70.0, 80.0), 1)
-    else:
-        ethylene = round(random.uniform(0.1, 1.0), 2)
-        temp = round(random.uniform(20.0, 25.0), 1)
-        humidity = round(random.uniform(60.0, 70.0), 1)
-    return {
-        'ethylene_ppm': ethylene,
-        'temperature_c': temp,
-        'humidity_percent': humidity
-    }
-
-def dynamic_apple_price_engine(prediction, confidence, sensor_data):
-    base_price = 1.00
-    if prediction == 'freshapples':
-        discount_percent = min(sensor_data['ethylene_ppm'] * 10, 10) if sensor_data['ethylene_ppm'] >= 0.2 else 0
-        price = round(base_price * (1 - discount_percent / 100), 2)
-        action = 'sell'
-        discount_applied = discount_percent > 0
-        message = None
-    else:
-        if confidence > 0.7 and sensor_data['ethylene_ppm'] > 5.0:
-            if sensor_data['ethylene_ppm'] < 7.5:
-                action = 'donate'
-                message = 'Donate to local food bank for community support.'
-                price = 0.00
-                discount_applied = False
-                discount_percent = 0
-            else:
-                action = 'dump'
-                message = 'Dispose of spoiled apple safely to prevent contamination.'
-                price = 0.00
-                discount_applied = False
-                discount_percent = 0
-        else:
-            discount_percent = 20 + (confidence - 0.5) * 100 * 0.6
-            discount_percent = min(discount_percent, 50)
-            price = round(base_price * (1 - discount_percent / 100), 2)
-            action = 'sell'
-            discount_applied = True
-            message = None
-    return {
-        'action': action,
-        'discount_applied': discount_applied,
-        'discount_percent': round(discount_percent, 1),
-        'price_usd': price,
-        'message': message
-    }
+# The apple pipeline runs in the main service (app.py); call it over a pooled connection
+pipeline_client = PipelineClient(os.getenv("PIPELINE_URL", "http://localhost:8000"))
 
 def simulate_milk_spoilage_data(sku):
     today = datetime.datetime(2025, 6, 29)  # Current date
@@ -178,24 +131,13 @@ async def predict_with_sensor(file: UploadFile = File(...)):
     contents = await file.read()
     
     try:
-        response = requests.post(apple_predict_url, files={'file': ('image.jpg', contents, 'image/jpeg')})
-        if response.status_code != 200:
-            raise HTTPException(status_code=response.status_code, detail="Error from predict endpoint")
-        result = response.json()
-        prediction = result['prediction']
-        confidence = result['confidence']
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Predict endpoint error: {str(e)}")
-    
-    sensor_data = simulate_apple_sensor_data(prediction, confidence)
-    pricing = dynamic_apple_price_engine(prediction, confidence, sensor_data)
-    
-    return {
-        'prediction': prediction,
-        'confidence': confidence,
-        'sensor_data': sensor_data,
-        'pricing': pricing
-    }
+        return await pipeline_client.predict_with_sensor(contents, file.content_type)
+    except PipelineError as e:
+        raise HTTPException(status_code=e.status_code, detail=f"Pipeline error: {e.detail}")
+
+@app.on_event("shutdown")
+def close_pipeline_client():
+    pipeline_client.close()
 
 @app.post("/predict_milk_spoilage")
 async def predict_milk_spoilage(sku: str = "whole_milk_1gal"):
@@ -0,0 +1,331 @@
+""" Benchmark harness for the AIML service.
+
+    Measures latency percentiles and frames/sec for /detect, /process_video_frame
+    and /ws/video against a running server, plus the pricing / milk engines
+    in-process. Results are written as JSON so two commits can be compared:
+
+        python benchmark.py --url http://localhost:8000 --concurrency 1 4 8
+        python benchmark.py --engines-only
+        python benchmark.py --compare bench_results/old.json bench_results/new.json
+"""
+import argparse
+import asyncio
+import base64
+import datetime
+import glob
+import json
+import os
+import platform
+import random
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import requests
+
+DATASET_DIR = 'dataset/Validation_data'
+RESULTS_DIR = 'bench_results'
+TARGETS = ['detect', 'process_video_frame', 'ws_video']
+# An answer slower than this counts as an error rather than hanging the worker
+WS_RECV_TIMEOUT_S = 60.0
+
+
+def load_dataset_frames(dataset_dir=DATASET_DIR):
+    """Load every validation image and re-encode it as JPEG bytes."""
+    frames = []
+    for path in sorted(glob.glob(os.path.join(dataset_dir, '*'))):
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is None:
+            print(f"Skipping unreadable image: {path}")
+            continue
+        ok, buf = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        if ok:
+            frames.append((os.path.basename(path), buf.tobytes()))
+    return frames
+
+
+def synthetic_frame(width, height, apples, seed=0, quality=90):
+    """
+    Draw a shelf-like background with `apples` red/green discs on it.
+    Deterministic for a given seed so runs are comparable.
+    """
+    rng = np.random.default_rng(seed)
+    frame = np.full((height, width, 3), (190, 200, 205), dtype=np.uint8)
+    frame += rng.integers(0, 20, size=frame.shape, dtype=np.uint8)
+    radius = max(8, min(width, height) // 12)
+    for _ in range(apples):
+        cx = int(rng.integers(radius, max(radius + 1, width - radius)))
+        cy = int(rng.integers(radius, max(radius + 1, height - radius)))
+        color = (30, 30, 200) if rng.random() < 0.7 else (40, 90, 60)
+        cv2.circle(frame, (cx, cy), radius, color, -1)
+        cv2.circle(frame, (cx - radius // 3, cy - radius // 3), radius // 5, (230, 230, 255), -1)
+    ok, buf = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buf.tobytes()
+
+
+def summarize(latencies, wall_time, errors, shed=0):
+    """Latency percentiles (ms) and throughput for one run. `shed` counts frames the server refused under load."""
+    lat = np.asarray(latencies, dtype=np.float64) * 1000.0
+    if lat.size == 0:
+        return {'requests': 0, 'errors': errors, 'shed': shed, 'fps': 0.0}
+    return {
+        'requests': int(lat.size),
+        'errors': errors,
+        'shed': shed,
+        'p50_ms': round(float(np.percentile(lat, 50)), 3),
+        'p95_ms': round(float(np.percentile(lat, 95)), 3),
+        'p99_ms': round(float(np.percentile(lat, 99)), 3),
+        'mean_ms': round(float(lat.mean()), 3),
+        'max_ms': round(float(lat.max()), 3),
+        'fps': round(lat.size / wall_time, 3) if wall_time > 0 else 0.0,
+    }
+
+
+def _run_http(url, frames, concurrency, requests_per_worker, send):
+    latencies = []
+    errors = 0
+    shed = 0
+    lock = threading.Lock()
+
+    def worker(worker_id):
+        nonlocal errors, shed
+        session = requests.Session()
+        local = []
+        local_errors = 0
+        local_shed = 0
+        for i in range(requests_per_worker):
+            name, payload = frames[(worker_id + i) % len(frames)]
+            start = time.perf_counter()
+            try:
+                res = send(session, url, payload, i)
+                if res.status_code == 503:
+                    local_shed += 1
+                    continue
+                if res.status_code != 200:
+                    local_errors += 1
+                    continue
+            except requests.RequestException:
+                local_errors += 1
+                continue
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+            errors += local_errors
+            shed += local_shed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    return summarize(latencies, time.perf_counter() - start, errors, shed)
+
+
+def _send_detect(session, url, payload, i):
+    return session.post(f"{url}/detect", files={'file': ('frame.jpg', payload, 'image/jpeg')}, timeout=60)
+
+
+def _send_video_frame(session, url, payload, i):
+    body = {'frame': base64.b64encode(payload).decode('ascii'), 'frame_count': i}
+    return session.post(f"{url}/process_video_frame", json=body, timeout=60)
+
+
+def _run_ws(url, frames, concurrency, requests_per_worker):
+    import websockets
+
+    ws_url = url.replace('http://', 'ws://').replace('https://', 'wss://') + '/ws/video'
+    encoded = [(name, base64.b64encode(payload).decode('ascii')) for name, payload in frames]
+
+    async def client(worker_id, latencies, counters):
+        async with websockets.connect(ws_url, max_size=None) as ws:
+            for i in range(requests_per_worker):
+                name, b64 = encoded[(worker_id + i) % len(encoded)]
+                start = time.perf_counter()
+                await ws.send(json.dumps({'type': 'frame', 'frame': b64, 'frame_count': i}))
+                # Skip control messages (and late answers to earlier frames) until this frame's answer arrives.
+                # A shed frame is answered with `throttle` instead of results.
+                try:
+                    while True:
+                        message = json.loads(await asyncio.wait_for(ws.recv(), WS_RECV_TIMEOUT_S))
+                        kind = message.get('type')
+                        if kind == 'error' or (kind in ('detection_results', 'throttle')
+                                               and message.get('frame_count', i) == i):
+                            break
+                except asyncio.TimeoutError:
+                    counters['errors'] += 1
+                    continue
+                if kind == 'error':
+                    counters['errors'] += 1
+                elif kind == 'throttle':
+                    counters['shed'] += 1
+                else:
+                    latencies.append(time.perf_counter() - start)
+
+    async def run():
+        latencies = []
+        counters = {'errors': 0, 'shed': 0}
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *(client(w, latencies, counters) for w in range(concurrency)),
+            return_exceptions=True
+        )
+        counters['errors'] += sum(1 for r in results if isinstance(r, Exception))
+        return summarize(latencies, time.perf_counter() - start, counters['errors'], counters['shed'])
+
+    return asyncio.run(run())
+
+
+def bench_endpoints(url, frames, concurrency_levels, requests_per_worker, targets):
+    results = []
+    for target in targets:
+        for concurrency in concurrency_levels:
+            print(f"Benchmarking {target} at concurrency={concurrency} ...")
+            if target == 'detect':
+                stats = _run_http(url, frames, concurrency, requests_per_worker, _send_detect)
+            elif target == 'process_video_frame':
+                stats = _run_http(url, frames, concurrency, requests_per_worker, _send_video_frame)
+            else:
+                stats = _run_ws(url, frames, concurrency, requests_per_worker)
+            stats.update({'target': target, 'concurrency': concurrency})
+            print(f"  {stats}")
+            results.append(stats)
+    return results
+
+
+def bench_engines(iterations):
+    """Time the apple and milk pricing paths in-process (no HTTP, no models)."""
+    # pricing.py has the engines without the service: no models, CPU config, job queue or web app
+    import pricing
+    from sku_catalog import catalog
+
+    rng = random.Random(1234)
+    apple_inputs = []
+    for _ in range(iterations):
+        prediction = rng.choice(['freshapples', 'rottenapples'])
+        confidence = rng.random()
+        box = [rng.uniform(0, 600) for _ in range(4)]
+        apple_inputs.append((prediction, confidence, box))
+
+    latencies = []
+    start = time.perf_counter()
+    for prediction, confidence, box in apple_inputs:
+        t0 = time.perf_counter()
+        sensor_data = pricing.simulate_apple_sensor_data(prediction, confidence, box)
+        pricing.dynamic_apple_price_engine(prediction, confidence, sensor_data)
+        latencies.append(time.perf_counter() - t0)
+    apple = summarize(latencies, time.perf_counter() - start, 0)
+    apple.update({'target': 'apple_price_engine', 'concurrency': 1})
+
+    skus = catalog.skus('milk')
+    latencies = []
+    start = time.perf_counter()
+    for i in range(iterations):
+        sku = skus[i % len(skus)]
+        t0 = time.perf_counter()
+        spoilage_data = pricing.simulate_milk_spoilage_data(sku)
+        prediction, probability = pricing._predict_milk_spoilage(spoilage_data)
+        context = pricing.milk_business_context(sku)
+        pricing.dynamic_milk_price_engine(prediction, probability, spoilage_data, context)
+        latencies.append(time.perf_counter() - t0)
+    milk = summarize(latencies, time.perf_counter() - start, 0)
+    milk.update({'target': 'milk_price_engine', 'concurrency': 1})
+
+    print(f"  {apple}\n  {milk}")
+    return [apple, milk]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except Exception:
+        return 'unknown'
+
+
+def compare(old_path, new_path, threshold):
+    """Print per-target deltas; returns True if any p95/fps regressed beyond threshold."""
+    with open(old_path) as f:
+        old = {(r['target'], r['concurrency']): r for r in json.load(f)['results']}
+    with open(new_path) as f:
+        new = {(r['target'], r['concurrency']): r for r in json.load(f)['results']}
+
+    regressed = False
+    print(f"{'target':<22}{'conc':>5}{'p95 old':>12}{'p95 new':>12}{'fps old':>10}{'fps new':>10}")
+    for key in sorted(set(old) & set(new)):
+        o, n = old[key], new[key]
+        if 'p95_ms' not in o or 'p95_ms' not in n:
+            continue
+        slower = n['p95_ms'] > o['p95_ms'] * (1 + threshold)
+        fewer = n['fps'] < o['fps'] * (1 - threshold)
+        flag = '  REGRESSION' if slower or fewer else ''
+        regressed = regressed or slower or fewer
+        print(f"{key[0]:<22}{key[1]:>5}{o['p95_ms']:>12.2f}{n['p95_ms']:>12.2f}{o['fps']:>10.2f}{n['fps']:>10.2f}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ResQCart AIML benchmark")
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--targets', nargs='+', default=TARGETS, choices=TARGETS)
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 4, 8])
+    parser.add_argument('--requests', type=int, default=20, help="requests per concurrent worker")
+    parser.add_argument('--dataset', default=DATASET_DIR)
+    parser.add_argument('--no-dataset', action='store_true', help="use only synthetic frames")
+    parser.add_argument('--synthetic', type=int, default=0, help="number of synthetic frames to add")
+    parser.add_argument('--size', default='1280x720', help="synthetic frame size WxH")
+    parser.add_argument('--apples', type=int, default=6, help="apples per synthetic frame")
+    parser.add_argument('--engine-iterations', type=int, default=2000)
+    parser.add_argument('--engines-only', action='store_true')
+    parser.add_argument('--skip-engines', action='store_true')
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    parser.add_argument('--threshold', type=float, default=0.10, help="allowed regression ratio")
+    args = parser.parse_args()
+
+    if args.compare:
+        raise SystemExit(1 if compare(args.compare[0], args.compare[1], args.threshold) else 0)
+
+    results = []
+    frames = []
+    if not args.engines_only:
+        if not args.no_dataset:
+            frames.extend(load_dataset_frames(args.dataset))
+        width, height = (int(v) for v in args.size.lower().split('x'))
+        for i in range(args.synthetic):
+            frames.append((f"synthetic_{i}", synthetic_frame(width, height, args.apples, seed=i)))
+        if not frames:
+            raise SystemExit("No frames to send: dataset empty and --synthetic is 0")
+        print(f"Loaded {len(frames)} frames")
+        results.extend(bench_endpoints(args.url, frames, args.concurrency, args.requests, args.targets))
+
+    if not args.skip_engines:
+        print("Benchmarking pricing engines ...")
+        results.extend(bench_engines(args.engine_iterations))
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'url': args.url,
+            'frames': len(frames),
+            'synthetic': {'count': args.synthetic, 'size': args.size, 'apples': args.apples},
+            'requests_per_worker': args.requests,
+        },
+        'results': results,
+    }
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{report['meta']['commit']}.json")
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
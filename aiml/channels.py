@@ -0,0 +1,127 @@
+""" Named camera channels.
+
+    A channel has at most one producer (a /ws/camera/{name}/publish socket,
+    or a server-side stream worker) and any number of subscribers. Each frame
+    is inferred once by the producer path and the result is published to every
+    subscriber, serialized once per wire format in use rather than once per
+    client. The last CHANNEL_REPLAY results are kept so late joiners get the
+    current state immediately. Producers that also publish the frame feed the
+    channel's annotated MJPEG output (mjpeg.py) when it has viewers.
+"""
+import os
+import time
+from collections import deque
+
+from mjpeg import AnnotatedFeed
+from serialization import ResultEncoder
+
+CHANNEL_REPLAY = int(os.getenv("CHANNEL_REPLAY", "1"))
+
+
+class CameraChannel:
+    def __init__(self, name, replay=CHANNEL_REPLAY):
+        self.name = name
+        self.producer = None                 # producer description, e.g. "websocket" or a stream URL
+        self.subscribers = {}                # id(websocket) -> (websocket, ResultEncoder)
+        self.replay = deque(maxlen=replay)   # (detections, frame_count, model_version)
+        self.feed = AnnotatedFeed()          # annotated JPEGs for /cameras/{name}/mjpeg viewers
+        self.frames = 0
+        self.last_published = None
+
+    def status(self):
+        return {
+            "name": self.name,
+            "producer": self.producer,
+            "subscribers": len(self.subscribers),
+            "mjpeg_viewers": self.feed.viewers,
+            "frames": self.frames,
+            "last_published": self.last_published,
+        }
+
+
+class ChannelRegistry:
+    def __init__(self, manager, class_label, mjpeg=None):
+        self.manager = manager
+        self.class_label = class_label
+        self.mjpeg = mjpeg
+        self.channels = {}
+
+    def get(self, name):
+        return self.channels.get(name)
+
+    def get_or_create(self, name):
+        channel = self.channels.get(name)
+        if channel is None:
+            channel = self.channels[name] = CameraChannel(name)
+        return channel
+
+    def claim_producer(self, name, producer):
+        """Register the producer for a channel; False if it already has one."""
+        channel = self.get_or_create(name)
+        if channel.producer is not None:
+            return False
+        channel.producer = producer
+        return True
+
+    def release_producer(self, name):
+        channel = self.channels.get(name)
+        if channel is None:
+            return
+        channel.producer = None
+        self._maybe_remove(channel)
+
+    async def subscribe(self, name, websocket, encoder: ResultEncoder):
+        channel = self.get_or_create(name)
+        channel.subscribers[id(websocket)] = (websocket, encoder)
+        schema = encoder.schema_message()
+        if schema is not None:
+            await self.manager.send_personal_message(schema, websocket, keep=True)
+        for detections, frame_count, model_version in channel.replay:
+            payload = encoder.encode_results(detections, frame_count, self.class_label, model_version)
+            await self.manager.send_personal_message(payload, websocket)
+
+    def unsubscribe(self, name, websocket):
+        channel = self.channels.get(name)
+        if channel is None:
+            return
+        channel.subscribers.pop(id(websocket), None)
+        self._maybe_remove(channel)
+
+    def add_viewer(self, name):
+        """Count an MJPEG viewer of a channel; returns the channel's annotated feed."""
+        channel = self.get_or_create(name)
+        channel.feed.viewers += 1
+        return channel.feed
+
+    def remove_viewer(self, name):
+        channel = self.channels.get(name)
+        if channel is None:
+            return
+        channel.feed.viewers = max(0, channel.feed.viewers - 1)
+        self._maybe_remove(channel)
+
+    def _maybe_remove(self, channel):
+        if channel.producer is None and not channel.subscribers and not channel.feed.viewers:
+            self.channels.pop(channel.name, None)
+
+    async def publish(self, name, detections, frame_count, model_version=None, frame=None):
+        """Fan one frame's result out to every subscriber of the channel (and its MJPEG viewers, given the frame)."""
+        channel = self.channels.get(name)
+        if channel is None:
+            return
+        channel.replay.append((detections, frame_count, model_version))
+        channel.frames += 1
+        channel.last_published = time.time()
+        if frame is not None and self.mjpeg is not None:
+            self.mjpeg.offer(channel.feed, frame, detections)
+
+        # Serialize once per (format, schema) in use, not once per subscriber
+        payloads = {}
+        for websocket, encoder in list(channel.subscribers.values()):
+            key = (encoder.fmt, encoder.schema)
+            if key not in payloads:
+                payloads[key] = encoder.encode_results(detections, frame_count, self.class_label, model_version)
+            await self.manager.send_personal_message(payloads[key], websocket)
+
+    def status(self):
+        return [channel.status() for channel in self.channels.values()]
@@ -0,0 +1,132 @@
+""" WebSocket connection manager.
+
+    Every client gets a bounded outgoing queue drained by its own writer task,
+    so sending never waits on a socket: a slow or stalled client only fills its
+    own queue, and once that is full its oldest droppable message is dropped.
+    Messages sent with keep=True (the one-time `schema` message) are never
+    dropped. Messages of a delta `chain` only make sense on top of the ones
+    before them, so dropping one drops the rest of that chain still queued
+    and calls chain.resync(), which makes the next result a keyframe.
+    Connections are kept in a dict, making connect/disconnect O(1), and a
+    broadcast costs one enqueue per client.
+"""
+import asyncio
+import os
+from collections import deque
+from typing import Dict
+
+from fastapi import WebSocket
+
+SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "32"))
+
+
+class _Client:
+    __slots__ = ("websocket", "pending", "ready", "writer", "dropped", "sent")
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.pending = deque()          # (message, keep, chain)
+        self.ready = asyncio.Event()    # set while pending is not empty
+        self.writer = None
+        self.dropped = 0
+        self.sent = 0
+
+
+class ConnectionManager:
+    def __init__(self, queue_size=SEND_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.active_connections: Dict[int, _Client] = {}
+        self.dropped_total = 0
+
+    async def connect(self, websocket: WebSocket):
+        await websocket.accept()
+        self.register(websocket)
+
+    def register(self, websocket: WebSocket):
+        """Start a writer for an already-accepted socket."""
+        client = _Client(websocket)
+        client.writer = asyncio.create_task(self._writer(client))
+        self.active_connections[id(websocket)] = client
+        return client
+
+    def disconnect(self, websocket: WebSocket):
+        client = self.active_connections.pop(id(websocket), None)
+        if client is not None and client.writer is not asyncio.current_task():
+            client.writer.cancel()
+
+    def _drop_oldest(self, client):
+        """
+        Drop the oldest droppable message, and the rest of its chain if it has
+        one. Returns (dropped anything, that message's chain).
+        """
+        for message, keep, chain in client.pending:
+            if not keep:
+                break
+        else:
+            return False, None
+        if chain is None:
+            client.pending.remove((message, keep, chain))
+            dropped = 1
+        else:
+            before = len(client.pending)
+            client.pending = deque(entry for entry in client.pending if entry[2] is not chain)
+            dropped = before - len(client.pending)
+            chain.resync()
+        client.dropped += dropped
+        self.dropped_total += dropped
+        return True, chain
+
+    def _enqueue(self, client, message, keep=False, chain=None):
+        if len(client.pending) >= self.queue_size:
+            # Slow consumer: make room by dropping what it can do without
+            made_room, dropped_chain = self._drop_oldest(client)
+            # The new message cannot go in either if nothing could be dropped, or if it builds on what just was
+            if (not made_room and not keep) or (chain is not None and dropped_chain is chain):
+                if chain is not None:
+                    chain.resync()
+                client.dropped += 1
+                self.dropped_total += 1
+                return
+        client.pending.append((message, keep, chain))
+        client.ready.set()
+
+    async def send_personal_message(self, message, websocket: WebSocket, keep=False, chain=None):
+        """
+        Queue a message for one client. `keep` messages are never dropped;
+        `chain` (a DeltaEncoder) marks a message that depends on the ones before it.
+        """
+        client = self.active_connections.get(id(websocket))
+        if client is not None:
+            self._enqueue(client, message, keep, chain)
+
+    async def broadcast(self, message):
+        for client in list(self.active_connections.values()):
+            self._enqueue(client, message)
+
+    async def _writer(self, client):
+        websocket = client.websocket
+        try:
+            while True:
+                if not client.pending:
+                    client.ready.clear()
+                    await client.ready.wait()
+                    continue
+                message, _, _ = client.pending.popleft()
+                if isinstance(message, bytes):
+                    await websocket.send_bytes(message)
+                else:
+                    await websocket.send_text(message)
+                client.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Socket is gone; stop writing and forget the client
+            self.disconnect(websocket)
+
+    def stats(self):
+        return {
+            "connections": len(self.active_connections),
+            "queue_size": self.queue_size,
+            "queued": sum(len(c.pending) for c in self.active_connections.values()),
+            "dropped_total": self.dropped_total,
+        }
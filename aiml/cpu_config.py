@@ -0,0 +1,203 @@
+""" CPU topology-aware thread configuration.
+
+    Torch intra-op threads, OpenCV's thread pool and uvicorn workers all
+    default to "every core", so several workers (each with an inference pool
+    and a decode pool) oversubscribe the machine. apply() runs once per
+    process before any model is loaded, in every web worker and every job
+    worker (jobs.py), and splits the usable cores between them:
+
+        usable cores      = CPU affinity mask, capped by the cgroup CPU quota
+        workers           = web workers + JOB_WORKERS
+        cores per worker  = usable // workers
+        torch threads     = cores per worker // INFERENCE_SLOTS (1 in a job worker)
+        OpenCV threads    = cores per worker // DECODE_THREADS
+
+    The web worker count is WEB_CONCURRENCY when set, else the --workers /
+    -w option on the command line of the uvicorn or gunicorn process that
+    started this one (Linux only; elsewhere set WEB_CONCURRENCY). TORCH_THREADS,
+    TORCH_INTEROP_THREADS and CV2_THREADS override the computed values. With
+    CPU_AFFINITY=1 each process claims a slot index (via a lock file, so
+    siblings never pick the same one) and pins itself to its own block of
+    cores: web workers take slots 0..web-1, job workers the ones after them.
+    cpu_sweep.py finds the best split for a given box.
+"""
+import math
+import os
+import tempfile
+
+import cv2
+import torch
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; pinning is then skipped
+    fcntl = None
+
+
+def _read(path):
+    with open(path) as f:
+        return f.read().strip()
+
+
+def cgroup_cpu_limit():
+    """Whole CPUs allowed by the cgroup quota (v2 or v1), or None if unlimited."""
+    try:
+        quota, period = _read('/sys/fs/cgroup/cpu.max').split()
+        if quota != 'max':
+            return max(1, math.ceil(int(quota) / int(period)))
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        quota = int(_read('/sys/fs/cgroup/cpu/cpu.cfs_quota_us'))
+        period = int(_read('/sys/fs/cgroup/cpu/cpu.cfs_period_us'))
+        if quota > 0:
+            return max(1, math.ceil(quota / period))
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def allowed_cpus():
+    """Core ids this process may run on."""
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+WEB = "web"
+JOB = "job"
+# Set by a web worker for the job workers it spawns, so both key their slot locks on the same server
+CPU_GROUP_ENV = "RESQCART_CPU_GROUP"
+
+
+def _option_value(args, names):
+    """Value of the first `--name N`, `--name=N` or `-w N` style option in an argv list, or None."""
+    for i, arg in enumerate(args):
+        for name in names:
+            if arg == name and i + 1 < len(args):
+                return args[i + 1]
+            if arg.startswith(name + "="):
+                return arg[len(name) + 1:]
+    return None
+
+
+def server_workers(pid=None):
+    """Worker count from the uvicorn / gunicorn command line of process `pid` (the parent by default), or None."""
+    pid = pid or os.getppid()
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            args = [a.decode(errors="replace") for a in f.read().split(b"\0") if a]
+    except OSError:
+        return None
+    if not any(server in arg for arg in args[:3] for server in ("uvicorn", "gunicorn")):
+        return None
+    value = _option_value(args, ("--workers", "-w"))
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def web_workers():
+    """WEB_CONCURRENCY, else the server's --workers option, else 1."""
+    return max(1, _env_int("WEB_CONCURRENCY", 0) or server_workers() or 1)
+
+
+class CpuConfig:
+    def __init__(self):
+        self.applied = None
+        self._slot_lock = None   # held open for the life of the worker
+
+    def plan(self, role=WEB):
+        """Compute the thread split for a web or job worker without changing anything."""
+        cpus = allowed_cpus()
+        limit = cgroup_cpu_limit()
+        usable = min(len(cpus), limit) if limit else len(cpus)
+        web = web_workers()
+        jobs = max(0, _env_int("JOB_WORKERS", 1))
+        workers = web + jobs
+        # A job worker runs one job at a time
+        slots = max(1, _env_int("INFERENCE_SLOTS", 1)) if role == WEB else 1
+        decode_threads = max(1, _env_int("DECODE_THREADS", 2))
+        per_worker = max(1, usable // workers)
+        return {
+            "role": role,
+            "cpus": cpus,
+            "cgroup_limit": limit,
+            "usable": usable,
+            "web_workers": web,
+            "job_workers": jobs,
+            "workers": workers,
+            "cores_per_worker": per_worker,
+            "torch_threads": _env_int("TORCH_THREADS", max(1, per_worker // slots)),
+            "torch_interop_threads": _env_int("TORCH_INTEROP_THREADS", 1),
+            "cv2_threads": _env_int("CV2_THREADS", max(1, per_worker // decode_threads)),
+            "pin": os.getenv("CPU_AFFINITY", "0") == "1",
+        }
+
+    def _claim_slot(self, slots):
+        """Lowest index in `slots` not held by a sibling process, or None."""
+        if fcntl is None:
+            return None
+        group = os.getenv(CPU_GROUP_ENV) or str(os.getppid())
+        for index in slots:
+            path = os.path.join(tempfile.gettempdir(), f"resqcart-cpu-{group}-{index}.lock")
+            handle = open(path, 'w')
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close()
+                continue
+            self._slot_lock = handle
+            return index
+        return None
+
+    def apply(self, role=WEB):
+        plan = self.plan(role)
+        if role == WEB:
+            # Job workers this process spawns inherit both, so they see the same server and its worker count
+            os.environ.setdefault(CPU_GROUP_ENV, str(os.getppid()))
+            os.environ.setdefault("WEB_CONCURRENCY", str(plan["web_workers"]))
+        pinned = None
+        if plan["pin"] and hasattr(os, "sched_setaffinity"):
+            web = plan["web_workers"]
+            index = self._claim_slot(range(web) if role == WEB else range(web, plan["workers"]))
+            if index is not None:
+                per_worker = plan["cores_per_worker"]
+                cores = plan["cpus"][index * per_worker:(index + 1) * per_worker]
+                if cores:
+                    os.sched_setaffinity(0, cores)
+                    pinned = {"worker_index": index, "cores": cores}
+
+        torch.set_num_threads(plan["torch_threads"])
+        try:
+            torch.set_num_interop_threads(plan["torch_interop_threads"])
+        except RuntimeError:
+            # Only settable before torch has started any inter-op work
+            pass
+        cv2.setNumThreads(plan["cv2_threads"])
+
+        plan.update({
+            "pinned": pinned,
+            "torch_threads_effective": torch.get_num_threads(),
+            "torch_interop_threads_effective": torch.get_num_interop_threads(),
+            "cv2_threads_effective": cv2.getNumThreads(),
+        })
+        self.applied = plan
+        print(f"CPU config ({role}): {plan['usable']} usable cores, {plan['web_workers']} web + "
+              f"{plan['job_workers']} job worker(s), "
+              f"torch={plan['torch_threads']} cv2={plan['cv2_threads']} pinned={pinned is not None}")
+        return plan
+
+    def status(self):
+        return self.applied if self.applied is not None else self.plan()
+
+
+cpu_config = CpuConfig()
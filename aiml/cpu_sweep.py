@@ -0,0 +1,156 @@
+""" Sweep worker / thread splits to find the best CPU configuration for a box.
+
+    For every combination of uvicorn workers, inference slots and torch
+    threads per slot that fits the usable cores alongside the job workers the
+    service also starts (JOB_WORKERS, each running one job on TORCH_THREADS
+    threads; --job-workers overrides it), start the service with that
+    configuration, benchmark it with the same images as benchmark.py, and
+    rank the results by throughput (p95 latency as tie-breaker):
+
+        python cpu_sweep.py --workers 1 2 4 --slots 1 2 --threads 1 2 4 --synthetic 10
+        python cpu_sweep.py --pin --target process_video_frame --concurrency 8
+
+    The crop cache is disabled in the servers under test so repeated images
+    measure inference rather than cache hits. The winning environment is
+    printed ready to paste into .env.
+"""
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+
+import requests
+
+from benchmark import (DATASET_DIR, RESULTS_DIR, bench_endpoints, git_commit,
+                       load_dataset_frames, synthetic_frame)
+from cpu_config import allowed_cpus, cgroup_cpu_limit
+
+
+def usable_cores():
+    limit = cgroup_cpu_limit()
+    cpus = len(allowed_cpus())
+    return min(cpus, limit) if limit else cpus
+
+
+def configurations(workers, slots, threads, job_workers, cores, oversubscribe):
+    for w in workers:
+        for s in slots:
+            for t in threads:
+                # Job workers run one job at a time, each on TORCH_THREADS threads too
+                if not oversubscribe and (w * s + job_workers) * t > cores:
+                    continue
+                yield {"workers": w, "slots": s, "threads": t, "job_workers": job_workers}
+
+
+def start_server(config, port, pin):
+    env = dict(os.environ)
+    env.update({
+        "WEB_CONCURRENCY": str(config["workers"]),
+        "INFERENCE_SLOTS": str(config["slots"]),
+        "TORCH_THREADS": str(config["threads"]),
+        "JOB_WORKERS": str(config["job_workers"]),
+        "CPU_AFFINITY": "1" if pin else "0",
+        "CROP_CACHE_ENABLED": "0",
+    })
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1",
+         "--port", str(port), "--workers", str(config["workers"])],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def wait_ready(url, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{url}/", timeout=2).json().get("status", {}).get("yolo_model_loaded"):
+                return True
+        except (requests.RequestException, ValueError):
+            pass
+        time.sleep(1)
+    return False
+
+
+def main():
+    cores = usable_cores()
+    parser = argparse.ArgumentParser(description="Find the best worker/thread split for this machine")
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 2, 4])
+    parser.add_argument('--slots', nargs='+', type=int, default=[1, 2])
+    parser.add_argument('--threads', nargs='+', type=int, default=sorted({1, 2, 4, cores}))
+    parser.add_argument('--job-workers', type=int, default=max(0, int(os.getenv("JOB_WORKERS", "1"))),
+                        help="job worker processes each server starts (counted against the cores)")
+    parser.add_argument('--oversubscribe', action='store_true', help="also try splits using more threads than cores")
+    parser.add_argument('--pin', action='store_true', help="pin each worker to its own cores (CPU_AFFINITY=1)")
+    parser.add_argument('--target', default='detect', choices=['detect', 'process_video_frame', 'ws_video'])
+    parser.add_argument('--concurrency', type=int, default=None, help="defaults to twice the usable cores")
+    parser.add_argument('--requests', type=int, default=10, help="requests per concurrent client")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--startup-timeout', type=float, default=180)
+    parser.add_argument('--dataset', default=DATASET_DIR)
+    parser.add_argument('--synthetic', type=int, default=0)
+    parser.add_argument('--size', default='1280x720')
+    parser.add_argument('--apples', type=int, default=6)
+    args = parser.parse_args()
+
+    frames = load_dataset_frames(args.dataset)
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    frames.extend((f"synthetic_{i}", synthetic_frame(width, height, args.apples, seed=i))
+                  for i in range(args.synthetic))
+    if not frames:
+        raise SystemExit("No frames to send: dataset empty and --synthetic is 0")
+
+    concurrency = args.concurrency or 2 * cores
+    url = f"http://127.0.0.1:{args.port}"
+    print(f"{cores} usable cores, {args.job_workers} job workers, {len(frames)} frames, concurrency {concurrency}")
+
+    results = []
+    for config in configurations(args.workers, args.slots, args.threads, args.job_workers, cores,
+                                 args.oversubscribe):
+        print(f"Trying {config} ...")
+        server = start_server(config, args.port, args.pin)
+        try:
+            if not wait_ready(url, args.startup_timeout):
+                print("  server did not become ready, skipping")
+                continue
+            stats = bench_endpoints(url, frames, [concurrency], args.requests, [args.target])[0]
+            stats.update(config)
+            results.append(stats)
+        finally:
+            server.terminate()
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    if not results:
+        raise SystemExit("No configuration completed")
+
+    results.sort(key=lambda r: (-r.get('fps', 0.0), r.get('p95_ms', float('inf'))))
+    print(f"\n{'workers':>8}{'slots':>7}{'threads':>9}{'fps':>10}{'p95 ms':>10}{'errors':>8}{'shed':>7}")
+    for r in results:
+        print(f"{r['workers']:>8}{r['slots']:>7}{r['threads']:>9}{r.get('fps', 0.0):>10.2f}"
+              f"{r.get('p95_ms', float('nan')):>10.1f}{r['errors']:>8}{r.get('shed', 0):>7}")
+
+    best = results[0]
+    print("\nBest configuration:")
+    print(f"WEB_CONCURRENCY={best['workers']}\nINFERENCE_SLOTS={best['slots']}\nTORCH_THREADS={best['threads']}\n"
+          f"JOB_WORKERS={best['job_workers']}")
+    if args.pin:
+        print("CPU_AFFINITY=1")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    output = os.path.join(RESULTS_DIR, f"cpu-sweep-{stamp}-{git_commit()}.json")
+    with open(output, 'w') as f:
+        json.dump({'meta': {'cores': cores, 'job_workers': args.job_workers, 'target': args.target,
+                            'concurrency': concurrency,
+                            'pinned': args.pin, 'frames': len(frames)},
+                   'results': results}, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
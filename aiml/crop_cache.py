@@ -0,0 +1,111 @@
+""" Crop-level classification cache.
+
+    The same apples are seen again and again: frame after frame of a stream,
+    and repeated /detect calls on the same shelf. Crops are keyed by a small
+    perceptual hash (a difference hash of the grey thumbnail plus the
+    quantized mean colour, since freshness is mostly a colour question) and the
+    model version, and the CNN's sigmoid score is cached in a bounded LRU.
+
+    Tolerance is set by CROP_CACHE_HASH_SIZE (a smaller thumbnail hashes more
+    crops together), CROP_CACHE_COLOR_STEP (mean-colour bucket width) and
+    CROP_CACHE_MAX_DISTANCE (0 for exact hash matches, 1 to also accept hashes
+    one bit away). Memory is capped by entry count and by estimated bytes.
+"""
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+CROP_CACHE_ENTRIES = int(os.getenv("CROP_CACHE_ENTRIES", "4096"))
+CROP_CACHE_MAX_BYTES = int(os.getenv("CROP_CACHE_MAX_BYTES", str(4 * 1024 * 1024)))
+CROP_CACHE_HASH_SIZE = int(os.getenv("CROP_CACHE_HASH_SIZE", "8"))
+CROP_CACHE_COLOR_STEP = int(os.getenv("CROP_CACHE_COLOR_STEP", "16"))
+CROP_CACHE_MAX_DISTANCE = int(os.getenv("CROP_CACHE_MAX_DISTANCE", "0"))
+
+
+def crop_hash(crop, hash_size=CROP_CACHE_HASH_SIZE, color_step=CROP_CACHE_COLOR_STEP):
+    """(difference hash, quantized mean colour) for a uint8 HxWx3 crop."""
+    small = cv2.resize(crop, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    gray = small.mean(axis=2)
+    bits = (gray[:, 1:] > gray[:, :-1]).ravel()
+    dhash = int.from_bytes(np.packbits(bits).tobytes(), 'big')
+    color = tuple(int(c) // color_step for c in small.reshape(-1, 3).mean(axis=0))
+    return dhash, color
+
+
+class CropCache:
+    def __init__(self, max_entries=CROP_CACHE_ENTRIES, max_bytes=CROP_CACHE_MAX_BYTES,
+                 hash_size=CROP_CACHE_HASH_SIZE, color_step=CROP_CACHE_COLOR_STEP,
+                 max_distance=CROP_CACHE_MAX_DISTANCE):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hash_size = hash_size
+        self.color_step = color_step
+        self.max_distance = max_distance
+        self._entries = OrderedDict()   # key -> (score, bytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, crop, model_version):
+        dhash, color = crop_hash(crop, self.hash_size, self.color_step)
+        return (model_version, dhash, color)
+
+    def _neighbours(self, key):
+        yield key
+        if self.max_distance >= 1:
+            version, dhash, color = key
+            for bit in range(self.hash_size * self.hash_size):
+                yield (version, dhash ^ (1 << bit), color)
+
+    def get(self, key):
+        """Cached score for a key (or a tolerated neighbour of it), else None."""
+        with self._lock:
+            for candidate in self._neighbours(key):
+                entry = self._entries.get(candidate)
+                if entry is not None:
+                    self._entries.move_to_end(candidate)
+                    self.hits += 1
+                    return entry[0]
+            self.misses += 1
+            return None
+
+    def put(self, key, score):
+        size = sys.getsizeof(key) + sys.getsizeof(key[1]) + sys.getsizeof(key[2]) + sys.getsizeof(score) + 64
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (score, size)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "hash_size": self.hash_size,
+                "color_step": self.color_step,
+                "max_distance": self.max_distance,
+            }
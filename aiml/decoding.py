@@ -0,0 +1,198 @@
+""" Frame decode stage.
+
+    Every inference path shrinks its input to 640 px anyway, so decoding a 4K
+    JPEG at full resolution is wasted work. The decoder reads the JPEG header
+    to get the source size, picks the strongest DCT-domain reduction
+    (IMREAD_REDUCED_COLOR_2/4/8, or libjpeg-turbo scaling when
+    DECODE_BACKEND=turbojpeg and PyTurboJPEG is installed) that still covers
+    the target size, and runs the decode on a dedicated thread pool
+    (cv2.imdecode releases the GIL). Per-scale timings are kept so the savings
+    can be reported at /admin/decode.
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+DECODE_THREADS = int(os.getenv("DECODE_THREADS", "2"))
+DECODE_BACKEND = os.getenv("DECODE_BACKEND", "opencv")
+# Every Nth reduced decode is also timed at full size to measure the savings (0 = never)
+DECODE_CALIBRATE_EVERY = int(os.getenv("DECODE_CALIBRATE_EVERY", "100"))
+
+# (scale factor, cv2 flag), strongest reduction first
+REDUCED_DECODE_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+]
+
+# How the consumer shrinks the decoded frame:
+#   'stretch'   - resized to exactly target (w, h), both sides must stay covered
+#   'letterbox' - long side scaled to max(target), only the long side must stay covered
+STRETCH = 'stretch'
+LETTERBOX = 'letterbox'
+
+
+def jpeg_size(data):
+    """(width, height) from a JPEG's SOF header without decoding it, or None."""
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    i = 2
+    n = len(data)
+    while i + 9 < n:
+        if data[i] != 0xFF:
+            i += 1
+            continue
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 2
+            continue
+        # SOF0..SOF15, excluding DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = (data[i + 5] << 8) | data[i + 6]
+            width = (data[i + 7] << 8) | data[i + 8]
+            return width, height
+        i += 2 + ((data[i + 2] << 8) | data[i + 3])
+    return None
+
+
+def oriented_size(full_size, frame, factor):
+    """
+    The header size in the orientation of the decoded frame. cv2.imdecode applies
+    EXIF rotation, which the SOF header does not reflect, so a portrait phone
+    photo stored as landscape comes back transposed.
+    """
+    width, height = full_size
+    expected = (-(-height // factor), -(-width // factor))    # (rows, cols), rounded up as libjpeg does
+    if frame.shape[:2] != expected and frame.shape[:2] == expected[::-1]:
+        return height, width
+    return full_size
+
+
+def reduction_factor(full_size, target_size, fit=STRETCH):
+    """Largest power-of-two reduction whose output still covers target_size."""
+    if full_size is None or target_size is None:
+        return 1
+    width, height = full_size
+    target_w, target_h = target_size
+    for factor, _ in REDUCED_DECODE_FLAGS:
+        if fit == LETTERBOX:
+            if max(width, height) // factor >= max(target_w, target_h):
+                return factor
+        elif width // factor >= target_w and height // factor >= target_h:
+            return factor
+    return 1
+
+
+class _TurboBackend:
+    def __init__(self):
+        from turbojpeg import TurboJPEG, TJPF_BGR
+        self.jpeg = TurboJPEG()
+        self.pixel_format = TJPF_BGR
+
+    def decode(self, data, factor):
+        return self.jpeg.decode(bytes(data), pixel_format=self.pixel_format, scaling_factor=(1, factor))
+
+
+class FrameDecoder:
+    def __init__(self, threads=DECODE_THREADS, backend=DECODE_BACKEND, calibrate_every=DECODE_CALIBRATE_EVERY):
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="decode")
+        self.turbo = None
+        if backend == "turbojpeg":
+            try:
+                self.turbo = _TurboBackend()
+                print("Using libjpeg-turbo decode backend")
+            except Exception as e:
+                print(f"turbojpeg backend unavailable, using OpenCV: {e}")
+        self._lock = threading.Lock()
+        # factor -> [frames, decode ms, source megapixels]
+        self._stats = {}
+        # full-size reference decodes: [frames, decode ms, source megapixels]
+        self.calibrate_every = calibrate_every
+        self._calibration = [0, 0.0, 0.0]
+        self._reduced_count = 0
+
+    def decode(self, data, target_size=None, fit=STRETCH):
+        """
+        Decode image bytes, reduced where possible. Returns (frame, factor, full_size);
+        frame is None if the bytes cannot be decoded. Multiply coordinates found
+        on the returned frame by `factor` to map them back to the source image.
+        """
+        full_size = jpeg_size(data)
+        factor = reduction_factor(full_size, target_size, fit)
+        started = time.perf_counter()
+        if self.turbo is not None and full_size is not None:
+            try:
+                frame = self.turbo.decode(data, factor)
+            except Exception:
+                frame = None
+        else:
+            flag = dict(REDUCED_DECODE_FLAGS).get(factor, cv2.IMREAD_COLOR)
+            frame = cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        if frame is None:
+            return None, factor, full_size
+        if full_size is None:
+            full_size = (frame.shape[1] * factor, frame.shape[0] * factor)
+        else:
+            full_size = oriented_size(full_size, frame, factor)
+        megapixels = full_size[0] * full_size[1] / 1e6
+        with self._lock:
+            entry = self._stats.setdefault(factor, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += elapsed_ms
+            entry[2] += megapixels
+            if factor != 1:
+                self._reduced_count += 1
+            calibrate = (factor != 1 and self.calibrate_every > 0
+                         and self._reduced_count % self.calibrate_every == 1)
+        if calibrate:
+            self._calibrate(data, megapixels)
+        return frame, factor, full_size
+
+    def _calibrate(self, data, megapixels):
+        started = time.perf_counter()
+        cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._calibration[0] += 1
+            self._calibration[1] += elapsed_ms
+            self._calibration[2] += megapixels
+
+    async def decode_async(self, data, target_size=None, fit=STRETCH):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.decode, data, target_size, fit)
+
+    def stats(self):
+        """Per-scale decode cost, and the time saved versus full decodes (when measured)."""
+        with self._lock:
+            snapshot = {factor: list(entry) for factor, entry in self._stats.items()}
+            calibration = list(self._calibration)
+        by_scale = {}
+        for factor, (frames, total_ms, megapixels) in sorted(snapshot.items()):
+            by_scale[f"1/{factor}"] = {
+                "frames": frames,
+                "mean_ms": round(total_ms / frames, 3),
+                "ms_per_source_mp": round(total_ms / megapixels, 3) if megapixels else None,
+            }
+        report = {"backend": "turbojpeg" if self.turbo else "opencv", "by_scale": by_scale}
+        # Full-decode cost per source megapixel, from real full decodes plus calibration samples
+        full = snapshot.get(1, [0, 0.0, 0.0])
+        full_ms, full_mp = full[1] + calibration[1], full[2] + calibration[2]
+        if full_mp > 0:
+            full_rate = full_ms / full_mp
+            report["full_ms_per_source_mp"] = round(full_rate, 3)
+            saved = sum(full_rate * mp - ms for factor, (_, ms, mp) in snapshot.items() if factor != 1)
+            report["estimated_saved_ms"] = round(saved, 1)
+        return report
+
+
+decoder = FrameDecoder()
@@ -0,0 +1,264 @@
+""" Append-only event log for detections and pricing decisions.
+
+    Request handlers call record(), which only appends the event to an
+    in-memory list. A background thread drains that list every
+    EVENT_LOG_FLUSH_INTERVAL_S, serializes the batch to NDJSON and appends
+    it to the current segment as one gzip member, so a crash loses at most
+    the unflushed batch and every segment stays readable with gzip.open
+    while it grows. Segments are rotated by compressed size
+    (EVENT_LOG_SEGMENT_BYTES) and age (EVENT_LOG_SEGMENT_AGE_S); only the
+    newest EVENT_LOG_RETAIN_SEGMENTS in the directory are kept, whichever
+    process wrote them, except that the segment a live writer is appending
+    to is never deleted.
+
+    Segment names carry their start time and the writer's pid, so several
+    workers can share EVENT_LOG_DIR. query() reads only segments that
+    overlap the requested time range, newest first. When more than
+    EVENT_LOG_MAX_PENDING events are waiting, new ones are dropped and
+    counted instead of growing memory.
+"""
+import atexit
+import glob
+import gzip
+import json
+import os
+import threading
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+EVENT_LOG_ENABLED = os.getenv("EVENT_LOG_ENABLED", "1") == "1"
+EVENT_LOG_DIR = os.getenv("EVENT_LOG_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "events"))
+EVENT_LOG_FLUSH_INTERVAL_S = float(os.getenv("EVENT_LOG_FLUSH_INTERVAL_S", "1.0"))
+EVENT_LOG_MAX_PENDING = int(os.getenv("EVENT_LOG_MAX_PENDING", "100000"))
+EVENT_LOG_SEGMENT_BYTES = int(os.getenv("EVENT_LOG_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+EVENT_LOG_SEGMENT_AGE_S = float(os.getenv("EVENT_LOG_SEGMENT_AGE_S", "3600"))
+EVENT_LOG_RETAIN_SEGMENTS = int(os.getenv("EVENT_LOG_RETAIN_SEGMENTS", "168"))
+EVENT_LOG_COMPRESSLEVEL = int(os.getenv("EVENT_LOG_COMPRESSLEVEL", "6"))
+
+
+def _dumps(event):
+    if orjson is not None:
+        return orjson.dumps(event, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(event, default=lambda o: o.item() if hasattr(o, 'item') else str(o)).encode()
+
+
+def _loads(line):
+    return orjson.loads(line) if orjson is not None else json.loads(line)
+
+
+def segment_start(path):
+    """Start time encoded in a segment name (events-<start_ms>-<pid>.ndjson.gz)."""
+    try:
+        return int(os.path.basename(path).split('-')[1]) / 1000.0
+    except (IndexError, ValueError):
+        return 0.0
+
+
+def segment_pid(path):
+    """Writer pid encoded in a segment name, or None."""
+    try:
+        return int(os.path.basename(path).split('-')[2].split('.')[0])
+    except (IndexError, ValueError):
+        return None
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class EventLog:
+    def __init__(self, directory=EVENT_LOG_DIR, enabled=EVENT_LOG_ENABLED,
+                 flush_interval_s=EVENT_LOG_FLUSH_INTERVAL_S, max_pending=EVENT_LOG_MAX_PENDING,
+                 segment_bytes=EVENT_LOG_SEGMENT_BYTES, segment_age_s=EVENT_LOG_SEGMENT_AGE_S,
+                 retain_segments=EVENT_LOG_RETAIN_SEGMENTS):
+        self.directory = directory
+        self.enabled = enabled
+        self.flush_interval_s = flush_interval_s
+        self.max_pending = max_pending
+        self.segment_bytes = segment_bytes
+        self.segment_age_s = segment_age_s
+        self.retain_segments = retain_segments
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()      # one flush at a time; queries wait for it
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._segment = None       # path of the segment being written
+        self._segment_opened = 0.0
+        self.recorded = 0
+        self.dropped = 0
+        self.written = 0
+        self.flushes = 0
+        self.segments_rotated = 0
+        self.error = None
+
+    def record(self, kind, **fields):
+        """Queue one event. Costs a list append; the write happens on the flush thread."""
+        if not self.enabled:
+            return
+        fields['ts'] = time.time()
+        fields['kind'] = kind
+        with self._pending_lock:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.append(fields)
+            self.recorded += 1
+        if self._thread is None:
+            self.start()
+
+    def start(self):
+        with self._pending_lock:
+            if self._thread is not None or not self.enabled:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, name="event-log", daemon=True)
+            self._thread.start()
+        # Job worker processes have no shutdown hook; write what is queued on exit
+        atexit.register(self.flush)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval_s)
+            self._wake.clear()
+            try:
+                self.flush()
+            except OSError as e:
+                self.error = str(e)
+                print(f"Error writing event log: {e}")
+
+    def _rotate_if_needed(self, now):
+        if self._segment is not None:
+            try:
+                size = os.path.getsize(self._segment)
+            except OSError:
+                size = 0
+            if size < self.segment_bytes and now - self._segment_opened < self.segment_age_s:
+                return
+            self.segments_rotated += 1
+        self._segment = os.path.join(self.directory, f"events-{int(now * 1000)}-{os.getpid()}.ndjson.gz")
+        self._segment_opened = now
+        self._prune()
+
+    def _prune(self):
+        """Delete all but the newest retain_segments segments of every writer, sparing live writers' current ones."""
+        segments = glob.glob(os.path.join(self.directory, "events-*.ndjson.gz"))
+        if self._segment is not None and self._segment not in segments:
+            segments.append(self._segment)     # just opened, not written yet
+        segments.sort(key=segment_start)
+        current = {}     # pid -> its newest segment, which it may still be appending to
+        for path in segments:
+            current[segment_pid(path)] = path
+        for path in segments[:max(0, len(segments) - self.retain_segments)]:
+            pid = segment_pid(path)
+            if path == self._segment or (current.get(pid) == path and pid is not None and _pid_alive(pid)):
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def flush(self):
+        """Write every queued event now. Returns how many were written."""
+        with self._pending_lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return 0
+        payload = b''.join(_dumps(event) + b'\n' for event in batch)
+        with self._write_lock:
+            self._rotate_if_needed(time.time())
+            with open(self._segment, 'ab') as f:
+                f.write(gzip.compress(payload, compresslevel=EVENT_LOG_COMPRESSLEVEL))
+            self.written += len(batch)
+            self.flushes += 1
+        self.error = None
+        return len(batch)
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def segments(self, since=None, until=None):
+        """(start, end, path) of segments overlapping [since, until], newest start first. A segment ends at its mtime."""
+        found = []
+        for path in glob.glob(os.path.join(self.directory, "events-*.ndjson.gz")):
+            start = segment_start(path)
+            try:
+                end = os.path.getmtime(path)
+            except OSError:
+                continue
+            if (since is not None and end < since) or (until is not None and start > until):
+                continue
+            found.append((start, end, path))
+        return sorted(found, reverse=True)
+
+    def query(self, kinds=None, since=None, until=None, filters=None, limit=1000):
+        """
+        Most recent `limit` events (oldest first) of the given kinds in a time
+        range whose fields equal `filters`. Queued events are flushed first so
+        the result includes everything recorded so far.
+        """
+        self.flush()
+        kinds = set(kinds) if kinds else None
+        filters = filters or {}
+        matched = []
+        cutoff = None      # ts of the limit-th newest match so far
+        with self._write_lock:
+            for start, end, path in self.segments(since, until):
+                # Segments of other workers overlap, so stop only once nothing older can qualify
+                if cutoff is not None and end < cutoff:
+                    break
+                try:
+                    with gzip.open(path, 'rb') as f:
+                        for line in f:
+                            event = _loads(line)
+                            if kinds is not None and event.get('kind') not in kinds:
+                                continue
+                            ts = event.get('ts', 0.0)
+                            if (since is not None and ts < since) or (until is not None and ts > until):
+                                continue
+                            if any(event.get(k) != v for k, v in filters.items()):
+                                continue
+                            matched.append(event)
+                except (OSError, EOFError, ValueError) as e:
+                    # A segment another worker is appending to can end mid-member
+                    print(f"Skipping the rest of event segment {path}: {e}")
+                if len(matched) >= limit:
+                    matched.sort(key=lambda e: e.get('ts', 0.0))
+                    matched = matched[-limit:]
+                    cutoff = matched[0].get('ts', 0.0)
+        matched.sort(key=lambda e: e.get('ts', 0.0))
+        return matched[-limit:]
+
+    def stats(self):
+        with self._pending_lock:
+            pending = len(self._pending)
+        return {
+            "enabled": self.enabled,
+            "directory": self.directory,
+            "segment": self._segment,
+            "pending": pending,
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "written": self.written,
+            "flushes": self.flushes,
+            "segments_rotated": self.segments_rotated,
+            "error": self.error,
+        }
+
+
+event_log = EventLog()
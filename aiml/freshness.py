@@ -0,0 +1,168 @@
+""" Freshness classification stage.
+
+    FreshnessClassifier scores apple crops with the spoilage CNN in batches.
+    With a cascade model loaded, every crop is first scored by a small backbone
+    (ResNet18 / MobileNetV3 with the same head) and only crops whose score falls
+    within CASCADE_BAND of the 0.8 threshold are escalated to the ResNet50. A
+    small audit sample of confident crops is also run through the ResNet50 to
+    track how often the two models agree. An optional CropCache in front of
+    both stages returns the stored score for crops that look like ones already
+    classified by the same model version.
+"""
+import os
+import random
+import threading
+
+import numpy as np
+import torch
+from PIL import Image
+from torchvision import models
+
+from shared_weights import load_state_dict
+
+FRESHNESS_THRESHOLD = 0.8
+MAX_BATCH = int(os.getenv("CNN_MAX_BATCH", "32"))
+
+CASCADE_MODEL_PATH = os.getenv("CASCADE_MODEL_PATH", "models/trained/spoilage_cnn_small.pth")
+CASCADE_ARCH = os.getenv("CASCADE_ARCH", "resnet18")
+CASCADE_BAND = float(os.getenv("CASCADE_BAND", "0.15"))
+CASCADE_AUDIT_RATE = float(os.getenv("CASCADE_AUDIT_RATE", "0.05"))
+
+
+def spoilage_head(in_features):
+    """The binary head used by spoilage_cnn.pth: 128 hidden units and a sigmoid."""
+    return torch.nn.Sequential(
+        torch.nn.Linear(in_features, 128),
+        torch.nn.ReLU(),
+        torch.nn.Linear(128, 1),
+        torch.nn.Sigmoid()
+    )
+
+
+def build_small_model(arch):
+    if arch == "resnet18":
+        net = models.resnet18(weights=None)
+        net.fc = spoilage_head(net.fc.in_features)
+    elif arch == "mobilenet_v3_small":
+        net = models.mobilenet_v3_small(weights=None)
+        net.classifier = spoilage_head(net.classifier[0].in_features)
+    elif arch == "mobilenet_v3_large":
+        net = models.mobilenet_v3_large(weights=None)
+        net.classifier = spoilage_head(net.classifier[0].in_features)
+    else:
+        raise ValueError(f"Unknown cascade architecture: {arch}")
+    return net
+
+
+def load_small_model(path=CASCADE_MODEL_PATH, arch=CASCADE_ARCH, device=torch.device('cpu')):
+    """Load the cascade's first-stage model, or None if no weights are available."""
+    if not os.path.exists(path):
+        print(f"No cascade model at {path}, using the full CNN for every crop")
+        return None
+    try:
+        net = build_small_model(arch)
+        load_state_dict(net, path, device)
+        net.eval()
+        print(f"Cascade model ({arch}) loaded successfully")
+        return net.to(device)
+    except Exception as e:
+        print(f"Error loading cascade model: {e}")
+        return None
+
+
+class FreshnessClassifier:
+    def __init__(self, model, transform, device, small_model=None,
+                 band=CASCADE_BAND, audit_rate=CASCADE_AUDIT_RATE,
+                 cache=None, model_version="spoilage_cnn"):
+        self.model = model
+        self.small_model = small_model
+        self.cache = cache
+        # Cascade scores differ slightly from pure ResNet50 ones, so they are cached apart
+        self.model_version = model_version + ("+cascade" if small_model is not None else "")
+        self.transform = transform
+        self.device = device
+        self.band = band
+        self.audit_rate = audit_rate
+        # Own generator: the process-wide one is reseeded per detection by the pricing simulation
+        self._rng = random.Random()
+        self._lock = threading.Lock()
+        self.crops = 0
+        self.escalated = 0
+        self.audited = 0
+        self.agreed = 0
+
+    def _run(self, net, crops):
+        scores = []
+        for start in range(0, len(crops), MAX_BATCH):
+            chunk = crops[start:start + MAX_BATCH]
+            batch = torch.stack([self.transform(Image.fromarray(c)) for c in chunk]).to(self.device)
+            with torch.no_grad():
+                scores.extend(net(batch).view(-1).tolist())
+        return scores
+
+    def warmup(self):
+        """One dummy batch through each network so the first real request is not slow."""
+        dummy = [np.zeros((64, 64, 3), dtype=np.uint8)]
+        self._run(self.model, dummy)
+        if self.small_model is not None:
+            self._run(self.small_model, dummy)
+
+    def score(self, crops):
+        """Sigmoid spoilage score per crop (RGB uint8 arrays); > 0.8 means rotten."""
+        if not crops:
+            return []
+        if self.cache is None:
+            return self._score_uncached(crops)
+
+        keys = [self.cache.key(crop, self.model_version) for crop in crops]
+        scores = [self.cache.get(key) for key in keys]
+        missing = [i for i, s in enumerate(scores) if s is None]
+        if missing:
+            computed = self._score_uncached([crops[i] for i in missing])
+            for i, value in zip(missing, computed):
+                scores[i] = value
+                self.cache.put(keys[i], value)
+        return scores
+
+    def _score_uncached(self, crops):
+        if self.small_model is None:
+            scores = self._run(self.model, crops)
+            with self._lock:
+                self.crops += len(crops)
+                self.escalated += len(crops)
+            return scores
+
+        scores = self._run(self.small_model, crops)
+        uncertain = [i for i, s in enumerate(scores) if abs(s - FRESHNESS_THRESHOLD) <= self.band]
+        uncertain_set = set(uncertain)
+        audit = [i for i in range(len(crops))
+                 if i not in uncertain_set and self._rng.random() < self.audit_rate]
+        picked = uncertain + audit
+        agreed = 0
+        if picked:
+            full = self._run(self.model, [crops[i] for i in picked])
+            for i, full_score in zip(picked, full):
+                if i in uncertain_set:
+                    scores[i] = full_score
+                elif (full_score > FRESHNESS_THRESHOLD) == (scores[i] > FRESHNESS_THRESHOLD):
+                    agreed += 1
+        with self._lock:
+            self.crops += len(crops)
+            self.escalated += len(uncertain)
+            self.audited += len(audit)
+            self.agreed += agreed
+        return scores
+
+    def stats(self):
+        with self._lock:
+            return {
+                "cascade_enabled": self.small_model is not None,
+                "band": self.band,
+                "crops": self.crops,
+                "escalated": self.escalated,
+                "escalation_rate": round(self.escalated / self.crops, 4) if self.crops else None,
+                "audited": self.audited,
+                "agreement_rate": round(self.agreed / self.audited, 4) if self.audited else None,
+                "model_version": self.model_version,
+                "cache": self.cache.stats() if self.cache is not None else None,
+            }
@@ -0,0 +1,216 @@
+""" Server-side camera stream ingestion.
+
+    Instead of a browser pushing every frame, the service can pull a stream
+    itself: an RTSP or HTTP-MJPEG URL, or a local video file as a stand-in for
+    a camera. Each stream gets a reader thread (cv2.VideoCapture) that samples
+    frames at the configured rate and keeps only the newest one, already
+    shrunk to the inference size, so memory per stream stays bounded no matter
+    how far inference falls behind. An asyncio task per stream hands sampled
+    frames to the shared inference pool and publishes results to the stream's
+    camera channel.
+"""
+import asyncio
+import os
+import threading
+import time
+
+import cv2
+
+from admission import Overloaded, STREAM
+
+MAX_STREAMS = int(os.getenv("MAX_STREAMS", "32"))
+DEFAULT_SAMPLE_FPS = float(os.getenv("STREAM_SAMPLE_FPS", "2"))
+RECONNECT_DELAY_S = 5.0
+INFERENCE_SIZE = (640, 640)
+
+
+class StreamWorker:
+    def __init__(self, name, url, sample_fps=DEFAULT_SAMPLE_FPS, loop_file=True):
+        self.name = name
+        self.url = url
+        self.sample_fps = sample_fps
+        self.loop_file = loop_file
+        self.is_file = os.path.isfile(url)
+        self._latest = None              # newest sampled frame not yet inferred
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._ready = None               # asyncio.Event set by the reader thread
+        self._loop = None
+        self._thread = None
+        self.task = None
+        self.frames_read = 0
+        self.frames_sampled = 0
+        self.frames_inferred = 0
+        self.frames_dropped = 0
+        self.error = None
+        self.finished = False
+
+    def start(self, loop, consume):
+        self._loop = loop
+        self._ready = asyncio.Event()
+        self._thread = threading.Thread(target=self._read, name=f"stream-{self.name}", daemon=True)
+        self._thread.start()
+        self.task = loop.create_task(consume(self))
+
+    def stop(self):
+        self._stop.set()
+        if self.task is not None:
+            self.task.cancel()
+
+    def _open(self):
+        cap = cv2.VideoCapture(self.url)
+        if not cap.isOpened():
+            cap.release()
+            return None
+        # Keep the driver's own buffer short so live streams stay current
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
+
+    def _read(self):
+        interval = 1.0 / self.sample_fps if self.sample_fps > 0 else 0.0
+        while not self._stop.is_set():
+            cap = self._open()
+            if cap is None:
+                self.error = f"Could not open {self.url}"
+                if self.is_file:
+                    break
+                self._stop.wait(RECONNECT_DELAY_S)
+                continue
+            self.error = None
+
+            # Files are paced by their own frame rate; live sources by wall clock
+            source_fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+            step = max(1, round(source_fps * interval)) if self.is_file else None
+            last_sample = 0.0
+            index = 0
+            while not self._stop.is_set():
+                # grab() skips the colour conversion for frames we do not keep
+                if not cap.grab():
+                    break
+                self.frames_read += 1
+                index += 1
+                now = time.monotonic()
+                if step is not None:
+                    if index % step:
+                        continue
+                    # Play files back in real time rather than as fast as they decode
+                    self._stop.wait(step / source_fps)
+                elif now - last_sample < interval:
+                    continue
+                last_sample = now
+                ok, frame = cap.retrieve()
+                if not ok:
+                    break
+                self._offer(cv2.resize(frame, INFERENCE_SIZE))
+            cap.release()
+            if index == 0:
+                self.error = f"No frames read from {self.url}"
+
+            if self.is_file and not self.loop_file:
+                break
+            # A looped file that yields nothing would otherwise be reopened in a tight loop
+            if not self.is_file or index == 0:
+                self._stop.wait(RECONNECT_DELAY_S)
+        self.finished = True
+        self._signal()
+
+    def _offer(self, frame):
+        with self._lock:
+            if self._latest is not None:
+                self.frames_dropped += 1
+            self._latest = frame
+        self.frames_sampled += 1
+        self._signal()
+
+    def _signal(self):
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            pass  # event loop already closed
+
+    async def next_frame(self):
+        """Wait for the newest sampled frame; None once the reader has finished."""
+        while True:
+            with self._lock:
+                frame, self._latest = self._latest, None
+            if frame is not None:
+                return frame
+            if self.finished:
+                return None
+            await self._ready.wait()
+            self._ready.clear()
+
+    def status(self):
+        return {
+            "name": self.name,
+            "url": self.url,
+            "sample_fps": self.sample_fps,
+            "frames_read": self.frames_read,
+            "frames_sampled": self.frames_sampled,
+            "frames_inferred": self.frames_inferred,
+            "frames_dropped": self.frames_dropped,
+            "finished": self.finished,
+            "error": self.error,
+        }
+
+
+class StreamManager:
+    def __init__(self, channels, admission, analyze, max_streams=MAX_STREAMS):
+        self.channels = channels
+        self.admission = admission
+        self.analyze = analyze
+        self.max_streams = max_streams
+        self.workers = {}
+
+    def add(self, name, url, sample_fps=DEFAULT_SAMPLE_FPS, loop_file=True):
+        """Start pulling a stream into channel `name`. Raises ValueError on conflicts."""
+        if name in self.workers:
+            raise ValueError(f"Stream '{name}' already exists")
+        if len(self.workers) >= self.max_streams:
+            raise ValueError(f"Stream limit of {self.max_streams} reached")
+        if not self.channels.claim_producer(name, url):
+            raise ValueError(f"Channel '{name}' already has a producer")
+        worker = StreamWorker(name, url, sample_fps, loop_file)
+        self.workers[name] = worker
+        worker.start(asyncio.get_running_loop(), self._consume)
+        print(f"Started stream '{name}' from {url}")
+        return worker
+
+    def remove(self, name):
+        worker = self.workers.pop(name, None)
+        if worker is None:
+            return False
+        worker.stop()
+        self.channels.release_producer(name)
+        print(f"Stopped stream '{name}'")
+        return True
+
+    async def _consume(self, worker):
+        frame_count = 0
+        try:
+            while True:
+                frame = await worker.next_frame()
+                if frame is None:
+                    break
+                try:
+                    detections, model_version = await self.admission.run(STREAM, self.analyze, frame)
+                except Overloaded:
+                    # Shed: the reader keeps only the newest frame, so just move on
+                    worker.frames_dropped += 1
+                    continue
+                except Exception as e:
+                    worker.error = f"Inference error: {e}"
+                    continue
+                worker.frames_inferred += 1
+                frame_count += 1
+                await self.channels.publish(worker.name, detections, frame_count, model_version, frame)
+        finally:
+            if self.workers.get(worker.name) is worker and worker.finished:
+                self.remove(worker.name)
+
+    def status(self):
+        return [worker.status() for worker in self.workers.values()]
+
+    def stop_all(self):
+        for name in list(self.workers):
+            self.remove(name)
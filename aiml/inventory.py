@@ -0,0 +1,164 @@
+""" In-memory inventory state.
+
+    One row per (store, SKU), stored column-wise in NumPy arrays (stock level,
+    daily sales rate, nominal shelf life, received and updated timestamps)
+    with a dict index, so a pricing call reads its business context in O(1)
+    and a sales feed is applied as one batch of array writes.
+
+    Sales feeds post rows with any of: an absolute `stock_level`, units `sold`
+    over `period_days` (decrements stock and updates the exponentially
+    weighted sales rate by INVENTORY_SALES_ALPHA), an explicit
+    `daily_sales_rate`, `shelf_life_days` and `received_at`. Reads never
+    create rows: a store/SKU that has never been fed is read from the
+    `default_row` callback, which is deterministic per (store, SKU), so
+    pricing is reproducible and only sales feeds add rows.
+"""
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+INVENTORY_INITIAL_ROWS = int(os.getenv("INVENTORY_INITIAL_ROWS", "1024"))
+INVENTORY_SALES_ALPHA = float(os.getenv("INVENTORY_SALES_ALPHA", "0.3"))
+DAY_S = 86400.0
+
+COLUMNS = ('stock_level', 'daily_sales_rate', 'shelf_life_days', 'received_at', 'updated_at')
+
+
+def _non_negative(value):
+    """float(value), rejecting NaN, infinities and negatives (float() accepts "nan" and "inf")."""
+    value = float(value)
+    if not math.isfinite(value) or value < 0:
+        raise ValueError(f"Invalid quantity: {value}")
+    return value
+
+
+class InventoryStore:
+    def __init__(self, default_row, capacity=INVENTORY_INITIAL_ROWS, sales_alpha=INVENTORY_SALES_ALPHA):
+        """`default_row(store, sku)` returns the initial column values for an unfed row."""
+        self.default_row = default_row
+        self.sales_alpha = sales_alpha
+        self.columns = {name: np.zeros(capacity, dtype=np.float64) for name in COLUMNS}
+        self.keys = []           # row -> (store, sku)
+        self.index = {}          # (store, sku) -> row
+        self.by_store = {}       # store -> [row, ...]
+        self._lock = threading.Lock()
+        self.upserts = 0
+
+    def _grow(self):
+        capacity = len(self.columns['stock_level'])
+        for name, column in self.columns.items():
+            grown = np.zeros(capacity * 2, dtype=np.float64)
+            grown[:capacity] = column
+            self.columns[name] = grown
+
+    def _add_row(self, store, sku, values):
+        row = len(self.keys)
+        if row == len(self.columns['stock_level']):
+            self._grow()
+        now = time.time()
+        for name in COLUMNS:
+            self.columns[name][row] = values.get(name, now if name in ('received_at', 'updated_at') else 0.0)
+        self.keys.append((store, sku))
+        self.index[(store, sku)] = row
+        self.by_store.setdefault(store, []).append(row)
+        return row
+
+    def _row(self, store, sku):
+        row = self.index.get((store, sku))
+        if row is None:
+            row = self._add_row(store, sku, self.default_row(store, sku))
+        return row
+
+    def _context(self, row, now):
+        store, sku = self.keys[row]
+        return self._make_context(store, sku, {name: column[row] for name, column in self.columns.items()}, now)
+
+    @staticmethod
+    def _make_context(store, sku, values, now):
+        days_in_stock = int(max(0.0, now - values.get('received_at', now)) // DAY_S)
+        shelf_life = int(values['shelf_life_days'])
+        return {
+            'store': store,
+            'sku': sku,
+            'daily_sales_rate': round(float(values['daily_sales_rate']), 2),
+            'stock_level': int(values['stock_level']),
+            'estimated_shelf_life_days': max(0, shelf_life - days_in_stock),
+        }
+
+    def known(self, store, sku):
+        with self._lock:
+            return (store, sku) in self.index
+
+    def context(self, store, sku):
+        """Business context for one store/SKU; the default row's, without storing it, if never fed."""
+        now = time.time()
+        with self._lock:
+            row = self.index.get((store, sku))
+            if row is not None:
+                return self._context(row, now)
+        return self._make_context(store, sku, self.default_row(store, sku), now)
+
+    def store_contexts(self, store):
+        now = time.time()
+        with self._lock:
+            return [self._context(row, now) for row in self.by_store.get(store, ())]
+
+    def upsert(self, rows):
+        """Apply a sales-feed batch. Returns (applied, rejected)."""
+        now = time.time()
+        rejected = 0
+        fields = {name: ([], []) for name in ('stock_level', 'daily_sales_rate', 'shelf_life_days', 'received_at')}
+        sold_rows, sold_rates = [], []
+        with self._lock:
+            touched = []
+            for item in rows:
+                # Validate the whole item before touching any column
+                try:
+                    key = (str(item['store']), str(item['sku']))
+                    parsed = {name: _non_negative(item[name]) for name in fields if item.get(name) is not None}
+                    sale = None
+                    if item.get('sold') is not None:
+                        sold = _non_negative(item['sold'])
+                        sale = (sold, sold / _non_negative(item.get('period_days') or 1.0))
+                except (KeyError, TypeError, ValueError, ZeroDivisionError):
+                    rejected += 1
+                    continue
+                row = self._row(*key)
+                for name, value in parsed.items():
+                    fields[name][0].append(row)
+                    fields[name][1].append(value)
+                if sale is not None:
+                    sold_rows.append(row)
+                    sold_rates.append(sale)
+                touched.append(row)
+
+            # Absolute values first, then sales are applied on top of them
+            c = self.columns
+            for name, (idx, values) in fields.items():
+                if idx:
+                    c[name][np.asarray(idx)] = np.asarray(values)
+            if sold_rows:
+                idx = np.asarray(sold_rows)
+                sold = np.array([s for s, _ in sold_rates])
+                rate = np.array([r for _, r in sold_rates])
+                # np.subtract.at handles a row sold more than once in the same batch
+                np.subtract.at(c['stock_level'], idx, sold)
+                np.maximum(c['stock_level'], 0.0, out=c['stock_level'])
+                for row, r in zip(sold_rows, rate.tolist()):
+                    c['daily_sales_rate'][row] += self.sales_alpha * (r - c['daily_sales_rate'][row])
+            if touched:
+                c['updated_at'][np.asarray(touched)] = now
+            self.upserts += len(touched)
+        return len(touched), rejected
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rows": len(self.keys),
+                "stores": len(self.by_store),
+                "capacity": len(self.columns['stock_level']),
+                "upserts": self.upserts,
+            }
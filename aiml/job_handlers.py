@@ -0,0 +1,134 @@
+""" Job handlers, run in the job worker processes (see jobs.py).
+
+    A worker is `python jobs.py worker job_handlers:jobs`. It imports this
+    module rather than the service, so it does not start the web app, the
+    stream and decode pools or a second copy of the service's state. It
+    loads the detector and classifier on its first image or video job;
+    repricing needs no model. A worker's inventory, telemetry and shelf-life
+    stores start empty, so the serving process snapshots the state a job is
+    priced from into its params at submit time.
+"""
+import os
+
+import cv2
+
+from apple_models import detectors, classifiers, load_models, DETECT_DECODE_SIDE
+from decoding import decoder, LETTERBOX
+from freshness import FRESHNESS_THRESHOLD
+from jobs import JobQueue
+from pipeline import Pipeline, FrameRequest, DetectStage, ClassifyStage, SensorStage, PricingStage
+from pricing import (inventory, APPLE_SKU, apple_sensor_reading, dynamic_apple_price_engine, apple_detections,
+                     simulate_milk_spoilage_data, milk_business_context, _predict_milk_spoilage,
+                     dynamic_milk_price_engine)
+from serialization import dumps_json
+
+JOB_IMAGE_BATCH = int(os.getenv("JOB_IMAGE_BATCH", "8"))
+
+jobs = JobQueue(target="job_handlers:jobs")
+
+
+def apple_job_pipeline(params):
+    """The apple pipeline, with sensors, stock and shelf life read from the job's submit-time snapshot."""
+    # Jobs queued before snapshots were taken price from the store's default inventory, with simulated sensors
+    snapshot = params.get('snapshot') or {"context": inventory.context(params['store'], APPLE_SKU),
+                                          "readings": None, "remaining_days": None}
+    readings = snapshot['readings']
+    return Pipeline(
+        DetectStage(detectors),
+        ClassifyStage(classifiers, FRESHNESS_THRESHOLD),
+        SensorStage(lambda prediction, score, box, lot: apple_sensor_reading(prediction, score, box, readings)),
+        PricingStage(dynamic_apple_price_engine, lambda store: snapshot['context'],
+                     lambda lot, scores: snapshot['remaining_days']),
+    )
+
+
+@jobs.handler('analyze_images')
+def run_image_batch(job):
+    load_models()
+    if detectors.active() is None:
+        raise RuntimeError("YOLO model not available")
+    names = job.params['files']
+    pipeline = apple_job_pipeline(job.params)
+    actions = {}
+    failed = apples = 0
+    with open(job.artifact('results.ndjson'), 'w') as out:
+        for start in range(0, len(names), JOB_IMAGE_BATCH):
+            # Each chunk goes through the pipeline together: one YOLO call and one CNN batch
+            batch = []
+            for name in names[start:start + JOB_IMAGE_BATCH]:
+                with open(job.input(name), 'rb') as f:
+                    frame, scale, full_size = decoder.decode(f.read(), (DETECT_DECODE_SIDE, DETECT_DECODE_SIDE), LETTERBOX)
+                if frame is None:
+                    failed += 1
+                    out.write(dumps_json({"file": name, "error": "Could not decode image"}) + "\n")
+                else:
+                    batch.append((name, FrameRequest(frame, scale, full_size, job.params.get('lot'), job.params['store'])))
+            pipeline.run_batch([request for _, request in batch])
+            for name, request in batch:
+                detections, version = apple_detections(request)
+                apples += len(detections)
+                for detection in detections:
+                    action = detection['pricing']['action']
+                    actions[action] = actions.get(action, 0) + 1
+                out.write(dumps_json({"file": name, "detections": detections, "model_version": version}) + "\n")
+            done = min(start + JOB_IMAGE_BATCH, len(names))
+            job.progress(done / len(names), f"{done}/{len(names)} images")
+    return {"images": len(names), "failed": failed, "apples": apples,
+            "actions": actions, "artifact": "results.ndjson"}
+
+
+@jobs.handler('analyze_video')
+def run_video_analysis(job):
+    load_models()
+    if detectors.active() is None:
+        raise RuntimeError("YOLO model not available")
+    capture = cv2.VideoCapture(job.input(job.params['file']))
+    if not capture.isOpened():
+        raise ValueError("Could not open video")
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+    total = int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) or 0
+    step = max(1, round(fps / job.params['sample_fps']))
+    pipeline = apple_job_pipeline(job.params)
+    index = sampled = apples = 0
+    actions = {}
+    try:
+        with open(job.artifact('frames.ndjson'), 'w') as out:
+            # grab() skips frames without decoding them; only sampled frames are retrieved
+            while capture.grab():
+                if index % step == 0:
+                    ok, frame = capture.retrieve()
+                    if ok:
+                        request = FrameRequest(frame, lot=job.params.get('lot'), store=job.params['store'])
+                        detections, version = apple_detections(pipeline.run(request))
+                        sampled += 1
+                        apples += len(detections)
+                        for detection in detections:
+                            action = detection['pricing']['action']
+                            actions[action] = actions.get(action, 0) + 1
+                        out.write(dumps_json({"frame": index, "time_s": round(index / fps, 3),
+                                              "detections": detections, "model_version": version}) + "\n")
+                        job.progress(index / total if total else 0.0, f"frame {index}/{total}")
+                index += 1
+    finally:
+        capture.release()
+    return {"frames": index, "sampled": sampled, "apples": apples, "actions": actions, "artifact": "frames.ndjson"}
+
+
+@jobs.handler('reprice_store')
+def run_store_reprice(job):
+    items = job.params['items']
+    if not items:
+        return {"store": job.params['store'], "skus": 0, "actions": {}}
+    actions = {}
+    with open(job.artifact('prices.ndjson'), 'w') as out:
+        for i, context in enumerate(items):
+            spoilage_data = simulate_milk_spoilage_data(context['sku'])
+            prediction, probability = _predict_milk_spoilage(spoilage_data)
+            # Inventory as it was in the serving process at submit time
+            business_context = milk_business_context(context['sku'], context=context)
+            pricing = dynamic_milk_price_engine(prediction, probability, spoilage_data, business_context)
+            actions[pricing['action']] = actions.get(pricing['action'], 0) + 1
+            out.write(dumps_json({"sku": context['sku'], "prediction": prediction,
+                                  "probability": round(probability, 3), "pricing": pricing}) + "\n")
+            job.progress((i + 1) / len(items), f"{i + 1}/{len(items)} SKUs")
+    return {"store": job.params['store'], "skus": len(items), "actions": actions, "artifact": "prices.ndjson"}
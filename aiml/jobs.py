@@ -0,0 +1,415 @@
+""" Persistent job queue for work that does not fit in a request.
+
+    Batch image uploads, video file analysis and storewide repricing are
+    submitted as jobs and return a job id right away. Jobs live in a SQLite
+    database (JOBS_DB_PATH, WAL mode) so they survive a restart, and a pool of
+    JOB_WORKERS worker processes claims them one at a time:
+
+        queued -> running -> done | failed | cancelled
+
+    A worker process is `python jobs.py worker job_handlers:jobs`: it imports
+    the handler module (not the service), which registers the handlers with
+    @jobs.handler(kind), then loops claiming jobs. Workers exit when the
+    process that started them goes away; a job running at that moment goes
+    back in the queue at its next progress report. Handlers get a Job to report progress (also the
+    point where a cancel request takes effect) and to write result artifacts
+    under JOBS_DIR/<id>/. Only one process per host supervises the pool (a
+    lock file, like the CPU slot claim), so every uvicorn worker can call
+    start_workers(). The supervisor restarts dead workers and puts jobs whose
+    worker died back in the queue, up to JOB_MAX_ATTEMPTS tries; that is
+    also how jobs interrupted by a restart resume.
+"""
+import argparse
+import importlib
+import json
+import os
+import shutil
+import signal
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; every process then supervises its own pool
+    fcntl = None
+
+JOBS_DIR = os.getenv("JOBS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "job_data"))
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join(JOBS_DIR, "jobs.db"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+JOB_POLL_INTERVAL_S = float(os.getenv("JOB_POLL_INTERVAL_S", "0.5"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "2"))
+JOB_PROGRESS_INTERVAL_S = 0.5
+# Workers run at a lower CPU priority than the service, so job inference yields to request inference
+JOB_WORKER_NICE = int(os.getenv("JOB_WORKER_NICE", "10"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    worker_pid INTEGER,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    updated_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+"""
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class WorkerExiting(Exception):
+    """The worker's parent process is gone; the job is put back in the queue."""
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Job:
+    """What a handler sees: its id, params and artifact directory, plus progress reporting."""
+
+    def __init__(self, queue, conn, job_id, params):
+        self.queue = queue
+        self.conn = conn
+        self.id = job_id
+        self.params = params
+        self.directory = queue.job_dir(job_id)
+        self._reported = 0.0
+
+    def artifact(self, name):
+        """Path to write a result artifact to."""
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, os.path.basename(name))
+
+    def input(self, name):
+        return os.path.join(self.queue.input_dir(self.id), os.path.basename(name))
+
+    def progress(self, fraction, message=None):
+        """Report progress in [0, 1]. Raises JobCancelled once a cancel has been requested."""
+        if self.queue.orphaned():
+            raise WorkerExiting()
+        now = time.time()
+        if fraction < 1.0 and now - self._reported < JOB_PROGRESS_INTERVAL_S:
+            return
+        self._reported = now
+        self.conn.execute("UPDATE jobs SET progress = ?, message = ?, updated_at = ? WHERE id = ?",
+                          (min(max(float(fraction), 0.0), 1.0), message, now, self.id))
+        cancelled = self.conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (self.id,)).fetchone()
+        if cancelled and cancelled[0]:
+            raise JobCancelled()
+
+
+class JobQueue:
+    def __init__(self, path=JOBS_DB_PATH, directory=JOBS_DIR, workers=JOB_WORKERS,
+                 target="job_handlers:jobs", max_attempts=JOB_MAX_ATTEMPTS):
+        self.path = path
+        self.directory = directory
+        self.workers = workers
+        self.target = target
+        self.max_attempts = max_attempts
+        self.handlers = {}
+        self._local = threading.local()
+        self._processes = []
+        self._supervisor = None
+        self._lock_file = None
+        self._stop = threading.Event()
+        self.parent_pid = None     # set in worker processes: the process that spawned them
+        self.restarts = 0
+
+    def handler(self, kind):
+        """Decorator registering `fn(job)` as the handler for a job kind. Its return value is the job's result."""
+        def register(fn):
+            self.handlers[kind] = fn
+            return fn
+        return register
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def job_dir(self, job_id):
+        return os.path.join(self.directory, job_id)
+
+    def input_dir(self, job_id):
+        path = os.path.join(self.job_dir(job_id), "inputs")
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    @staticmethod
+    def new_id():
+        return uuid.uuid4().hex[:16]
+
+    def submit(self, kind, params, job_id=None):
+        """Queue a job. Pass `job_id` when its inputs were already saved under input_dir(job_id)."""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind '{kind}'")
+        job_id = job_id or self.new_id()
+        self._connect().execute(
+            "INSERT INTO jobs (id, kind, params, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, kind, json.dumps(params), QUEUED, time.time(), time.time()))
+        return self.get(job_id)
+
+    @staticmethod
+    def _describe(row):
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        return job
+
+    def get(self, job_id):
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._describe(row) if row is not None else None
+
+    def list(self, status=None, kind=None, limit=100):
+        query, args = "SELECT * FROM jobs", []
+        clauses = []
+        if status:
+            clauses.append("status = ?")
+            args.append(status)
+        if kind:
+            clauses.append("kind = ?")
+            args.append(kind)
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        args.append(limit)
+        return [self._describe(row) for row in self._connect().execute(query, args)]
+
+    def cancel(self, job_id):
+        """Cancel a queued job now, or ask a running one to stop at its next progress report."""
+        conn = self._connect()
+        now = time.time()
+        conn.execute("UPDATE jobs SET status = ?, finished_at = ?, updated_at = ?, cancel_requested = 1 "
+                     "WHERE id = ? AND status = ?", (CANCELLED, now, now, job_id, QUEUED))
+        conn.execute("UPDATE jobs SET cancel_requested = 1, updated_at = ? WHERE id = ? AND status = ?",
+                     (now, job_id, RUNNING))
+        return self.get(job_id)
+
+    def delete(self, job_id):
+        """Remove a finished job and its files. False if it is unknown or still queued / running."""
+        cursor = self._connect().execute(
+            f"DELETE FROM jobs WHERE id = ? AND status IN ({','.join('?' * len(FINISHED))})", (job_id, *FINISHED))
+        if cursor.rowcount == 0:
+            return False
+        shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+        return True
+
+    def artifacts(self, job_id):
+        directory = self.job_dir(job_id)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(name for name in os.listdir(directory) if os.path.isfile(os.path.join(directory, name)))
+
+    def artifact_path(self, job_id, name):
+        """Path of an artifact, or None if there is no such file (names cannot leave the job's directory)."""
+        if name != os.path.basename(name):
+            return None
+        path = os.path.join(self.job_dir(job_id), name)
+        return path if os.path.isfile(path) else None
+
+    # Worker side
+
+    def _claim(self, conn):
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE jobs SET status = ?, worker_pid = ?, attempts = attempts + 1, "
+                             "started_at = ?, updated_at = ?, progress = 0, message = NULL WHERE id = ?",
+                             (RUNNING, os.getpid(), now, now, row["id"]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row
+
+    def _run(self, conn, row):
+        job = Job(self, conn, row["id"], json.loads(row["params"]))
+        status, result, error = DONE, None, None
+        try:
+            handler = self.handlers.get(row["kind"])
+            if handler is None:
+                raise ValueError(f"No handler for job kind '{row['kind']}'")
+            result = handler(job)
+        except JobCancelled:
+            status = CANCELLED
+        except WorkerExiting:
+            conn.execute("UPDATE jobs SET status = ?, worker_pid = NULL, updated_at = ? WHERE id = ? AND status = ?",
+                         (QUEUED, time.time(), row["id"], RUNNING))
+            return
+        except Exception as e:
+            status, error = FAILED, f"{type(e).__name__}: {e}"
+            print(f"Job {row['id']} ({row['kind']}) failed: {error}")
+        now = time.time()
+        conn.execute("UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, updated_at = ?, "
+                     "progress = CASE WHEN ? = 'done' THEN 1 ELSE progress END WHERE id = ?",
+                     (status, json.dumps(result) if result is not None else None, error, now, now,
+                      status, row["id"]))
+
+    def orphaned(self):
+        """True in a worker whose parent process has exited (it is reparented, so getppid changes)."""
+        return self.parent_pid is not None and os.getppid() != self.parent_pid
+
+    def work_forever(self, parent_pid=None):
+        """Worker process main loop: claim and run jobs until SIGTERM or until `parent_pid` exits."""
+        self.parent_pid = parent_pid
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        conn = self._connect()
+        print(f"Job worker {os.getpid()} ready for: {', '.join(sorted(self.handlers))}")
+        while not stop.is_set():
+            if self.orphaned():
+                print(f"Job worker {os.getpid()}: parent {parent_pid} exited, stopping")
+                break
+            row = self._claim(conn)
+            if row is None:
+                stop.wait(JOB_POLL_INTERVAL_S)
+                continue
+            self._run(conn, row)
+
+    # Supervisor side
+
+    def recover(self):
+        """Requeue running jobs whose worker process is gone; fail those out of attempts. Returns how many were requeued."""
+        conn = self._connect()
+        now = time.time()
+        requeued = 0
+        for row in conn.execute("SELECT id, worker_pid, attempts FROM jobs WHERE status = ?", (RUNNING,)).fetchall():
+            if _pid_alive(row["worker_pid"]):
+                continue
+            if row["attempts"] >= self.max_attempts:
+                conn.execute("UPDATE jobs SET status = ?, error = ?, finished_at = ?, updated_at = ? WHERE id = ?",
+                             (FAILED, "Worker exited while running the job", now, now, row["id"]))
+            else:
+                conn.execute("UPDATE jobs SET status = ?, worker_pid = NULL, updated_at = ? "
+                             "WHERE id = ? AND status = ?", (QUEUED, now, row["id"], RUNNING))
+                requeued += 1
+        return requeued
+
+    def _spawn(self):
+        here = os.path.dirname(os.path.abspath(__file__))
+        return subprocess.Popen([sys.executable, os.path.join(here, "jobs.py"), "worker", self.target,
+                                 "--parent", str(os.getpid())], cwd=here)
+
+    def _supervise(self):
+        while not self._stop.is_set():
+            for i, process in enumerate(self._processes):
+                if process.poll() is not None and not self._stop.is_set():
+                    print(f"Job worker {process.pid} exited with {process.returncode}, restarting")
+                    self._processes[i] = self._spawn()
+                    self.restarts += 1
+            try:
+                # poll() above reaped exited workers, so their pids now read as dead
+                self.recover()
+            except sqlite3.Error as e:
+                print(f"Error recovering jobs: {e}")
+            self._stop.wait(5.0)
+
+    def start_workers(self):
+        """Start the worker pool unless another process on this host already supervises it."""
+        if self.workers <= 0 or self._supervisor is not None:
+            return False
+        if fcntl is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._lock_file = open(os.path.join(self.directory, "supervisor.lock"), "w")
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._lock_file.close()
+                self._lock_file = None
+                return False
+        # Anything still marked running was interrupted by the last shutdown
+        requeued = self.recover()
+        if requeued:
+            print(f"Requeued {requeued} interrupted job(s)")
+        self._processes = [self._spawn() for _ in range(self.workers)]
+        self._supervisor = threading.Thread(target=self._supervise, name="job-supervisor", daemon=True)
+        self._supervisor.start()
+        return True
+
+    def stop_workers(self, timeout=30):
+        self._stop.set()
+        for process in self._processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in self._processes:
+            try:
+                process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def stats(self):
+        counts = {status: 0 for status in (QUEUED, RUNNING) + FINISHED}
+        for row in self._connect().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"):
+            counts[row["status"]] = row["n"]
+        return {
+            "database": self.path,
+            "kinds": sorted(self.handlers),
+            "jobs": counts,
+            "supervising": self._supervisor is not None,
+            "workers": [{"pid": p.pid, "alive": p.poll() is None} for p in self._processes],
+            "restarts": self.restarts,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a job worker process")
+    parser.add_argument('command', choices=['worker'])
+    parser.add_argument('target', nargs='?', default='job_handlers:jobs', help="module:attribute of the JobQueue")
+    parser.add_argument('--parent', type=int, default=None, help="exit once this process is gone")
+    args = parser.parse_args()
+    # Take this worker's share of the cores before the handler module loads any model
+    from cpu_config import cpu_config, JOB
+    cpu_config.apply(JOB)
+    if JOB_WORKER_NICE and hasattr(os, "nice"):
+        os.nice(JOB_WORKER_NICE)
+    module_name, attribute = args.target.split(':')
+    queue = getattr(importlib.import_module(module_name), attribute)
+    queue.work_forever(args.parent)
+
+
+if __name__ == '__main__':
+    main()
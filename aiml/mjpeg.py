@@ -0,0 +1,166 @@
+""" Annotated MJPEG output for camera channels.
+
+    GET /cameras/{name}/mjpeg serves a channel's frames with boxes, freshness
+    and price labels drawn by the server, as a multipart/x-mixed-replace
+    stream that browsers and VLC play directly. Nothing is drawn or encoded for a channel unless
+    someone is watching it. When someone is, at most MJPEG_FPS frames per
+    second are annotated and JPEG-encoded at MJPEG_QUALITY on a small thread
+    pool (MJPEG_ENCODE_THREADS), never on the event loop. A channel has at
+    most one encode in flight; frames published meanwhile are skipped. Every
+    viewer of a channel gets the same encoded bytes.
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+MJPEG_ENABLED = os.getenv("MJPEG_ENABLED", "1") == "1"
+MJPEG_QUALITY = int(os.getenv("MJPEG_QUALITY", "75"))
+MJPEG_FPS = float(os.getenv("MJPEG_FPS", "5"))
+MJPEG_ENCODE_THREADS = int(os.getenv("MJPEG_ENCODE_THREADS", "2"))
+BOUNDARY = "frame"
+
+
+def draw_detections(frame, detections, class_label, box_size=None):
+    """
+    Boxes with class, freshness, confidence and (for priced detections)
+    action and price labels, drawn in place. `box_size` (w, h) is the image
+    the boxes were found on, if not the frame itself.
+    """
+    h, w = frame.shape[:2]
+    sx, sy = (w / box_size[0], h / box_size[1]) if box_size else (1.0, 1.0)
+    for detection in detections:
+        bx1, by1, bx2, by2 = detection["box"]
+        x1, y1, x2, y2 = int(bx1 * sx), int(by1 * sy), int(bx2 * sx), int(by2 * sy)
+        prediction = detection.get("prediction") or "unknown"
+        if prediction.startswith("rotten"):
+            color = (0, 0, 255)
+        elif prediction.startswith("fresh"):
+            color = (0, 255, 0)
+        else:
+            color = (160, 160, 160)
+        label = f'{class_label(detection.get("class_id", 0))} {prediction} {detection["confidence"]:.2f}'
+        pricing = detection.get("pricing")
+        if pricing is not None:
+            label += f' | {pricing["action"]} ${pricing["price_usd"]:.2f}'
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(frame, label, (x1, max(y1 - 8, 12)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1, cv2.LINE_AA)
+
+
+class AnnotatedFeed:
+    """The latest annotated JPEG of one channel, and how many viewers are waiting for the next."""
+
+    def __init__(self):
+        self.viewers = 0
+        self.jpeg = None
+        self.seq = 0
+        self.encoding = False
+        self.last_encoded = 0.0
+        self._changed = asyncio.Event()
+
+    def update(self, jpeg):
+        self.jpeg = jpeg
+        self.seq += 1
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def next(self, after, timeout):
+        """(seq, jpeg) once there is a frame newer than `after`, or the current one on timeout."""
+        if self.seq <= after:
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.seq, self.jpeg
+
+
+class MjpegOutput:
+    def __init__(self, class_label, box_size=None, quality=MJPEG_QUALITY, fps=MJPEG_FPS,
+                 threads=MJPEG_ENCODE_THREADS, enabled=MJPEG_ENABLED):
+        self.class_label = class_label
+        self.box_size = box_size
+        self.quality = quality
+        self.interval = 1.0 / fps if fps > 0 else 0.0
+        self.enabled = enabled
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="mjpeg")
+        self._tasks = set()
+        self._lock = threading.Lock()
+        self.encoded = 0
+        self.encode_ms = 0.0
+        self.bytes_out = 0
+        self.skipped_idle = 0
+        self.skipped_rate = 0
+        self.errors = 0
+
+    def offer(self, feed, frame, detections):
+        """Schedule an annotated encode of a published frame if the feed has viewers and is due. Returns at once."""
+        if feed.viewers == 0:
+            self.skipped_idle += 1
+            return
+        now = time.monotonic()
+        if feed.encoding or now - feed.last_encoded < self.interval:
+            self.skipped_rate += 1
+            return
+        feed.encoding = True
+        feed.last_encoded = now
+        task = asyncio.ensure_future(self._encode(feed, frame, detections))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _encode(self, feed, frame, detections):
+        loop = asyncio.get_running_loop()
+        try:
+            jpeg = await loop.run_in_executor(self.executor, self.render, frame, detections)
+            if jpeg is not None:
+                feed.update(jpeg)
+        except Exception as e:
+            self.errors += 1
+            print(f"Error encoding annotated frame: {e}")
+        finally:
+            feed.encoding = False
+
+    def render(self, frame, detections):
+        """Annotated JPEG bytes of a frame. Runs on the encode pool."""
+        started = time.perf_counter()
+        # The producer's frame is not ours to draw on
+        frame = frame.copy()
+        draw_detections(frame, detections, self.class_label, self.box_size)
+        ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            return None
+        jpeg = buffer.tobytes()
+        with self._lock:
+            self.encoded += 1
+            self.encode_ms += (time.perf_counter() - started) * 1000.0
+        return jpeg
+
+    async def parts(self, feed, timeout=5.0):
+        """multipart/x-mixed-replace body: one part per new annotated frame, for as long as the client reads."""
+        seq = 0
+        while True:
+            next_seq, jpeg = await feed.next(seq, timeout)
+            if jpeg is None or next_seq == seq:
+                continue
+            seq = next_seq
+            self.bytes_out += len(jpeg)
+            yield (f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(jpeg)}\r\n\r\n").encode() \
+                + jpeg + b"\r\n"
+
+    def stats(self):
+        with self._lock:
+            encoded, encode_ms = self.encoded, self.encode_ms
+        return {
+            "enabled": self.enabled,
+            "quality": self.quality,
+            "fps": round(1.0 / self.interval, 2) if self.interval else None,
+            "encoded": encoded,
+            "mean_encode_ms": round(encode_ms / encoded, 2) if encoded else None,
+            "bytes_out": self.bytes_out,
+            "skipped_idle": self.skipped_idle,
+            "skipped_rate": self.skipped_rate,
+            "errors": self.errors,
+            "in_flight": len(self._tasks),
+        }
@@ -0,0 +1,200 @@
+""" Versioned model registry with hot reload.
+
+    Each model slot (the YOLO detector, the spoilage classifier) keeps a set of
+    versions. A new version is loaded and warmed up on a background thread
+    while the current one keeps serving; once it is ready, promoting it is a
+    single reference swap. Request handlers take the active version once at
+    the start of a request (`registry.snapshot()`), so in-flight work finishes on
+    the version it started with and nothing needs to be restarted.
+
+    The active version and the one before it stay loaded for instant rollback;
+    older versions are unloaded (MODEL_KEEP_VERSIONS) and reloaded from disk if
+    promoted again.
+"""
+import hashlib
+import os
+import threading
+import time
+
+MODEL_KEEP_VERSIONS = int(os.getenv("MODEL_KEEP_VERSIONS", "2"))
+
+LOADING = "loading"
+READY = "ready"
+ACTIVE = "active"
+FAILED = "failed"
+UNLOADED = "unloaded"
+
+
+def file_version(path):
+    """Short content hash of a weights file, used as its default version id."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+class ModelVersion:
+    __slots__ = ("version", "path", "model", "status", "error", "loaded_at", "load_ms", "warmup_ms")
+
+    def __init__(self, version, path):
+        self.version = version
+        self.path = path
+        self.model = None
+        self.status = LOADING
+        self.error = None
+        self.loaded_at = None
+        self.load_ms = None
+        self.warmup_ms = None
+
+    def info(self):
+        return {
+            "version": self.version,
+            "path": self.path,
+            "status": self.status,
+            "error": self.error,
+            "loaded_at": self.loaded_at,
+            "load_ms": self.load_ms,
+            "warmup_ms": self.warmup_ms,
+        }
+
+
+class ModelRegistry:
+    def __init__(self, name, loader, warmup=None, keep=MODEL_KEEP_VERSIONS):
+        """
+        `loader(path, version)` returns the ready-to-serve object for a weights
+        file; `warmup(obj)` runs a dummy inference on it before it is promoted.
+        """
+        self.name = name
+        self.loader = loader
+        self.warmup = warmup
+        self.keep = max(1, keep)
+        self.versions = {}      # version -> ModelVersion, in registration order
+        self.history = []       # versions in promotion order, newest last
+        self._active = None     # ModelVersion currently serving
+        self._lock = threading.Lock()
+
+    def active(self):
+        """The serving model object, or None. Take it once per request."""
+        current = self._active
+        return current.model if current is not None else None
+
+    def active_version(self):
+        current = self._active
+        return current.version if current is not None else None
+
+    def snapshot(self):
+        """(model, version) of the serving entry, read together."""
+        current = self._active
+        if current is None:
+            return None, None
+        return current.model, current.version
+
+    def register(self, path, version=None, promote=True, background=True):
+        """Load a new version; promote it once warmed up if `promote` is set."""
+        if not os.path.exists(path):
+            raise ValueError(f"No weights file at {path}")
+        if version is None:
+            version = file_version(path)
+        with self._lock:
+            existing = self.versions.get(version)
+            if existing is not None and existing.status in (LOADING, ACTIVE):
+                raise ValueError(f"{self.name} version '{version}' is already {existing.status}")
+            entry = ModelVersion(version, path)
+            self.versions[version] = entry
+        if background:
+            threading.Thread(target=self._load, args=(entry, promote),
+                             name=f"load-{self.name}-{version}", daemon=True).start()
+        else:
+            self._load(entry, promote)
+        return entry
+
+    def _load(self, entry, promote, demote=None):
+        try:
+            started = time.perf_counter()
+            model = self.loader(entry.path, entry.version)
+            entry.load_ms = round((time.perf_counter() - started) * 1000, 1)
+            if self.warmup is not None:
+                started = time.perf_counter()
+                self.warmup(model)
+                entry.warmup_ms = round((time.perf_counter() - started) * 1000, 1)
+            entry.model = model
+            entry.loaded_at = time.time()
+            entry.status = READY
+            print(f"{self.name} version {entry.version} loaded in {entry.load_ms} ms")
+        except Exception as e:
+            entry.status = FAILED
+            entry.error = str(e)
+            print(f"Error loading {self.name} version {entry.version}: {e}")
+            return
+        if promote:
+            with self._lock:
+                self._promote_locked(entry.version, demote)
+
+    def promote(self, version):
+        """Make a ready version the serving one. Raises ValueError if it cannot be."""
+        with self._lock:
+            return self._promote_locked(version)
+
+    def rollback(self):
+        """Go back to the version promoted before the active one."""
+        with self._lock:
+            loading = [v for v, entry in self.versions.items() if entry.status == LOADING]
+            if loading:
+                # Its promotion would race this one
+                raise ValueError(f"{self.name} version '{loading[0]}' is still loading")
+            if len(self.history) < 2:
+                raise ValueError(f"No earlier {self.name} version to roll back to")
+            return self._promote_locked(self.history[-2], demote=self.history[-1])
+
+    def _promote_locked(self, version, demote=None):
+        """
+        promote() with the lock held. `demote` (a rollback's current version)
+        moves to the front of the history once the swap happens, to keep it
+        out of the way of the next rollback.
+        """
+        entry = self.versions.get(version)
+        if entry is None:
+            raise ValueError(f"Unknown {self.name} version '{version}'")
+        if entry.status == ACTIVE:
+            return entry
+        if entry.status == UNLOADED:
+            # Reload in the background; it promotes itself when ready
+            entry.status = LOADING
+            threading.Thread(target=self._load, args=(entry, True, demote),
+                             name=f"load-{self.name}-{version}", daemon=True).start()
+            return entry
+        if entry.status != READY:
+            raise ValueError(f"{self.name} version '{version}' is {entry.status}")
+
+        previous = self._active
+        if previous is not None:
+            previous.status = READY
+        entry.status = ACTIVE
+        # The swap itself: requests that already took the old model keep it
+        self._active = entry
+        if version in self.history:
+            self.history.remove(version)
+        self.history.append(version)
+        if demote is not None and demote in self.history:
+            self.history.remove(demote)
+            self.history.insert(0, demote)
+        self._unload_old()
+        print(f"{self.name} now serving version {version}")
+        return entry
+
+    def _unload_old(self):
+        loaded = [v for v in reversed(self.history) if self.versions[v].model is not None]
+        for version in loaded[self.keep:]:
+            entry = self.versions[version]
+            entry.model = None
+            entry.status = UNLOADED
+
+    def status(self):
+        with self._lock:
+            return {
+                "name": self.name,
+                "active": self.active_version(),
+                "history": list(self.history),
+                "versions": [entry.info() for entry in self.versions.values()],
+            }
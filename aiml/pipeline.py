@@ -0,0 +1,182 @@
+""" Composable in-process apple pipeline.
+
+    The detect -> classify -> sensor -> pricing chain behind /detect and the
+    image / video jobs is a sequence of stage objects that each fill in part
+    of a FrameRequest (the live stream path, analyze_stream_frame in app.py,
+    runs its own YOLO + CNN pass and then the sensor and pricing stages):
+
+        DetectStage     YOLO boxes -> one AppleItem (box + RGB crop) per apple
+        WholeImageStage the whole frame as one item (a photo of a single apple)
+        ClassifyStage   spoilage CNN score and fresh / rotten label per item
+        SensorStage     sensor readings per item (telemetry or simulated)
+        PricingStage    price decision per item, business context read once per frame
+
+    Stages are plain callables over one request and have a batch() form over
+    many; a Pipeline runs its stages in order with either. Batching lets YOLO
+    take several frames in one call and the CNN score the crops of every
+    frame at once. Model stages read from a ModelRegistry snapshot and record
+    the version they used in `request.versions`. Callers in the same process
+    compose stages directly rather than POSTing images to another endpoint.
+"""
+from abc import ABC, abstractmethod
+
+import cv2
+
+
+def safe_crop_box(box, frame_shape):
+    """
+    Ensure YOLO box coordinates are valid and inside frame bounds.
+    Returns clamped (x1, y1, x2, y2).
+    """
+    x1, y1, x2, y2 = box
+    h, w = frame_shape[:2]
+
+    # Round coordinates
+    x1 = max(0, min(int(round(x1)), w - 1))
+    y1 = max(0, min(int(round(y1)), h - 1))
+    x2 = max(x1 + 1, min(int(round(x2)), w))
+    y2 = max(y1 + 1, min(int(round(y2)), h))
+
+    return x1, y1, x2, y2
+
+
+class AppleItem:
+    __slots__ = ("box", "crop_box", "crop", "score", "prediction", "sensor_data", "sensor_source", "pricing")
+
+    def __init__(self, box, crop_box, crop):
+        self.box = box               # raw detector box (sensor simulation is seeded from it)
+        self.crop_box = crop_box     # clamped integer box on the decoded frame
+        self.crop = crop             # RGB uint8 array
+        self.score = None
+        self.prediction = None
+        self.sensor_data = None
+        self.sensor_source = None
+        self.pricing = None
+
+
+class FrameRequest:
+    __slots__ = ("frame", "scale", "full_size", "lot", "store", "items", "versions")
+
+    def __init__(self, frame, scale=1, full_size=None, lot=None, store=None):
+        self.frame = frame           # BGR, as decoded
+        self.scale = scale           # multiply frame coordinates by this to get source coordinates
+        self.full_size = full_size
+        self.lot = lot
+        self.store = store
+        self.items = []
+        self.versions = {}           # model name -> version used, in stage order
+
+
+class Stage(ABC):
+    @abstractmethod
+    def __call__(self, request):
+        """Fill in this stage's part of one FrameRequest."""
+
+    def batch(self, requests):
+        for request in requests:
+            self(request)
+
+
+class DetectStage(Stage):
+    def __init__(self, registry, conf=0.5):
+        self.registry = registry
+        self.conf = conf
+
+    def _collect(self, request, result):
+        for box in result.boxes.xyxy.cpu().numpy():
+            x1, y1, x2, y2 = safe_crop_box(box[:4], request.frame.shape)
+            crop = request.frame[y1:y2, x1:x2]
+            if crop.size == 0:
+                continue
+            request.items.append(AppleItem(box, [x1, y1, x2, y2], cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)))
+
+    def __call__(self, request):
+        self.batch([request])
+
+    def batch(self, requests):
+        if not requests:
+            return
+        model, version = self.registry.snapshot()
+        results = model([request.frame for request in requests] if len(requests) > 1 else requests[0].frame,
+                        conf=self.conf, device='cpu', verbose=False)
+        for request, result in zip(requests, results):
+            request.versions[self.registry.name] = version
+            self._collect(request, result)
+
+
+class WholeImageStage(Stage):
+    def __call__(self, request):
+        h, w = request.frame.shape[:2]
+        request.items.append(AppleItem(None, [0, 0, w, h], cv2.cvtColor(request.frame, cv2.COLOR_BGR2RGB)))
+
+
+class ClassifyStage(Stage):
+    def __init__(self, registry, threshold, labels=('freshapples', 'rottenapples')):
+        self.registry = registry
+        self.threshold = threshold
+        self.labels = labels
+
+    def __call__(self, request):
+        self.batch([request])
+
+    def batch(self, requests):
+        classifier, version = self.registry.snapshot()
+        items = [item for request in requests for item in request.items]
+        # One CNN call for the crops of every request
+        for item, score in zip(items, classifier.score([item.crop for item in items])):
+            item.score = score
+            item.prediction = self.labels[1] if score > self.threshold else self.labels[0]
+        for request in requests:
+            request.versions[self.registry.name] = version
+
+
+class SensorStage(Stage):
+    def __init__(self, sensor_fn):
+        """`sensor_fn(prediction, score, box, lot)` returns (sensor_data, source)."""
+        self.sensor_fn = sensor_fn
+
+    def __call__(self, request):
+        for item in request.items:
+            box = item.box if item.box is not None else item.crop_box
+            item.sensor_data, item.sensor_source = self.sensor_fn(item.prediction, item.score, box, request.lot)
+
+
+class PricingStage(Stage):
+    def __init__(self, price_fn, context_fn, shelf_life_fn=None):
+        """
+        `price_fn(prediction, score, sensor_data, context, shelf_life_days)` prices
+        one item, `context_fn(store)` reads the business context once per frame and
+        `shelf_life_fn(lot, scores)` returns the lot's remaining days (or None).
+        """
+        self.price_fn = price_fn
+        self.context_fn = context_fn
+        self.shelf_life_fn = shelf_life_fn
+
+    def __call__(self, request):
+        if not request.items:
+            return
+        shelf_life_days = None
+        if self.shelf_life_fn is not None and request.lot is not None:
+            shelf_life_days = self.shelf_life_fn(request.lot, [item.score for item in request.items])
+        context = self.context_fn(request.store)
+        for item in request.items:
+            item.pricing = self.price_fn(item.prediction, item.score, item.sensor_data, context, shelf_life_days)
+
+
+class Pipeline:
+    def __init__(self, *stages):
+        self.stages = stages
+
+    def then(self, *stages):
+        """A new pipeline with more stages appended."""
+        return Pipeline(*self.stages, *stages)
+
+    def run(self, request):
+        for stage in self.stages:
+            stage(request)
+        return request
+
+    def run_batch(self, requests):
+        for stage in self.stages:
+            stage.batch(requests)
+        return requests
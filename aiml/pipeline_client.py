@@ -0,0 +1,121 @@
+""" Pooled async client for the pipeline service.
+
+    When the sensor / pricing front end and the inference service are
+    deployed separately, the front end calls the service's /detect,
+    /predict_with_sensor and /predict_with_sensor/batch over HTTP. This client keeps one requests.Session
+    with a keep-alive connection pool of PIPELINE_CLIENT_POOL connections,
+    and runs the blocking calls on a thread pool of the same size so that
+    async handlers never block the event loop. There is no new TCP connection
+    per call, and the pool size caps in-flight calls. Failed connection
+    attempts are retried (PIPELINE_CLIENT_RETRIES); requests that reached the
+    server are not, since they may have done work.
+
+    In a single deployment, compose the stages in pipeline.py in-process
+    instead.
+"""
+import asyncio
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+PIPELINE_URL = os.getenv("PIPELINE_URL", "http://localhost:8000")
+PIPELINE_CLIENT_POOL = int(os.getenv("PIPELINE_CLIENT_POOL", "16"))
+PIPELINE_CLIENT_TIMEOUT_S = float(os.getenv("PIPELINE_CLIENT_TIMEOUT_S", "10"))
+PIPELINE_CLIENT_RETRIES = int(os.getenv("PIPELINE_CLIENT_RETRIES", "2"))
+
+
+class PipelineError(Exception):
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class PipelineClient:
+    def __init__(self, base_url=PIPELINE_URL, pool_size=PIPELINE_CLIENT_POOL,
+                 timeout_s=PIPELINE_CLIENT_TIMEOUT_S, retries=PIPELINE_CLIENT_RETRIES):
+        self.base_url = base_url.rstrip('/')
+        self.timeout_s = timeout_s
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True,
+                              max_retries=Retry(total=retries, connect=retries, read=0, status=0,
+                                                backoff_factor=0.1, allowed_methods=None))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="pipeline-client")
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+
+    def _post(self, path, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.session.post(self.base_url + path, timeout=self.timeout_s, **kwargs)
+        except requests.RequestException as e:
+            with self._lock:
+                self.calls += 1
+                self.errors += 1
+            raise PipelineError(502, f"Pipeline service unreachable: {e}")
+        with self._lock:
+            self.calls += 1
+            self.total_ms += (time.perf_counter() - started) * 1000.0
+            if response.status_code != 200:
+                self.errors += 1
+        if response.status_code != 200:
+            try:
+                detail = response.json().get('detail', response.text)
+            except ValueError:
+                detail = response.text
+            raise PipelineError(response.status_code, detail)
+        return response.json()
+
+    async def _call(self, path, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(self._post, path, **kwargs))
+
+    @staticmethod
+    def _params(lot, store):
+        return {key: value for key, value in (('lot', lot), ('store', store)) if value is not None}
+
+    async def detect(self, image, content_type='image/jpeg', lot=None, store=None):
+        """Every apple in an image with its price decision (the service's /detect response)."""
+        return await self._call('/detect', files={'file': ('image.jpg', image, content_type)},
+                                params=self._params(lot, store))
+
+    async def predict_with_sensor(self, image, content_type='image/jpeg', lot=None, store=None):
+        """Classification, sensor data and pricing for a photo of a single apple."""
+        return await self._call('/predict_with_sensor', files={'file': ('image.jpg', image, content_type)},
+                                params=self._params(lot, store))
+
+    def classify_batch(self, images, lot=None, store=None):
+        """
+        Blocking form of predict_with_sensor_batch, for callers that run their own
+        threads (the edge client). Shares the session's connection pool.
+        """
+        files = [('files', (f'crop{i}.jpg', image, 'image/jpeg')) for i, image in enumerate(images)]
+        return self._post('/predict_with_sensor/batch', files=files, params=self._params(lot, store))
+
+    async def predict_with_sensor_batch(self, images, lot=None, store=None):
+        """Classification, sensor data and pricing for several JPEG crops of one frame, in one request."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.classify_batch, images, lot, store)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "base_url": self.base_url,
+                "calls": self.calls,
+                "errors": self.errors,
+                "mean_ms": round(self.total_ms / self.calls, 2) if self.calls else None,
+            }
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
@@ -0,0 +1,254 @@
+""" Apple and milk pricing.
+
+    Simulated sensor readings, the business context read from the inventory
+    store and the apple / milk price engines, which evaluate the rule tables
+    in pricing_rules/. Everything here is plain Python over in-memory state:
+    the service (app.py), the job workers (job_handlers.py) and the benchmark
+    all import it without loading a model or starting the web app.
+"""
+import datetime
+import hashlib
+import math
+import os
+import random
+import time
+
+from event_log import event_log
+from inventory import InventoryStore
+from pipeline import FrameRequest, safe_crop_box
+from pricing_rules import PricingRules
+from sku_catalog import catalog, CatalogError
+
+
+def simulate_apple_sensor_data(prediction, confidence, box):
+
+    # using bounding box and prediction as seed, on a private generator: this runs on
+    # inference threads, where reseeding the global one would skew every other sampler
+    rng = seeded_rng(f"{box}-{prediction}")
+
+    if prediction == 'rottenapples':
+        ethylene = round(5.0 + (confidence * 5) + rng.uniform(-0.5, 0.5), 2)
+        ethylene = max(1.0, min(ethylene, 10.0))
+        temp = round(27.0 + rng.uniform(-1.0, 1.0), 1)
+        humidity = round(75.0 + rng.uniform(-2.0, 2.0), 1)
+    else:
+        ethylene = round(0.5 + (confidence * 0.5) + rng.uniform(-0.1, 0.1), 2)
+        ethylene = max(0.1, min(ethylene, 1.5))
+        temp = round(22.0 + rng.uniform(-1.0, 1.0), 1)
+        humidity = round(65.0 + rng.uniform(-2.0, 2.0), 1)
+
+    return {
+        'ethylene_ppm': ethylene,
+        'temperature_c': temp,
+        'humidity_percent': humidity
+    }
+
+
+APPLE_SENSORS = ('ethylene_ppm', 'temperature_c', 'humidity_percent')
+
+
+def apple_sensor_reading(prediction, confidence, box, readings):
+    """Sensor data from rolling `readings` (as telemetry.current returns them), simulated when None."""
+    if readings is None:
+        return simulate_apple_sensor_data(prediction, confidence, box), 'simulated'
+    return {
+        'ethylene_ppm': round(readings['ethylene_ppm'], 2),
+        'temperature_c': round(readings['temperature_c'], 1),
+        'humidity_percent': round(readings['humidity_percent'], 1)
+    }, 'telemetry'
+
+
+""" Business context (stock, sales rate, shelf life) comes from the inventory
+    store. Rows a sales feed has not set yet start from values seeded by
+    store and SKU, so repeated calls price the same way.
+"""
+DEFAULT_STORE = os.getenv("DEFAULT_STORE", "default")
+APPLE_SKU = "apples"
+
+
+def seeded_rng(key: str):
+    hash_bytes = hashlib.md5(key.encode()).digest()
+    return random.Random(int.from_bytes(hash_bytes[:4], 'big'))
+
+
+def default_inventory_row(store, sku):
+    """Initial stock, sales rate and shelf life for a store/SKU no feed has reported yet."""
+    if sku == APPLE_SKU:
+        rng = seeded_rng(f"{store}/{sku}")
+        shelf_life_days = 14
+        daily_sales_rate = rng.choice([15, 20, 30, 50, 70])
+        stock_level = rng.choice([60, 85, 100, 150, 180])
+        days_in_stock = rng.randint(0, shelf_life_days)
+    else:
+        # Same draws the per-SKU milk simulation used for the default store
+        rng = seeded_rng(sku + "biz" if store == DEFAULT_STORE else f"{store}/{sku}biz")
+        demand = rng.choice(['low', 'medium', 'high'])
+        daily_sales_rate = {
+            'low': rng.randint(10, 50),
+            'medium': rng.randint(50, 100),
+            'high': rng.randint(100, 200)
+        }[demand]
+        stock_level = rng.randint(100, 1000)
+        shelf_life_days = 14
+        days_in_stock = 0
+    return {
+        'stock_level': stock_level,
+        'daily_sales_rate': daily_sales_rate,
+        'shelf_life_days': shelf_life_days,
+        'received_at': time.time() - days_in_stock * 86400
+    }
+
+
+inventory = InventoryStore(default_inventory_row)
+
+pricing_rules = PricingRules()
+
+
+def dynamic_apple_price_engine(prediction, confidence, sensor_data, context=None, forecast_shelf_life_days=None):
+    if context is None:
+        context = inventory.context(DEFAULT_STORE, APPLE_SKU)
+    if forecast_shelf_life_days is not None:
+        # The lot's forecast replaces the stocked shelf life
+        context = dict(context, estimated_shelf_life_days=forecast_shelf_life_days)
+    # Thresholds and discounts live in pricing_rules/apple.json
+    result = pricing_rules.get('apple').evaluate({
+        'prediction': prediction,
+        'ethylene_ppm': sensor_data['ethylene_ppm'],
+        'daily_sales_rate': context['daily_sales_rate'],
+        'stock_level': context['stock_level'],
+        'estimated_shelf_life_days': context['estimated_shelf_life_days']
+    })
+    discount_percent = result['discount_percent']
+
+    return {
+        'action': result['action'],
+        'discount_applied': discount_percent > 0,
+        'discount_percent': round(discount_percent, 1),
+        'price_usd': result['price_usd'],
+        'message': result['message'],
+        'business_context': context,
+        'rules_version': result['rules_version']
+    }
+
+
+def scale_box_to_source(box, scale, full_size):
+    """Map a box found on a reduced-resolution decode back to source image coordinates."""
+    if scale == 1:
+        return box
+    x1, y1, x2, y2 = box
+    return list(safe_crop_box((x1 * scale, y1 * scale, x2 * scale, y2 * scale), (full_size[1], full_size[0])))
+
+
+def apple_detections(request: FrameRequest):
+    """Response rows for a request the pipeline has run; each decision goes to the event log. Returns (detections, model_version)."""
+    version = "+".join(f"{name}@{v}" for name, v in request.versions.items())
+    response_data = []
+    for item in request.items:
+        response_data.append({
+            "box": scale_box_to_source(item.crop_box, request.scale, request.full_size),
+            "prediction": item.prediction,
+            "confidence": item.score,
+            "sensor_data": item.sensor_data,
+            "sensor_source": item.sensor_source,
+            "pricing": item.pricing
+        })
+        event_log.record(
+            'apple_decision', store=request.store, sku=APPLE_SKU, lot=request.lot, prediction=item.prediction,
+            confidence=item.score, sensor_data=item.sensor_data, sensor_source=item.sensor_source,
+            action=item.pricing['action'], discount_percent=item.pricing['discount_percent'],
+            price_usd=item.pricing['price_usd'], rules_version=item.pricing['rules_version'], model_version=version
+        )
+    return response_data, version
+
+
+def simulate_milk_spoilage_data(sku):
+    today = datetime.datetime.today()
+    # Shelf-life and spoilage ranges per SKU come from the catalog
+    entry = catalog.get(sku, 'milk')
+    if entry is None:
+        raise CatalogError(f"Unknown milk SKU '{sku}'")
+    # Seeded randomness per SKU, on a private generator so concurrent lookups cannot interleave draws
+    rng = seeded_rng(sku)
+
+    shelf_life_days = rng.randint(entry.shelf_life_min, entry.shelf_life_max)
+    days_past_expiry = rng.randint(0, entry.past_expiry_max)
+    pH = round(rng.uniform(entry.pH_min, entry.pH_max), 2)
+    bacterial_load = round(rng.uniform(entry.bacteria_min, entry.bacteria_max), 2)
+
+    production_date = today - datetime.timedelta(days=shelf_life_days + days_past_expiry)
+    expiry_date = production_date + datetime.timedelta(days=shelf_life_days)
+    storage_temp = round(rng.uniform(0.0, 10.0), 1)
+
+    return {
+        'sku': sku,
+        'production_date': production_date.strftime('%Y-%m-%d'),
+        'expiry_date': expiry_date.strftime('%Y-%m-%d'),
+        'days_past_expiry': days_past_expiry,
+        'pH': pH,
+        'bacterial_load_log_cfu_ml': bacterial_load,
+        'storage_temperature_c': storage_temp
+    }
+
+
+def milk_business_context(sku: str, store: str = DEFAULT_STORE, context=None):
+    """Demand, sales rate and stock for a SKU, from the inventory or an already-read inventory `context`."""
+    context = context or inventory.context(store, sku)
+    sales_rate = context['daily_sales_rate']
+    demand = 'low' if sales_rate < 50 else 'medium' if sales_rate < 100 else 'high'
+    return {
+        'demand': demand,
+        'daily_sales_rate': sales_rate,
+        'stock_level': context['stock_level']
+    }
+
+
+def _predict_milk_spoilage(spoilage_data):
+    w1, w2, w3 = 0.5, -1.0, 0.8
+    b = -5.0
+    x1 = spoilage_data['days_past_expiry']
+    x2 = spoilage_data['pH']
+    x3 = spoilage_data['bacterial_load_log_cfu_ml']
+    z = w1 * x1 + w2 * x2 + w3 * x3 + b
+    probability = 1 / (1 + math.exp(-z))
+    prediction = 'spoiled' if probability > 0.5 else 'fresh'
+    return prediction, probability
+
+
+def dynamic_milk_price_engine(prediction, probability, spoilage_data, context):
+    days_to_expiry = max(0, (datetime.datetime.strptime(spoilage_data['expiry_date'], "%Y-%m-%d") - datetime.datetime.now()).days)
+
+    # Expiry and donate rules live in pricing_rules/milk.json, per-SKU price and thresholds in the catalog
+    entry = catalog.get(spoilage_data['sku'], 'milk')
+    result = pricing_rules.get('milk').evaluate({
+        'sku': spoilage_data['sku'],
+        'base_price': entry.base_price,
+        'pH_threshold': entry.pH_threshold,
+        'bacteria_threshold': entry.bacteria_threshold,
+        'prediction': prediction,
+        'days_past_expiry': spoilage_data['days_past_expiry'],
+        'days_to_expiry': days_to_expiry,
+        'pH': spoilage_data['pH'],
+        'bacterial_load_log_cfu_ml': spoilage_data['bacterial_load_log_cfu_ml'],
+        'stock_level': context['stock_level'],
+        'daily_sales_rate': context['daily_sales_rate']
+    })
+
+    return {
+        'action': result['action'],
+        'discount_applied': result['discount_percent'] > 0,
+        'discount_percent': result['discount_percent'],
+        'price_usd': result['price_usd'],
+        'message': result['message'],
+        'business_context': context,
+        'rules_version': result['rules_version']
+    }
+
+
+def generate_explanation_message(spoilage_data, prediction, probability):
+    return (
+        f"The prediction for {spoilage_data['sku']} was calculated using a logistic regression model "
+        f"based on spoilage indicators: pH={spoilage_data['pH']}, days past expiry={spoilage_data['days_past_expiry']}, "
+        f"and bacterial load={spoilage_data['bacterial_load_log_cfu_ml']} log CFU/mL. "
+        f"Probability of spoilage: {probability:.2f}. Storage temp: {spoilage_data['storage_temperature_c']}°C. "
+        f"Recommended action: '{prediction.upper()}' based on predicted safety and shelf risk."
+    )
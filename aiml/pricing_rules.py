@@ -0,0 +1,380 @@
+""" Declarative pricing rules.
+
+    Each product category has a decision table in PRICING_RULES_DIR
+    (<category>.json, or .yaml when PyYAML is installed):
+
+        {
+          "category": "apple",
+          "version": "1",
+          "base_price": 1.00,
+          "params": {"default": {...}, "<sku>": {...}},     optional, merged into the inputs
+          "derive": {"name": <expr>, ...},                  computed in order before the rules
+          "rules": [
+            {"when": <condition>, "then": {"action": "sell", "discount_percent": <expr>,
+                                           "price": <expr>, "message": "..."}},
+            ...
+          ]
+        }
+
+    The first rule whose condition holds wins. Expressions are numbers,
+    strings, null, {"var": "name"} or an operator object such as
+    {"sub": [a, b]}, {"mul": [...]}, {"div": [a, b]} (x/0 is infinity),
+    {"min": [...]}, {"max": [...]}, {"round": [x, digits]}. A condition maps
+    input names to tests ({"<": 3}, {"in": [...]}, a bare value for equality)
+    that must all hold, with {"all": [...]}, {"any": [...]} and {"not": ...}
+    for combining. "price" defaults to base_price less the discount.
+
+    Tables are compiled once into closures that evaluate a single item or,
+    with NumPy, whole columns at once. The registry re-reads a file when its
+    mtime changes (checked at most every PRICING_RELOAD_INTERVAL_S); a table
+    that fails to compile is reported and the previous one keeps serving.
+"""
+import glob
+import json
+import math
+import operator
+import os
+import threading
+import time
+
+import numpy as np
+
+try:
+    import yaml
+except ImportError:  # optional: JSON tables work without it
+    yaml = None
+
+PRICING_RULES_DIR = os.getenv("PRICING_RULES_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "pricing_rules"))
+PRICING_RELOAD_INTERVAL_S = float(os.getenv("PRICING_RELOAD_INTERVAL_S", "2"))
+
+COMPARISONS = {
+    '==': operator.eq, '!=': operator.ne,
+    '<': operator.lt, '<=': operator.le,
+    '>': operator.gt, '>=': operator.ge,
+}
+
+
+class RuleError(ValueError):
+    pass
+
+
+def _div_scalar(a, b):
+    return a / b if b else math.inf
+
+
+def _div_vector(a, b):
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(b != 0, a / np.where(b != 0, b, 1.0), np.inf)
+
+
+def round_vector(x, digits=0):
+    """np.round, except near-ties are settled by Python's round so both paths agree exactly."""
+    x = np.asarray(x, dtype=np.float64)
+    scale = 10.0 ** int(digits)
+    scaled = x * scale
+    result = np.round(scaled) / scale
+    ties = np.abs(np.abs(scaled - np.floor(scaled)) - 0.5) < 1e-6
+    if ties.any():
+        result = np.array(result, copy=True)
+        result[ties] = [round(v, int(digits)) for v in x[ties].tolist()]
+    return result
+
+
+def _fold(fn):
+    def apply(*args):
+        result = args[0]
+        for arg in args[1:]:
+            result = fn(result, arg)
+        return result
+    return apply
+
+
+OPERATORS = {
+    # name: (scalar implementation, vectorized implementation)
+    'add': (_fold(operator.add), _fold(operator.add)),
+    'sub': (operator.sub, operator.sub),
+    'mul': (_fold(operator.mul), _fold(operator.mul)),
+    'div': (_div_scalar, _div_vector),
+    'min': (min, _fold(np.minimum)),
+    'max': (max, _fold(np.maximum)),
+    'round': (round, round_vector),
+}
+
+
+def compile_expr(node, vector):
+    """Compile an expression into fn(inputs) -> value."""
+    if isinstance(node, dict):
+        if len(node) != 1:
+            raise RuleError(f"Expression must have exactly one operator: {node}")
+        (op, args), = node.items()
+        if op == 'var':
+            name = args
+            return lambda inputs: inputs[name]
+        if op not in OPERATORS:
+            raise RuleError(f"Unknown operator '{op}'")
+        fn = OPERATORS[op][1 if vector else 0]
+        parts = [compile_expr(arg, vector) for arg in (args if isinstance(args, list) else [args])]
+        return lambda inputs: fn(*(part(inputs) for part in parts))
+    if isinstance(node, list):
+        raise RuleError(f"Unexpected list in expression: {node}")
+    return lambda inputs: node
+
+
+def compile_condition(node, vector):
+    """Compile a condition into fn(inputs) -> bool (or a boolean array)."""
+    if node is None or node == {}:
+        return (lambda inputs: np.True_) if vector else (lambda inputs: True)
+    if not isinstance(node, dict):
+        raise RuleError(f"Condition must be an object: {node}")
+
+    tests = []
+    for key, spec in node.items():
+        if key in ('all', 'any'):
+            parts = [compile_condition(part, vector) for part in spec]
+            if key == 'all':
+                tests.append(_all(parts, vector))
+            else:
+                tests.append(_any(parts, vector))
+        elif key == 'not':
+            inner = compile_condition(spec, vector)
+            tests.append((lambda inputs: ~np.asarray(inner(inputs), dtype=bool)) if vector
+                         else (lambda inputs: not inner(inputs)))
+        else:
+            tests.extend(_field_tests(key, spec, vector))
+    return _all(tests, vector)
+
+
+def _field_tests(name, spec, vector):
+    if not isinstance(spec, dict) or 'var' in spec:
+        spec = {'==': spec}
+    tests = []
+    for op, operand in spec.items():
+        if op == 'in':
+            values = list(operand)
+            if vector:
+                tests.append(lambda inputs, v=values: np.isin(inputs[name], v))
+            else:
+                tests.append(lambda inputs, v=values: inputs[name] in v)
+            continue
+        if op not in COMPARISONS:
+            raise RuleError(f"Unknown comparison '{op}' for '{name}'")
+        compare = COMPARISONS[op]
+        rhs = compile_expr(operand, vector)
+        tests.append(lambda inputs, c=compare, r=rhs: c(inputs[name], r(inputs)))
+    return tests
+
+
+def _all(parts, vector):
+    if vector:
+        def test(inputs):
+            result = np.True_
+            for part in parts:
+                result = result & np.asarray(part(inputs), dtype=bool)
+            return result
+        return test
+    return lambda inputs: all(part(inputs) for part in parts)
+
+
+def _any(parts, vector):
+    if vector:
+        def test(inputs):
+            result = np.False_
+            for part in parts:
+                result = result | np.asarray(part(inputs), dtype=bool)
+            return result
+        return test
+    return lambda inputs: any(part(inputs) for part in parts)
+
+
+class PricingTable:
+    def __init__(self, spec, source=None):
+        self.category = spec.get('category')
+        self.version = str(spec.get('version', '0'))
+        self.source = source
+        self.base_price = float(spec.get('base_price', 0.0))
+        params = spec.get('params') or {}
+        self.default_params = params.get('default', {})
+        self.params = {key: dict(self.default_params, **value) for key, value in params.items() if key != 'default'}
+        derive = spec.get('derive') or {}
+        rules = spec.get('rules')
+        if not rules:
+            raise RuleError("Table has no rules")
+
+        self._derive = [(name, compile_expr(expr, False)) for name, expr in derive.items()]
+        self._derive_v = [(name, compile_expr(expr, True)) for name, expr in derive.items()]
+        self._rules = []
+        self._rules_v = []
+        self.actions = []
+        self.messages = []
+        for rule in rules:
+            then = rule.get('then') or {}
+            if 'action' not in then:
+                raise RuleError(f"Rule without an action: {rule}")
+            discount = then.get('discount_percent', 0)
+            price = then.get('price')
+            self._rules.append((
+                compile_condition(rule.get('when'), False),
+                then['action'],
+                compile_expr(discount, False),
+                compile_expr(price, False) if price is not None else None,
+                then.get('message'),
+            ))
+            self._rules_v.append((
+                compile_condition(rule.get('when'), True),
+                compile_expr(discount, True),
+                compile_expr(price, True) if price is not None else None,
+            ))
+            self.actions.append(then['action'])
+            self.messages.append(then.get('message'))
+
+    def _inputs(self, item):
+        inputs = dict(self.default_params)
+        inputs['base_price'] = self.base_price
+        if self.params:
+            inputs.update(self.params.get(item.get('sku'), {}))
+        inputs.update(item)
+        return inputs
+
+    def evaluate(self, item):
+        """Price one item: {action, discount_percent, price_usd, message, rules_version}."""
+        inputs = self._inputs(item)
+        for name, fn in self._derive:
+            inputs[name] = fn(inputs)
+        for condition, action, discount, price, message in self._rules:
+            if condition(inputs):
+                discount_percent = discount(inputs)
+                if price is None:
+                    value = round(inputs['base_price'] * (1 - discount_percent / 100), 2)
+                else:
+                    value = price(inputs)
+                return {
+                    'action': action,
+                    'discount_percent': discount_percent,
+                    'price_usd': value,
+                    'message': message,
+                    'rules_version': self.version,
+                }
+        raise RuleError(f"No {self.category} rule matched")
+
+    def evaluate_many(self, columns):
+        """
+        Vectorized evaluate over equal-length columns (scalars broadcast).
+        Returns columns: action, discount_percent, price_usd, message.
+        """
+        n = max((len(v) for v in columns.values() if isinstance(v, (list, np.ndarray))), default=1)
+        inputs = {}
+        skus = columns.get('sku')
+        for key, value in self.default_params.items():
+            inputs[key] = np.full(n, value, dtype=np.float64) if isinstance(value, (int, float)) else value
+        inputs['base_price'] = np.full(n, self.base_price)
+        if self.params and skus is not None:
+            skus = np.asarray(skus) if isinstance(skus, (list, np.ndarray)) else np.full(n, skus)
+            fallback = dict(self.default_params, base_price=self.base_price)
+            for name in {name for values in self.params.values() for name in values}:
+                inputs[name] = np.array([self.params.get(sku, fallback).get(name, fallback.get(name))
+                                         for sku in skus.tolist()])
+        for key, value in columns.items():
+            inputs[key] = np.asarray(value) if isinstance(value, (list, np.ndarray)) else np.full(n, value)
+        for name, fn in self._derive_v:
+            inputs[name] = fn(inputs)
+
+        rule_index = np.full(n, -1, dtype=np.int64)
+        discount = np.zeros(n, dtype=np.float64)
+        price = np.zeros(n, dtype=np.float64)
+        for i, (condition, discount_fn, price_fn) in enumerate(self._rules_v):
+            hit = (rule_index < 0) & np.broadcast_to(np.asarray(condition(inputs), dtype=bool), (n,))
+            if not hit.any():
+                continue
+            rule_index[hit] = i
+            d = np.broadcast_to(np.asarray(discount_fn(inputs), dtype=np.float64), (n,))
+            discount[hit] = d[hit]
+            if price_fn is None:
+                p = round_vector(inputs['base_price'] * (1 - d / 100), 2)
+            else:
+                p = np.broadcast_to(np.asarray(price_fn(inputs), dtype=np.float64), (n,))
+            price[hit] = p[hit]
+        if (rule_index < 0).any():
+            raise RuleError(f"No {self.category} rule matched {int((rule_index < 0).sum())} item(s)")
+        return {
+            'action': [self.actions[i] for i in rule_index.tolist()],
+            'discount_percent': discount,
+            'price_usd': price,
+            'message': [self.messages[i] for i in rule_index.tolist()],
+            'rules_version': self.version,
+        }
+
+
+def load_spec(path):
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise RuleError("PyYAML is not installed")
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+class PricingRules:
+    """Compiled tables by category, reloaded when their files change."""
+
+    def __init__(self, directory=PRICING_RULES_DIR, reload_interval=PRICING_RELOAD_INTERVAL_S):
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self.tables = {}      # category -> PricingTable
+        self.mtimes = {}      # path -> mtime last loaded (or attempted)
+        self.errors = {}      # path -> last compile error
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.reload(force=True)
+
+    def _paths(self):
+        patterns = ['*.json'] + (['*.yaml', '*.yml'] if yaml is not None else [])
+        return sorted(p for pattern in patterns for p in glob.glob(os.path.join(self.directory, pattern)))
+
+    def reload(self, force=False):
+        """Recompile changed tables. Returns the categories that were (re)loaded."""
+        loaded = []
+        with self._lock:
+            self._checked = time.monotonic()
+            for path in self._paths():
+                try:
+                    mtime = os.path.getmtime(path)
+                except OSError:
+                    continue
+                if not force and self.mtimes.get(path) == mtime:
+                    continue
+                self.mtimes[path] = mtime
+                try:
+                    spec = load_spec(path)
+                    table = PricingTable(spec, source=path)
+                    category = table.category or os.path.splitext(os.path.basename(path))[0]
+                    table.category = category
+                except Exception as e:
+                    # Keep serving the previous version of this table
+                    self.errors[path] = str(e)
+                    print(f"Error compiling pricing rules {path}: {e}")
+                    continue
+                self.errors.pop(path, None)
+                self.tables[category] = table
+                loaded.append(category)
+                print(f"Pricing rules '{category}' version {table.version} loaded")
+        return loaded
+
+    def get(self, category):
+        if time.monotonic() - self._checked >= self.reload_interval:
+            self.reload()
+        table = self.tables.get(category)
+        if table is None:
+            raise RuleError(f"No pricing rules for '{category}'")
+        return table
+
+    def status(self):
+        return {
+            "directory": self.directory,
+            "tables": {
+                category: {"version": table.version, "source": table.source, "rules": len(table.actions)}
+                for category, table in self.tables.items()
+            },
+            "errors": dict(self.errors),
+        }
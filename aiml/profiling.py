@@ -0,0 +1,222 @@
+""" On-demand request profiling.
+
+    A request is profiled when it carries an `X-Profile: 1` header, or when
+    sampling has been switched on through the admin endpoint. The header is
+    ignored unless PROFILE_ALLOW_HEADER=1 (or allow_header is set through the
+    admin endpoint), and it only counts on requests that also carry an
+    X-Admin-Token matching ADMIN_TOKEN (never when that is unset). The request is
+    wrapped in cProfile (and torch.profiler if requested) and the traces are
+    written to a bounded directory where they can be listed and downloaded.
+    When nothing is enabled the middleware is a straight pass-through.
+
+    Inference runs on worker threads, so work handed to a pool is wrapped with
+    `profiler.bind(fn)`; it profiles the worker side of the active capture and
+    is a no-op otherwise. On Python 3.12+ cProfile is process-wide, so the
+    capture's profiler covers worker threads itself and bind() adds nothing.
+"""
+import contextvars
+import cProfile
+import datetime
+import os
+import pstats
+import random
+import re
+import threading
+import time
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MAX_TRACES = int(os.getenv("PROFILE_MAX_TRACES", "50"))
+PROFILE_HEADER = b"x-profile"
+ADMIN_HEADER = b"x-admin-token"
+
+_active_capture = contextvars.ContextVar("active_capture", default=None)
+
+
+class Profiler:
+    def __init__(self, directory=PROFILE_DIR, max_traces=PROFILE_MAX_TRACES):
+        self.directory = directory
+        self.max_traces = max_traces
+        self.sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+        self.allow_header = os.getenv("PROFILE_ALLOW_HEADER", "0") == "1"
+        token = os.getenv("ADMIN_TOKEN")
+        self.admin_token = token.encode() if token else None
+        self.use_torch = os.getenv("PROFILE_TORCH", "0") == "1"
+        # cProfile and torch.profiler cannot be nested, so only one capture runs at a time
+        self._busy = threading.Lock()
+
+    @property
+    def active(self):
+        return self.allow_header or self.sample_rate > 0
+
+    def configure(self, sample_rate=None, allow_header=None, use_torch=None, max_traces=None):
+        if sample_rate is not None:
+            self.sample_rate = max(0.0, min(float(sample_rate), 1.0))
+        if allow_header is not None:
+            self.allow_header = bool(allow_header)
+        if use_torch is not None:
+            self.use_torch = bool(use_torch)
+        if max_traces is not None:
+            self.max_traces = max(1, int(max_traces))
+            self._prune()
+        return self.status()
+
+    def status(self):
+        return {
+            "sample_rate": self.sample_rate,
+            "allow_header": self.allow_header,
+            "use_torch": self.use_torch,
+            "max_traces": self.max_traces,
+            "directory": self.directory,
+            "traces": self.list_traces(),
+        }
+
+    def should_profile(self, headers):
+        if self.allow_header:
+            requested = authorized = None
+            for key, value in headers:
+                if key == PROFILE_HEADER:
+                    requested = value not in (b"0", b"false")
+                elif key == ADMIN_HEADER:
+                    authorized = value == self.admin_token
+            if requested is not None and self.admin_token is not None and authorized:
+                return requested
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def list_traces(self):
+        if not os.path.isdir(self.directory):
+            return []
+        traces = []
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            traces.append({"name": name, "bytes": os.path.getsize(path)})
+        return traces
+
+    def trace_path(self, name):
+        """Resolve a trace name to a path inside the profile directory, or None."""
+        if os.path.basename(name) != name:
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
+
+    def _prune(self):
+        """Keep only the newest `max_traces` captures (a capture may span several files)."""
+        if not os.path.isdir(self.directory):
+            return
+        captures = {}
+        for name in os.listdir(self.directory):
+            captures.setdefault(name.split(".", 1)[0], []).append(name)
+        for stem in sorted(captures)[:-self.max_traces]:
+            for name in captures[stem]:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def start(self, label):
+        """Begin a capture; returns a handle for `stop`, or None if one is already running."""
+        if not self._busy.acquire(blocking=False):
+            return None
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", label).strip("_")[:60]
+        capture = {
+            "stem": f"{stamp}-{slug}",
+            "started": time.perf_counter(),
+            "workers": [],   # cProfile.Profile objects from bound worker calls
+            "torch": [],     # torch.profiler.profile objects from bound worker calls
+        }
+        capture["cprofile"] = cProfile.Profile()
+        capture["cprofile"].enable()
+        capture["token"] = _active_capture.set(capture)
+        return capture
+
+    def bind(self, fn):
+        """Wrap `fn` so a worker thread profiles it for the active capture, if any."""
+        capture = _active_capture.get()
+        if capture is None:
+            return fn
+        use_torch = self.use_torch
+
+        def profiled(*args, **kwargs):
+            worker = cProfile.Profile()
+            torch_prof = None
+            if use_torch:
+                try:
+                    import torch
+                    torch_prof = torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU])
+                    torch_prof.__enter__()
+                except Exception as e:
+                    print(f"torch profiler unavailable: {e}")
+                    torch_prof = None
+            try:
+                worker.enable()
+            except ValueError:
+                # Python 3.12+ profiles through sys.monitoring, which allows one profiler per
+                # process; the capture's own profiler already sees this thread
+                worker = None
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                if worker is not None:
+                    worker.disable()
+                    capture["workers"].append(worker)
+                if torch_prof is not None:
+                    torch_prof.__exit__(None, None, None)
+                    capture["torch"].append(torch_prof)
+
+        return profiled
+
+    def stop(self, capture):
+        """Finish a capture, write its traces and return the file names."""
+        try:
+            capture["cprofile"].disable()
+            _active_capture.reset(capture["token"])
+            os.makedirs(self.directory, exist_ok=True)
+            names = [capture["stem"] + ".pstats"]
+            stats = pstats.Stats(capture["cprofile"])
+            for worker in capture["workers"]:
+                stats.add(worker)
+            stats.dump_stats(os.path.join(self.directory, names[0]))
+            for i, torch_prof in enumerate(capture["torch"]):
+                names.append(f"{capture['stem']}.{i}.trace.json")
+                torch_prof.export_chrome_trace(os.path.join(self.directory, names[-1]))
+            self._prune()
+            elapsed = (time.perf_counter() - capture["started"]) * 1000
+            print(f"Profiled {capture['stem']} in {elapsed:.1f} ms -> {', '.join(names)}")
+            return names
+        finally:
+            self._busy.release()
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that hands selected HTTP requests to the profiler."""
+
+    def __init__(self, app, profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http"
+                or not self.profiler.active
+                or scope["path"].startswith("/admin")
+                or not self.profiler.should_profile(scope["headers"])):
+            return await self.app(scope, receive, send)
+
+        capture = self.profiler.start(f"{scope['method']}{scope['path']}")
+        if capture is None:
+            return await self.app(scope, receive, send)
+
+        trace_header = (b"x-profile-trace", capture["stem"].encode())
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + [trace_header]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace)
+        finally:
+            self.profiler.stop(capture)
+
+
+profiler = Profiler()
@@ -0,0 +1,83 @@
+""" Per-connection frame-rate feedback for /ws/video.
+
+    Each stream keeps a StreamRateController that tracks how long its frames
+    take to decode and process. Every few seconds it produces a `rate_hint`
+    for the client (target fps, JPEG quality, max resolution). The hinted
+    resolution is also the decode target, so frames larger than it are
+    decoded at 1/2, 1/4 or 1/8 scale (see decoding.py) instead of in full.
+"""
+import os
+import time
+
+INFERENCE_SIZE = 640
+HINT_INTERVAL_S = float(os.getenv("RATE_HINT_INTERVAL_S", "2.0"))
+MAX_STREAM_FPS = float(os.getenv("MAX_STREAM_FPS", "15"))
+MIN_STREAM_FPS = 0.5
+# Frames larger than this (base64 chars) get a lower JPEG quality hint
+FRAME_BYTES_BUDGET = int(os.getenv("FRAME_BYTES_BUDGET", "120000"))
+
+
+class StreamRateController:
+    def __init__(self, target_size=(INFERENCE_SIZE, INFERENCE_SIZE), alpha=0.2):
+        self.target_size = target_size
+        self.alpha = alpha
+        self.full_size = None        # last seen full-resolution (w, h) of the client's frames
+        self.decode_factor = 1       # reduction used for the last frame
+        self.process_ms = None       # EWMA of decode + inference time
+        self.payload_chars = None    # EWMA of incoming frame size
+        self.frames = 0
+        self.last_hint_at = 0.0
+        self.last_hint = None
+
+    def _ewma(self, current, sample):
+        return sample if current is None else current + self.alpha * (sample - current)
+
+    def decode_target(self):
+        """Smallest (w, h) the next frame must be decoded at."""
+        if self.last_hint is not None:
+            return (self.last_hint["max_width"], self.last_hint["max_height"])
+        return self.target_size
+
+    def record_frame(self, full_size, decode_factor, payload_chars, process_ms):
+        """Update the stream's statistics after a frame has been handled."""
+        self.full_size = full_size
+        self.decode_factor = decode_factor
+        self.process_ms = self._ewma(self.process_ms, process_ms)
+        self.payload_chars = self._ewma(self.payload_chars, payload_chars)
+        self.frames += 1
+
+    def maybe_hint(self, server_fps=None):
+        """Return a rate_hint message when one is due, otherwise None."""
+        now = time.monotonic()
+        if self.process_ms is None or now - self.last_hint_at < HINT_INTERVAL_S:
+            return None
+        self.last_hint_at = now
+
+        # Leave ~20% headroom so the client does not sit exactly at capacity
+        target_fps = 0.8 * 1000.0 / max(self.process_ms, 1.0)
+        if server_fps is not None:
+            target_fps = min(target_fps, server_fps)
+        target_fps = round(max(MIN_STREAM_FPS, min(target_fps, MAX_STREAM_FPS)), 1)
+
+        jpeg_quality = 0.8
+        if self.payload_chars > FRAME_BYTES_BUDGET:
+            jpeg_quality = 0.6
+        if self.payload_chars > 2 * FRAME_BYTES_BUDGET:
+            jpeg_quality = 0.5
+
+        # Inference runs at INFERENCE_SIZE, anything larger is wasted bandwidth
+        max_width, max_height = self.target_size
+        if self.full_size is not None:
+            max_width = min(max_width, self.full_size[0])
+            max_height = min(max_height, self.full_size[1])
+
+        self.last_hint = {
+            "type": "rate_hint",
+            "target_fps": target_fps,
+            "jpeg_quality": jpeg_quality,
+            "max_width": max_width,
+            "max_height": max_height,
+            "server_process_ms": round(self.process_ms, 1),
+            "decode_scale": self.decode_factor,
+        }
+        return self.last_hint
@@ -0,0 +1,219 @@
+""" Result serialization for /ws/video.
+
+    Clients pick a wire format and schema with query parameters:
+
+        /ws/video?format=json|msgpack&schema=verbose|compact&delta=1
+
+    - format:  json is encoded with orjson when installed (falls back to the
+               json module); msgpack sends binary frames and needs msgpack.
+    - schema:  verbose is the original message shape. compact sends one
+               frame-level timestamp and each detection as an integer row,
+               described once by a `schema` message after connect.
+    - delta:   implies compact. Boxes are tracked across frames on the
+               connection and only added / changed / removed rows are sent,
+               with a full keyframe every KEYFRAME_INTERVAL frames, and
+               right after the connection had to drop one of its messages.
+"""
+import datetime
+import json
+import os
+import time
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+KEYFRAME_INTERVAL = int(os.getenv("DELTA_KEYFRAME_INTERVAL", "30"))
+
+VERBOSE = 'verbose'
+COMPACT = 'compact'
+
+COMPACT_FIELDS = ["x1", "y1", "x2", "y2", "confidence_permille", "class_id", "prediction_id"]
+PREDICTION_NAMES = ['fresh', 'rotten', 'unknown']
+PREDICTION_IDS = {name: i for i, name in enumerate(PREDICTION_NAMES)}
+
+
+def dumps_json(obj):
+    """JSON text, via orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+    return json.dumps(obj)
+
+
+def compact_row(detection):
+    x1, y1, x2, y2 = detection["box"]
+    return [
+        int(x1), int(y1), int(x2), int(y2),
+        int(round(detection["confidence"] * 1000)),
+        int(detection["class_id"]),
+        PREDICTION_IDS.get(detection.get("prediction", "unknown"), 2),
+    ]
+
+
+def _iou_matrix(a, b):
+    """Pairwise IoU between (n, 4) and (m, 4) box arrays."""
+    a = a[:, None, :].astype(np.float64)
+    b = b[None, :, :].astype(np.float64)
+    ix = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    iy = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    inter = ix * iy
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    return inter / np.maximum(area_a + area_b - inter, 1e-9)
+
+
+class DeltaEncoder:
+    """Tracks the rows last sent on a connection and diffs new frames against them."""
+
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL, iou_threshold=0.5,
+                 box_tolerance=4, confidence_tolerance=25):
+        self.keyframe_interval = keyframe_interval
+        self.iou_threshold = iou_threshold
+        self.box_tolerance = box_tolerance
+        self.confidence_tolerance = confidence_tolerance
+        self.tracks = {}   # track id -> last sent row
+        self.next_id = 0
+        self.frames = 0
+        self.needs_keyframe = False
+
+    def _changed(self, old, new):
+        return (max(abs(o - n) for o, n in zip(old[:4], new[:4])) > self.box_tolerance
+                or abs(old[4] - new[4]) > self.confidence_tolerance
+                or old[5:] != new[5:])
+
+    def _match(self, rows):
+        """Greedy IoU matching of new rows to existing tracks of the same class."""
+        ids = [None] * len(rows)
+        if not rows or not self.tracks:
+            return ids
+        track_ids = list(self.tracks)
+        old = np.array([self.tracks[t][:4] for t in track_ids])
+        new = np.array([r[:4] for r in rows])
+        iou = _iou_matrix(new, old)
+        for _ in range(min(len(rows), len(track_ids))):
+            i, j = np.unravel_index(np.argmax(iou), iou.shape)
+            if iou[i, j] < self.iou_threshold:
+                break
+            if rows[i][5] == self.tracks[track_ids[j]][5]:
+                ids[i] = track_ids[j]
+                iou[i, :] = -1
+                iou[:, j] = -1
+            else:
+                iou[i, j] = -1
+        return ids
+
+    def resync(self):
+        """The client missed a message of this stream; send a keyframe next."""
+        self.needs_keyframe = True
+
+    def encode(self, rows):
+        """Return ('keyframe', rows-with-ids) or ('delta', added, changed, removed)."""
+        ids = self._match(rows)
+        keyframe = self.needs_keyframe or self.frames % self.keyframe_interval == 0
+        self.needs_keyframe = False
+        self.frames += 1
+
+        added, changed = [], []
+        current = {}
+        for track_id, row in zip(ids, rows):
+            if track_id is None:
+                track_id = self.next_id
+                self.next_id += 1
+                added.append([track_id] + row)
+                current[track_id] = row
+            elif self._changed(self.tracks[track_id], row):
+                changed.append([track_id] + row)
+                current[track_id] = row
+            else:
+                # Unchanged: keep the row the client already has so drift accumulates to a change
+                current[track_id] = self.tracks[track_id]
+        removed = [t for t in self.tracks if t not in current]
+        self.tracks = current
+
+        if keyframe:
+            return 'keyframe', [[t] + row for t, row in current.items()]
+        return 'delta', added, changed, removed
+
+
+class ResultEncoder:
+    def __init__(self, fmt='json', schema=VERBOSE, delta=False):
+        if fmt == 'msgpack' and msgpack is None:
+            print("msgpack requested but not installed, using JSON")
+            fmt = 'json'
+        self.fmt = fmt
+        self.delta = DeltaEncoder() if delta else None
+        self.schema = COMPACT if delta else schema
+
+    @classmethod
+    def from_query(cls, params):
+        return cls(
+            fmt=params.get("format", "json"),
+            schema=params.get("schema", VERBOSE),
+            delta=params.get("delta", "0") in ("1", "true"),
+        )
+
+    def encode(self, message):
+        """Serialize any message; returns str for JSON or bytes for msgpack."""
+        if self.fmt == 'msgpack':
+            return msgpack.packb(message, use_bin_type=True)
+        return dumps_json(message)
+
+    def schema_message(self):
+        """Sent once after connect so compact clients can decode rows, or None."""
+        if self.schema != COMPACT:
+            return None
+        fields = (["track_id"] if self.delta else []) + COMPACT_FIELDS
+        return self.encode({
+            "type": "schema",
+            "format": self.fmt,
+            "delta": self.delta is not None,
+            "fields": fields,
+            "predictions": PREDICTION_NAMES,
+        })
+
+    def encode_results(self, detections, frame_count, class_label, model_version=None):
+        """
+        Encode one frame's detections. `detections` carry box, class_id,
+        confidence and prediction; class_label maps class_id to a name.
+        `model_version` identifies the models that produced them.
+        """
+        if self.schema == VERBOSE:
+            timestamp = datetime.datetime.now().isoformat()
+            message = {
+                "type": "detection_results",
+                "detections": [{
+                    "box": d["box"],
+                    "class": class_label(d["class_id"]),
+                    "confidence": d["confidence"],
+                    "prediction": d["prediction"],
+                    "timestamp": timestamp,
+                } for d in detections],
+                "frame_count": frame_count,
+                "timestamp": timestamp,
+            }
+            if model_version is not None:
+                message["model_version"] = model_version
+            return self.encode(message)
+
+        rows = [compact_row(d) for d in detections]
+        message = {"frame_count": frame_count, "ts": int(time.time() * 1000)}
+        if model_version is not None:
+            message["model_version"] = model_version
+        if self.delta is None:
+            message.update({"type": "detection_results", "detections": rows})
+        else:
+            encoded = self.delta.encode(rows)
+            if encoded[0] == 'keyframe':
+                message.update({"type": "detection_results", "keyframe": True, "detections": encoded[1]})
+            else:
+                _, added, changed, removed = encoded
+                message.update({"type": "detection_delta", "added": added, "changed": changed, "removed": removed})
+        return self.encode(message)
@@ -0,0 +1,139 @@
+""" Read-only model weights shared between worker processes.
+
+    With `uvicorn --workers N` every worker loads its own YOLO and ResNet50,
+    so each one pays the full weight size again. Here weights are loaded with
+    torch.load(mmap=True) and assigned into the module without copying, so the
+    tensors point straight at the file's pages in the OS page cache; all
+    workers mapping the same file share one physical copy. Models that
+    change their weights after loading (YOLO fuses conv+bn on first predict)
+    are fused first and written once to a weights cache file, which is then
+    mapped the same way.
+
+    The same applies to a `gunicorn --preload` setup, where workers inherit
+    the mapping across fork. SHARED_WEIGHTS=0 falls back to ordinary loads.
+
+    memory_report() reads /proc to give RSS and PSS (proportional set size:
+    shared pages divided between the processes mapping them) for this worker
+    and its sibling workers, which is the number to watch when adding workers.
+"""
+import os
+
+import torch
+
+SHARED_WEIGHTS = os.getenv("SHARED_WEIGHTS", "1") == "1"
+WEIGHTS_CACHE_DIR = os.getenv("WEIGHTS_CACHE_DIR", "models/cache")
+
+
+def load_state_dict(module, path, device=torch.device('cpu')):
+    """Load weights from `path` into `module`, memory-mapped when sharing is on and on CPU."""
+    if SHARED_WEIGHTS and device.type == 'cpu':
+        state = torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+        # assign=True keeps the mapped tensors instead of copying them into fresh parameters
+        module.load_state_dict(state, assign=True)
+    else:
+        module.load_state_dict(torch.load(path, map_location=device))
+    return module
+
+
+def share_module(module, tag):
+    """
+    Swap an already-loaded module's weights for a memory-mapped copy. The
+    module's state is written to WEIGHTS_CACHE_DIR/<tag>.pt the first time;
+    `tag` must change whenever the weights do (include the model version).
+    """
+    if not SHARED_WEIGHTS:
+        return module
+    os.makedirs(WEIGHTS_CACHE_DIR, exist_ok=True)
+    path = os.path.join(WEIGHTS_CACHE_DIR, f"{tag}.pt")
+    if not os.path.exists(path):
+        # Workers may start together; write to a private name and rename into place
+        tmp = f"{path}.{os.getpid()}.tmp"
+        torch.save(module.state_dict(), tmp)
+        os.replace(tmp, path)
+    return load_state_dict(module, path)
+
+
+def _smaps_rollup(pid):
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == 'kB':
+                    fields[parts[0].rstrip(':')] = int(parts[1])
+    except OSError:
+        return None
+    return fields
+
+
+def _mapped_weights_kb(pid):
+    """RSS and PSS of this process's mappings of .pt/.pth files."""
+    rss = pss = 0
+    current = False
+    try:
+        with open(f"/proc/{pid}/smaps") as f:
+            for line in f:
+                first = line.split(None, 1)[0]
+                if '-' in first and not first.endswith(':'):
+                    path = line.split()[-1] if len(line.split()) >= 6 else ''
+                    current = path.endswith(('.pt', '.pth'))
+                elif current and first == 'Rss:':
+                    rss += int(line.split()[1])
+                elif current and first == 'Pss:':
+                    pss += int(line.split()[1])
+    except OSError:
+        return None
+    return {"rss_mb": round(rss / 1024, 1), "pss_mb": round(pss / 1024, 1)}
+
+
+def _cmdline(pid):
+    try:
+        with open(f"/proc/{pid}/cmdline", 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _worker_pids():
+    """This process and its siblings (other workers started by the same parent)."""
+    parent = os.getppid()
+    own = _cmdline(os.getpid())
+    pids = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; ppid is the 2nd field after it
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == parent and _cmdline(entry) == own:
+            pids.append(int(entry))
+    return sorted(pids) or [os.getpid()]
+
+
+def memory_report():
+    if not os.path.exists('/proc/self/smaps_rollup'):
+        return {"supported": False}
+    workers = []
+    for pid in _worker_pids():
+        fields = _smaps_rollup(pid)
+        if fields is None:
+            continue
+        workers.append({
+            "pid": pid,
+            "self": pid == os.getpid(),
+            "rss_mb": round(fields.get("Rss", 0) / 1024, 1),
+            "pss_mb": round(fields.get("Pss", 0) / 1024, 1),
+            "shared_mb": round((fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0)) / 1024, 1),
+            "private_mb": round((fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)) / 1024, 1),
+            "weights": _mapped_weights_kb(pid),
+        })
+    return {
+        "supported": True,
+        "shared_weights": SHARED_WEIGHTS,
+        "workers": workers,
+        "total_rss_mb": round(sum(w["rss_mb"] for w in workers), 1),
+        "total_pss_mb": round(sum(w["pss_mb"] for w in workers), 1),
+    }
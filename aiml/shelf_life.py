@@ -0,0 +1,328 @@
+""" Incremental per-lot shelf-life forecasting.
+
+    Every lot (a shelf or batch id, the same key telemetry uses) keeps a small
+    fixed-size state that is updated in O(1) per event:
+
+    - sensor readings update the lot's feature vector, and a per-kind online
+      logistic model turns it into a current spoilage risk;
+    - detections (the CNN's spoilage scores for the lot's apples) and manual
+      observations are labels: they take one SGD step on the kind's model and
+      also count as a measured risk point;
+    - each risk point, as a logit, goes into an exponentially decayed linear
+      fit of risk over time (SHELF_LIFE_HALF_LIFE_H).
+
+    Remaining shelf life is the time until the fitted logit crosses 0 (50%
+    risk), capped by the nominal shelf life minus the lot's age.
+
+    Readings alone do not create a lot, since they do not say what the lot
+    holds: the latest value per sensor is buffered until the lot is tracked
+    or labelled, then applied. A lot first seen through a kind-less label
+    gets DEFAULT_KIND. If track() later names another kind, the kind is
+    corrected in place and the risk history is kept. The forecast
+    is stored with the time it was made, so a bulk query for every lot of a
+    store is just a read.
+
+    At most SHELF_LIFE_MAX_LOTS lots (and as many buffered ones) are kept; a
+    new lot evicts the least recently updated one, so lots that were sold
+    through or went quiet make room instead of blocking new ones.
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+SHELF_LIFE_HALF_LIFE_H = float(os.getenv("SHELF_LIFE_HALF_LIFE_H", "24"))
+SHELF_LIFE_LEARNING_RATE = float(os.getenv("SHELF_LIFE_LEARNING_RATE", "0.01"))
+SHELF_LIFE_MAX_LOTS = int(os.getenv("SHELF_LIFE_MAX_LOTS", "50000"))
+DEFAULT_KIND = os.getenv("SHELF_LIFE_DEFAULT_KIND", "apple")
+MIN_SLOPE_PER_DAY = 1e-3
+DAY_S = 86400.0
+
+# Feature order, initial weights (bias first) and neutral values per product kind
+KINDS = {
+    'apple': {
+        'features': ('ethylene_ppm', 'temperature_c', 'humidity_percent'),
+        'weights': (-6.0, 1.0, 0.05, 0.0),
+        'defaults': (0.5, 22.0, 65.0),
+        'nominal_days': 14,
+    },
+    'milk': {
+        'features': ('pH', 'temperature_c'),
+        'weights': (12.5, -2.5, 0.15),
+        'defaults': (6.6, 4.0),
+        'nominal_days': 18,
+    },
+}
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + math.exp(-max(-30.0, min(30.0, z))))
+
+
+def _logit(p):
+    p = min(max(p, 0.01), 0.99)
+    return math.log(p / (1.0 - p))
+
+
+class OnlineLogistic:
+    """Logistic regression trained one example at a time."""
+
+    def __init__(self, weights, learning_rate=SHELF_LIFE_LEARNING_RATE):
+        self.weights = np.array(weights, dtype=np.float64)
+        self.learning_rate = learning_rate
+        self.updates = 0
+
+    def predict(self, x):
+        return _sigmoid(float(self.weights[0] + np.dot(self.weights[1:], x)))
+
+    def update(self, x, target):
+        error = target - self.predict(x)
+        self.weights[0] += self.learning_rate * error
+        self.weights[1:] += self.learning_rate * error * x
+        self.updates += 1
+
+
+class LotState:
+    __slots__ = ("lot", "kind", "assumed", "features", "readings", "nominal_days", "started_at", "updated_at",
+                 "last_t", "sw", "st", "sy", "stt", "sty", "risk", "events",
+                 "remaining_days", "forecast_at")
+
+    def __init__(self, lot, kind, nominal_days, started_at, assumed=False):
+        self.lot = lot
+        self.kind = kind
+        self.assumed = assumed       # kind defaulted, not named by track() or a labelled detection
+        self.features = np.array(KINDS[kind]['defaults'], dtype=np.float64)
+        self.readings = {}           # sensor -> latest value, for every sensor seen (kind changes re-apply them)
+        self.nominal_days = nominal_days
+        self.started_at = started_at
+        self.updated_at = started_at
+        self.last_t = None
+        # Exponentially decayed sums for the logit-vs-time fit (t in days since start)
+        self.sw = self.st = self.sy = self.stt = self.sty = 0.0
+        self.risk = None
+        self.events = 0
+        self.remaining_days = float(nominal_days)
+        self.forecast_at = started_at
+
+    def set_reading(self, sensor, value):
+        """Record a sensor value; True if it is one of this kind's features."""
+        self.readings[sensor] = value
+        features = KINDS[self.kind]['features']
+        if sensor not in features:
+            return False
+        self.features[features.index(sensor)] = value
+        return True
+
+    def retype(self, kind, nominal_days=None):
+        """Switch to another kind, keeping the risk history and re-applying the readings seen so far."""
+        self.kind = kind
+        self.assumed = False
+        self.features = np.array(KINDS[kind]['defaults'], dtype=np.float64)
+        for sensor, value in list(self.readings.items()):
+            self.set_reading(sensor, value)
+        self.nominal_days = nominal_days or KINDS[kind]['nominal_days']
+        if self.events:
+            self._forecast(self.updated_at, self.last_t)
+        else:
+            self.remaining_days = float(self.nominal_days)
+
+    def add_point(self, now, risk, half_life_days):
+        t = (now - self.started_at) / DAY_S
+        if self.last_t is not None and t > self.last_t:
+            decay = 0.5 ** ((t - self.last_t) / half_life_days)
+            self.sw *= decay
+            self.st *= decay
+            self.sy *= decay
+            self.stt *= decay
+            self.sty *= decay
+        self.last_t = t if self.last_t is None else max(self.last_t, t)
+        y = _logit(risk)
+        self.sw += 1.0
+        self.st += t
+        self.sy += y
+        self.stt += t * t
+        self.sty += t * y
+        self.risk = risk
+        self.events += 1
+        self.updated_at = now
+        self._forecast(now, t)
+
+    def _forecast(self, now, t):
+        age_days = (now - self.started_at) / DAY_S
+        nominal_left = max(0.0, self.nominal_days - age_days)
+        denominator = self.sw * self.stt - self.st * self.st
+        slope = (self.sw * self.sty - self.st * self.sy) / denominator if denominator > 1e-9 else 0.0
+        intercept = (self.sy - slope * self.st) / self.sw
+        current = intercept + slope * t
+        if current >= 0.0 and self.risk is not None and self.risk >= 0.5:
+            remaining = 0.0
+        elif slope > MIN_SLOPE_PER_DAY:
+            remaining = min(nominal_left, max(0.0, -current / slope))
+        else:
+            remaining = nominal_left
+        self.remaining_days = remaining
+        self.forecast_at = now
+
+    def forecast(self, now):
+        elapsed_days = (now - self.forecast_at) / DAY_S
+        return {
+            "lot": self.lot,
+            "kind": self.kind,
+            "remaining_days": round(max(0.0, self.remaining_days - elapsed_days), 2),
+            "risk": round(self.risk, 4) if self.risk is not None else None,
+            "events": self.events,
+            "updated_at": self.updated_at,
+        }
+
+
+class ShelfLifeForecaster:
+    def __init__(self, half_life_h=SHELF_LIFE_HALF_LIFE_H, max_lots=SHELF_LIFE_MAX_LOTS):
+        self.half_life_days = half_life_h / 24.0
+        self.max_lots = max_lots
+        self.models = {kind: OnlineLogistic(spec['weights']) for kind, spec in KINDS.items()}
+        self.lots = OrderedDict()       # lot -> LotState, least recently updated first
+        self.pending = OrderedDict()    # untracked lot -> {sensor: (value, ts)}, applied when the lot is created
+        self._lock = threading.Lock()
+        self.evicted = 0
+        self.evicted_pending = 0
+
+    def track(self, lot, kind=DEFAULT_KIND, nominal_days=None, started_at=None):
+        """Register a lot (or update its kind / nominal shelf life / start time)."""
+        if kind not in KINDS:
+            raise ValueError(f"Unknown product kind '{kind}'")
+        with self._lock:
+            state = self.lots.get(lot)
+            if state is None:
+                state = self._create(lot, kind, nominal_days, started_at)
+            elif state.kind != kind and state.assumed:
+                # Only the default was wrong: keep what the lot has seen
+                state.retype(kind, nominal_days)
+                if started_at is not None:
+                    state.started_at = started_at
+            elif state.kind != kind:
+                # A tracked lot re-registered as another product starts over; its sensors still apply
+                previous = state
+                state = self.lots[lot] = LotState(
+                    lot, kind, nominal_days or KINDS[kind]['nominal_days'], started_at or time.time())
+                for sensor, value in previous.readings.items():
+                    state.set_reading(sensor, value)
+            else:
+                if nominal_days is not None:
+                    state.nominal_days = nominal_days
+                if started_at is not None:
+                    state.started_at = started_at
+            self.lots.move_to_end(lot)
+            return state
+
+    def ensure(self, lot, kind):
+        """
+        Forecast for a lot, tracking it as `kind` if unknown. Unlike track(), a
+        lot tracked as another kind is left alone and gives None.
+        """
+        if kind not in KINDS:
+            raise ValueError(f"Unknown product kind '{kind}'")
+        with self._lock:
+            state = self.lots.get(lot)
+            if state is None:
+                state = self._create(lot, kind)
+            elif state.kind != kind:
+                if not state.assumed:
+                    return None
+                state.retype(kind)
+                self.lots.move_to_end(lot)
+            return state.forecast(time.time())
+
+    def _create(self, lot, kind, nominal_days=None, started_at=None, assumed=False):
+        """Start a lot, evicting the least recently updated one if full, and apply its buffered readings."""
+        if self.lots and len(self.lots) >= self.max_lots:
+            self.lots.popitem(last=False)
+            self.evicted += 1
+        state = self.lots[lot] = LotState(
+            lot, kind, nominal_days or KINDS[kind]['nominal_days'], started_at or time.time(), assumed)
+        buffered = self.pending.pop(lot, None)
+        if buffered:
+            for sensor, (value, _) in buffered.items():
+                state.set_reading(sensor, value)
+            # The buffered readings count as one modelled risk point, at the newest reading
+            latest = max(ts for _, ts in buffered.values())
+            state.add_point(max(latest, state.started_at), self.models[kind].predict(state.features),
+                            self.half_life_days)
+        return state
+
+    def _state(self, lot, kind=None):
+        state = self.lots.get(lot)
+        if state is None:
+            return self._create(lot, kind or DEFAULT_KIND, assumed=kind is None)
+        self.lots.move_to_end(lot)
+        if kind is not None and state.assumed and state.kind != kind:
+            state.retype(kind)
+        return state
+
+    def observe_reading(self, lot, sensor, value, ts=None):
+        """A new (smoothed) sensor value for a lot: refresh its modelled risk, or buffer it until the lot is known."""
+        now = ts or time.time()
+        with self._lock:
+            state = self.lots.get(lot)
+            if state is None:
+                buffered = self.pending.get(lot)
+                if buffered is None:
+                    if self.pending and len(self.pending) >= self.max_lots:
+                        self.pending.popitem(last=False)
+                        self.evicted_pending += 1
+                    buffered = self.pending[lot] = {}
+                else:
+                    self.pending.move_to_end(lot)
+                buffered[sensor] = (value, now)
+                return
+            self.lots.move_to_end(lot)
+            if not state.set_reading(sensor, value):
+                return
+            risk = self.models[state.kind].predict(state.features)
+            state.add_point(now, risk, self.half_life_days)
+
+    def observe_label(self, lot, spoilage, kind=None, ts=None):
+        """A measured spoilage score in [0, 1] (detections or a manual check)."""
+        now = ts or time.time()
+        spoilage = min(max(float(spoilage), 0.0), 1.0)
+        with self._lock:
+            state = self._state(lot, kind)
+            self.models[state.kind].update(state.features, spoilage)
+            state.add_point(now, spoilage, self.half_life_days)
+
+    def forecast(self, lot):
+        with self._lock:
+            state = self.lots.get(lot)
+            return state.forecast(time.time()) if state is not None else None
+
+    def forecasts(self, prefix=None, lots=None):
+        """Current forecast for every lot, or those matching a prefix / id list."""
+        now = time.time()
+        with self._lock:
+            if lots is not None:
+                states = [self.lots[lot] for lot in lots if lot in self.lots]
+            elif prefix:
+                states = [s for lot, s in self.lots.items() if lot.startswith(prefix)]
+            else:
+                states = list(self.lots.values())
+            return [state.forecast(now) for state in states]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "lots": len(self.lots),
+                "pending_lots": len(self.pending),
+                "max_lots": self.max_lots,
+                "evicted_lots": self.evicted,
+                "evicted_pending_lots": self.evicted_pending,
+                "half_life_h": self.half_life_days * 24.0,
+                "models": {
+                    kind: {"weights": [round(w, 4) for w in model.weights.tolist()], "updates": model.updates}
+                    for kind, model in self.models.items()
+                },
+            }
+
+
+forecaster = ShelfLifeForecaster()
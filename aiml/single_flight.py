@@ -0,0 +1,91 @@
+""" Single-flight request coalescing with a short TTL cache.
+
+    When many clients ask for the same thing at once (every store device
+    calling /nearby-ngos with the same coordinates at shift start), only the
+    first call runs the lookup; identical calls that arrive while it is in
+    flight await the same task and get the same result. Results can then be
+    served from a TTL cache for a while, and a `cacheable(result)` predicate
+    keeps fallbacks (e.g. mock data after an API error) out of the cache.
+
+    The in-flight task is shielded, so a caller that goes away does not
+    cancel the work for the others. Synchronous functions run in a thread.
+    Keys are whatever the caller normalizes the parameters to.
+"""
+import asyncio
+import time
+
+
+class SingleFlight:
+    def __init__(self, name, ttl_s=0.0, max_entries=1024, cacheable=None):
+        self.name = name
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.cacheable = cacheable
+        self._in_flight = {}     # key -> asyncio.Task
+        self._cache = {}         # key -> (expires_at, result)
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self.cache_hits = 0
+        self.errors = 0
+
+    async def run(self, key, fn, *args):
+        """Result of `fn(*args)`, shared with every identical call in flight or cached under `key`."""
+        self.calls += 1
+        cached = self._cache.get(key)
+        if cached is not None:
+            if cached[0] > time.monotonic():
+                self.cache_hits += 1
+                return cached[1]
+            del self._cache[key]
+
+        task = self._in_flight.get(key)
+        if task is None:
+            self.executions += 1
+            task = self._in_flight[key] = asyncio.ensure_future(self._execute(key, fn, args))
+            # Retrieve the exception even if every caller went away, so it is not logged as unhandled
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def _execute(self, key, fn, args):
+        try:
+            if asyncio.iscoroutinefunction(fn):
+                result = await fn(*args)
+            else:
+                result = await asyncio.to_thread(fn, *args)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+        if self.ttl_s > 0 and (self.cacheable is None or self.cacheable(result)):
+            self._store(key, result)
+        return result
+
+    def _store(self, key, result):
+        now = time.monotonic()
+        if len(self._cache) >= self.max_entries:
+            for stale in [k for k, (expires, _) in self._cache.items() if expires <= now]:
+                del self._cache[stale]
+            # Still full: drop the oldest insertions
+            while len(self._cache) >= self.max_entries:
+                del self._cache[next(iter(self._cache))]
+        self._cache[key] = (now + self.ttl_s, result)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        return {
+            "ttl_s": self.ttl_s,
+            "calls": self.calls,
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "cache_hits": self.cache_hits,
+            "errors": self.errors,
+            "in_flight": len(self._in_flight),
+            "cached": len(self._cache),
+            "saved_ratio": round((self.coalesced + self.cache_hits) / self.calls, 3) if self.calls else 0.0,
+        }
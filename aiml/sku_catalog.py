@@ -0,0 +1,157 @@
+""" SKU catalog.
+
+    Per-SKU parameters (category, base price, simulated shelf-life and
+    spoilage ranges, safety thresholds) are loaded from CATALOG_PATH, a CSV
+    with one row per SKU:
+
+        sku,category,base_price,shelf_life_min,shelf_life_max,past_expiry_max,
+        pH_min,pH_max,bacteria_min,bacteria_max,pH_threshold,bacteria_threshold
+
+    Empty threshold cells fall back to CATALOG_DEFAULTS. Each load builds an
+    immutable snapshot: a dict from SKU to a `__slots__` entry for single
+    lookups plus NumPy columns over the same rows for bulk lookups. Reloads
+    and upserts build a new snapshot and swap the reference, so readers
+    always see either the old catalog or the new one, never a mix.
+"""
+import csv
+import os
+import threading
+
+import numpy as np
+
+CATALOG_PATH = os.getenv("CATALOG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalog", "skus.csv"))
+
+FIELDS = ('base_price', 'shelf_life_min', 'shelf_life_max', 'past_expiry_max',
+          'pH_min', 'pH_max', 'bacteria_min', 'bacteria_max', 'pH_threshold', 'bacteria_threshold')
+INTEGER_FIELDS = ('shelf_life_min', 'shelf_life_max', 'past_expiry_max')
+CATALOG_DEFAULTS = {'pH_threshold': 5.5, 'bacteria_threshold': 8.0}
+
+
+class CatalogError(ValueError):
+    pass
+
+
+class SkuEntry:
+    __slots__ = ('sku', 'category', 'row') + FIELDS
+
+    def __init__(self, sku, category, row, values):
+        self.sku = sku
+        self.category = category
+        self.row = row
+        for name in FIELDS:
+            setattr(self, name, values[name])
+
+    def as_dict(self):
+        return dict({'sku': self.sku, 'category': self.category},
+                    **{name: getattr(self, name) for name in FIELDS})
+
+
+def parse_row(raw):
+    """Validate one catalog row (CSV strings or JSON values) into (sku, category, values)."""
+    sku = str(raw.get('sku') or '').strip()
+    if not sku:
+        raise CatalogError(f"Row without a sku: {raw}")
+    category = str(raw.get('category') or 'milk').strip()
+    values = {}
+    for name in FIELDS:
+        value = raw.get(name)
+        if value is None or value == '':
+            if name not in CATALOG_DEFAULTS:
+                raise CatalogError(f"'{sku}' is missing {name}")
+            value = CATALOG_DEFAULTS[name]
+        try:
+            values[name] = int(value) if name in INTEGER_FIELDS else float(value)
+        except (TypeError, ValueError):
+            raise CatalogError(f"'{sku}' has a bad {name}: {value!r}")
+    if values['shelf_life_min'] > values['shelf_life_max'] or values['pH_min'] > values['pH_max'] \
+            or values['bacteria_min'] > values['bacteria_max']:
+        raise CatalogError(f"'{sku}' has a range with min above max")
+    return sku, category, values
+
+
+class CatalogSnapshot:
+    """Immutable view of the catalog at one version."""
+
+    def __init__(self, rows, version, source):
+        self.version = version
+        self.source = source
+        # A later row for the same SKU replaces the earlier one but keeps its position
+        latest = {}
+        for sku, category, values in rows:
+            latest[sku] = (category, values)
+        self.entries = {sku: SkuEntry(sku, category, row, values)
+                        for row, (sku, (category, values)) in enumerate(latest.items())}
+        ordered = list(self.entries.values())
+        self.columns = {name: np.array([getattr(e, name) for e in ordered], dtype=np.float64) for name in FIELDS}
+        self.by_category = {}
+        for entry in ordered:
+            self.by_category.setdefault(entry.category, []).append(entry.sku)
+
+
+class SkuCatalog:
+    def __init__(self, path=CATALOG_PATH):
+        self.path = path
+        self.snapshot = CatalogSnapshot([], 0, None)
+        self._write_lock = threading.Lock()   # serializes writers; readers never lock
+        self.error = None
+        if os.path.exists(path):
+            self.reload()
+
+    def reload(self):
+        """Re-read the catalog file. A file with any bad row leaves the current catalog in place."""
+        with self._write_lock:
+            try:
+                with open(self.path, newline='') as f:
+                    rows = [parse_row(raw) for raw in csv.DictReader(f)]
+            except (OSError, CatalogError) as e:
+                self.error = str(e)
+                raise CatalogError(f"Catalog not reloaded: {e}")
+            self.error = None
+            self.snapshot = CatalogSnapshot(rows, self.snapshot.version + 1, self.path)
+            print(f"SKU catalog version {self.snapshot.version} loaded: {len(rows)} SKUs")
+            return self.snapshot.version
+
+    def upsert(self, raw_rows):
+        """Add or replace SKUs in one atomic swap. Every row is validated first; any bad row rejects the batch."""
+        parsed = [parse_row(raw) for raw in raw_rows]
+        with self._write_lock:
+            current = self.snapshot
+            rows = [(e.sku, e.category, {name: getattr(e, name) for name in FIELDS})
+                    for e in current.entries.values()]
+            self.snapshot = CatalogSnapshot(rows + parsed, current.version + 1, current.source)
+            return self.snapshot.version
+
+    def get(self, sku, category=None):
+        """Entry for a SKU (optionally required to be in a category), or None."""
+        entry = self.snapshot.entries.get(sku)
+        if entry is None or (category is not None and entry.category != category):
+            return None
+        return entry
+
+    def skus(self, category=None):
+        snapshot = self.snapshot
+        if category is None:
+            return list(snapshot.entries)
+        return list(snapshot.by_category.get(category, ()))
+
+    def columns(self, skus):
+        """Parameter columns for a list of SKUs. Raises CatalogError naming the first unknown one."""
+        snapshot = self.snapshot
+        try:
+            rows = np.fromiter((snapshot.entries[sku].row for sku in skus), dtype=np.int64, count=len(skus))
+        except KeyError as e:
+            raise CatalogError(f"Unknown SKU {e}")
+        return {name: column[rows] for name, column in snapshot.columns.items()}
+
+    def stats(self):
+        snapshot = self.snapshot
+        return {
+            "version": snapshot.version,
+            "source": snapshot.source,
+            "skus": len(snapshot.entries),
+            "categories": {category: len(skus) for category, skus in snapshot.by_category.items()},
+            "error": self.error,
+        }
+
+
+catalog = SkuCatalog()
@@ -0,0 +1,319 @@
+""" Sensor telemetry store.
+
+    Real ethylene / temperature / humidity / pH readings arrive keyed by lot
+    (a shelf or batch id) over POST /telemetry or /ws/telemetry. Each
+    (lot, sensor) pair has a fixed-size NumPy ring buffer of the last
+    TELEMETRY_WINDOW readings, and the rolling mean, min, max and
+    least-squares slope over that window are kept up to date as readings
+    arrive, so the pricing engines read a lot's current state in O(1) instead
+    of simulating it. Lots with no reading in TELEMETRY_MAX_AGE_S are treated
+    as having no telemetry and the engines fall back to simulation. At most
+    TELEMETRY_MAX_SERIES series are kept; a new one evicts the series that
+    was updated least recently.
+
+    Single readings update the aggregates incrementally; large batches are
+    written into the ring with one slice assignment and the aggregates are
+    recomputed vectorized over the window. Listeners registered with
+    subscribe() get each touched series' new rolling mean after a batch.
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+SENSORS = ('ethylene_ppm', 'temperature_c', 'humidity_percent', 'pH')
+
+TELEMETRY_WINDOW = int(os.getenv("TELEMETRY_WINDOW", "120"))
+TELEMETRY_MAX_AGE_S = float(os.getenv("TELEMETRY_MAX_AGE_S", "900"))
+TELEMETRY_MAX_SERIES = int(os.getenv("TELEMETRY_MAX_SERIES", "10000"))
+
+
+class SensorSeries:
+    __slots__ = ("times", "values", "capacity", "count", "head", "origin",
+                 "sum_v", "sum_t", "sum_tt", "sum_tv", "min_v", "max_v",
+                 "_minmax_stale", "_appends", "last_value", "last_time")
+
+    def __init__(self, capacity=TELEMETRY_WINDOW):
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.values = np.zeros(capacity, dtype=np.float64)
+        self.count = 0
+        self.head = 0            # next write position
+        self.origin = None       # times are stored relative to this to keep the slope sums exact
+        self.sum_v = self.sum_t = self.sum_tt = self.sum_tv = 0.0
+        self.min_v = self.max_v = None
+        self._minmax_stale = False
+        self._appends = 0
+        self.last_value = None
+        self.last_time = None
+
+    def append(self, t, v):
+        if self.origin is None:
+            self.origin = t
+        rt = t - self.origin
+        if self.count == self.capacity:
+            old_t = self.times[self.head]
+            old_v = self.values[self.head]
+            self.sum_v -= old_v
+            self.sum_t -= old_t
+            self.sum_tt -= old_t * old_t
+            self.sum_tv -= old_t * old_v
+            # Only an evicted extreme forces a rescan for min/max
+            if old_v == self.min_v or old_v == self.max_v:
+                self._minmax_stale = True
+        else:
+            self.count += 1
+        self.times[self.head] = rt
+        self.values[self.head] = v
+        self.head = (self.head + 1) % self.capacity
+        self.sum_v += v
+        self.sum_t += rt
+        self.sum_tt += rt * rt
+        self.sum_tv += rt * v
+        if not self._minmax_stale:
+            self.min_v = v if self.min_v is None else min(self.min_v, v)
+            self.max_v = v if self.max_v is None else max(self.max_v, v)
+        self.last_value = v
+        self.last_time = t
+
+        # Running sums drift with enough add/subtract cycles; resync once per window
+        self._appends += 1
+        if self._appends >= self.capacity:
+            self._recompute()
+
+    def extend(self, times, values):
+        """Append many readings (arrays in time order)."""
+        n = len(values)
+        if n == 0:
+            return
+        if n < self.capacity // 8:
+            for t, v in zip(times.tolist(), values.tolist()):
+                self.append(t, v)
+            return
+        if self.origin is None:
+            self.origin = float(times[0])
+        times = times[-self.capacity:] - self.origin
+        values = values[-self.capacity:]
+        n = len(values)
+        # Write the batch into the ring in at most two slices
+        first = min(n, self.capacity - self.head)
+        self.times[self.head:self.head + first] = times[:first]
+        self.values[self.head:self.head + first] = values[:first]
+        if first < n:
+            self.times[:n - first] = times[first:]
+            self.values[:n - first] = values[first:]
+        self.head = (self.head + n) % self.capacity
+        self.count = min(self.capacity, self.count + n)
+        self.last_value = float(values[-1])
+        self.last_time = float(times[-1]) + self.origin
+        self._recompute()
+
+    def _window(self):
+        if self.count < self.capacity:
+            return self.times[:self.count], self.values[:self.count]
+        return self.times, self.values
+
+    def _recompute(self):
+        t, v = self._window()
+        self.sum_v = float(v.sum())
+        self.sum_t = float(t.sum())
+        self.sum_tt = float(np.dot(t, t))
+        self.sum_tv = float(np.dot(t, v))
+        self.min_v = float(v.min()) if self.count else None
+        self.max_v = float(v.max()) if self.count else None
+        self._minmax_stale = False
+        self._appends = 0
+
+    def aggregates(self):
+        if self.count == 0:
+            return None
+        if self._minmax_stale:
+            _, v = self._window()
+            self.min_v = float(v.min())
+            self.max_v = float(v.max())
+            self._minmax_stale = False
+        n = self.count
+        denominator = n * self.sum_tt - self.sum_t * self.sum_t
+        slope = (n * self.sum_tv - self.sum_t * self.sum_v) / denominator if denominator > 0 else 0.0
+        return {
+            "last": self.last_value,
+            "mean": self.sum_v / n,
+            "min": self.min_v,
+            "max": self.max_v,
+            "slope_per_hour": slope * 3600.0,
+            "count": n,
+            "updated_at": self.last_time,
+        }
+
+
+class TelemetryStore:
+    def __init__(self, window=TELEMETRY_WINDOW, max_age_s=TELEMETRY_MAX_AGE_S,
+                 max_series=TELEMETRY_MAX_SERIES):
+        self.window = window
+        self.max_age_s = max_age_s
+        self.max_series = max_series
+        self.series = OrderedDict()     # (lot, sensor) -> SensorSeries, least recently updated first
+        self.lots = {}                  # lot -> {sensor: SensorSeries}
+        self._lock = threading.Lock()
+        self.listeners = []
+        self.accepted = 0
+        self.rejected = 0
+        self.evicted = 0
+
+    def subscribe(self, listener):
+        """Call `listener(lot, sensor, rolling_mean, last_time)` for every series a batch touches."""
+        self.listeners.append(listener)
+
+    def _series(self, lot, sensor):
+        """The series to write a reading to, created (evicting the stalest one if full) when new."""
+        key = (lot, sensor)
+        series = self.series.get(key)
+        if series is not None:
+            self.series.move_to_end(key)
+            return series
+        if self.series and len(self.series) >= self.max_series:
+            (old_lot, old_sensor), _ = self.series.popitem(last=False)
+            sensors = self.lots.get(old_lot)
+            if sensors is not None:
+                sensors.pop(old_sensor, None)
+                if not sensors:
+                    del self.lots[old_lot]
+            self.evicted += 1
+        series = self.series[key] = SensorSeries(self.window)
+        self.lots.setdefault(lot, {})[sensor] = series
+        return series
+
+    def ingest(self, message):
+        """
+        Store a batch. `message` holds `readings` ([{lot, sensor, value, ts?}])
+        and/or columnar `series` ([{lot, sensor, ts: [...], values: [...]}]).
+        Returns (accepted, rejected); malformed entries are rejected, never raised.
+        """
+        now = time.time()
+        accepted = rejected = 0
+        readings = message.get("readings") or []
+        blocks = message.get("series") or []
+        if not isinstance(readings, list):
+            readings = []
+            rejected += 1
+        if not isinstance(blocks, list):
+            blocks = []
+            rejected += 1
+
+        # Group single readings per series so each one is extended once
+        grouped = {}
+        for reading in readings:
+            try:
+                key = (str(reading["lot"]), reading["sensor"])
+                value = float(reading["value"])
+                ts = float(reading.get("ts", now))
+            except (KeyError, TypeError, ValueError):
+                rejected += 1
+                continue
+            # float() accepts "nan" and "inf"; a NaN pH would pass every threshold rule
+            if not isinstance(key[1], str) or key[1] not in SENSORS \
+                    or not (math.isfinite(value) and math.isfinite(ts)):
+                rejected += 1
+                continue
+            times, values = grouped.setdefault(key, ([], []))
+            times.append(ts)
+            values.append(value)
+
+        columns = []
+        for key, (times, values) in grouped.items():
+            columns.append((key, times, values))
+        for block in blocks:
+            values = None
+            try:
+                key = (str(block["lot"]), block["sensor"])
+                values = block["values"]
+                times = block.get("ts") or [now] * len(values)
+                if not (isinstance(values, list) and isinstance(times, list) and len(times) == len(values)):
+                    raise ValueError("ts and values must be lists of the same length")
+            except (KeyError, TypeError, ValueError):
+                rejected += len(values) if isinstance(values, list) and values else 1
+                continue
+            if not isinstance(key[1], str) or key[1] not in SENSORS:
+                rejected += len(values)
+                continue
+            columns.append((key, times, values))
+
+        touched = []
+        with self._lock:
+            for (lot, sensor), times, values in columns:
+                try:
+                    t = np.asarray(times, dtype=np.float64)
+                    v = np.asarray(values, dtype=np.float64)
+                except (TypeError, ValueError):
+                    rejected += len(values)
+                    continue
+                # Nested lists make 2-D arrays; only flat columns are readings
+                if t.ndim != 1 or v.ndim != 1:
+                    rejected += len(values)
+                    continue
+                finite = np.isfinite(t) & np.isfinite(v)
+                if not finite.all():
+                    rejected += int(len(v) - finite.sum())
+                    t, v = t[finite], v[finite]
+                    if not len(v):
+                        continue
+                series = self._series(lot, sensor)
+                if len(t) > 1 and np.any(np.diff(t) < 0):
+                    order = np.argsort(t, kind='stable')
+                    t, v = t[order], v[order]
+                series.extend(t, v)
+                accepted += len(v)
+                if len(v):
+                    touched.append((lot, sensor, series.sum_v / series.count, series.last_time))
+            self.accepted += accepted
+            self.rejected += rejected
+        for listener in self.listeners:
+            for update in touched:
+                listener(*update)
+        return accepted, rejected
+
+    def aggregates(self, lot):
+        """Rolling aggregates for every sensor of a lot: {sensor: {...}}."""
+        with self._lock:
+            sensors = self.lots.get(lot)
+            if not sensors:
+                return None
+            return {sensor: series.aggregates() for sensor, series in sensors.items()}
+
+    def current(self, lot, sensors):
+        """
+        Rolling mean of each requested sensor for a lot, or None unless every
+        one of them has a reading newer than max_age_s.
+        """
+        if lot is None:
+            return None
+        cutoff = time.time() - self.max_age_s
+        with self._lock:
+            by_sensor = self.lots.get(lot)
+            if not by_sensor:
+                return None
+            values = {}
+            for sensor in sensors:
+                series = by_sensor.get(sensor)
+                if series is None or series.count == 0 or series.last_time < cutoff:
+                    return None
+                values[sensor] = series.sum_v / series.count
+            return values
+
+    def stats(self):
+        with self._lock:
+            return {
+                "lots": len(self.lots),
+                "series": len(self.series),
+                "max_series": self.max_series,
+                "window": self.window,
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "evicted": self.evicted,
+            }
+
+
+telemetry = TelemetryStore()
@@ -24,6 +24,14 @@ const VideoPrediction: React.FC = () => {
   const animationFrameRef = useRef<number | null>(null);
   const lastFrameTimeRef = useRef<number>(0);
   const frameCountRef = useRef<number>(0);
+  // Server-driven send pacing: minimum gap between frames and a pause deadline
+  const minFrameIntervalRef = useRef<number>(0);
+  const pausedUntilRef = useRef<number>(0);
+  const lastSentTimeRef = useRef<number>(0);
+  // Encoding parameters suggested by the server's rate_hint messages
+  const jpegQualityRef = useRef<number>(0.8);
+  const maxFrameSizeRef = useRef<{ width: number; height: number } | null>(null);
+  const encodeCanvasRef = useRef<HTMLCanvasElement | null>(null);
 
   const startStream = useCallback(async () => {
     try {
@@ -64,6 +72,16 @@ const VideoPrediction: React.FC = () => {
             setDetections(data.detections);
             setFrameCount(data.frame_count);
             setError(null); // Clear any previous errors
+          } else if (data.type === 'rate_hint') {
+            minFrameIntervalRef.current = 1000 / data.target_fps;
+            jpegQualityRef.current = data.jpeg_quality;
+            maxFrameSizeRef.current = { width: data.max_width, height: data.max_height };
+          } else if (data.type === 'throttle') {
+            // Server is shedding load: back off, then resume at the suggested rate
+            pausedUntilRef.current = performance.now() + (data.retry_after_ms || 1000);
+            if (data.suggested_fps) {
+              minFrameIntervalRef.current = 1000 / data.suggested_fps;
+            }
           } else if (data.type === 'error') {
             console.error('Server error:', data.message);
             setError(`Server error: ${data.message}`);
@@ -179,9 +197,34 @@ const VideoPrediction: React.FC = () => {
         ctx.font = '12px Arial';
         ctx.fillText(label, x1 + 5, y1 - 5);
     });
+
+        // Skip encoding and sending this frame if the server asked us to slow down
+        const sendTime = performance.now();
+        if (sendTime < pausedUntilRef.current
+            || sendTime - lastSentTimeRef.current < minFrameIntervalRef.current) {
+          animationFrameRef.current = requestAnimationFrame(captureFrame);
+          return;
+        }
         
+        // Downscale to the server's hinted resolution before encoding
+        let encodeSource = canvas;
+        const maxSize = maxFrameSizeRef.current;
+        if (maxSize) {
+          const scale = Math.min(1, maxSize.width / canvas.width, maxSize.height / canvas.height);
+          if (scale < 1) {
+            if (!encodeCanvasRef.current) {
+              encodeCanvasRef.current = document.createElement('canvas');
+            }
+            const encodeCanvas = encodeCanvasRef.current;
+            encodeCanvas.width = Math.round(canvas.width * scale);
+            encodeCanvas.height = Math.round(canvas.height * scale);
+            encodeCanvas.getContext('2d')?.drawImage(video, 0, 0, encodeCanvas.width, encodeCanvas.height);
+            encodeSource = encodeCanvas;
+          }
+        }
+
         // Convert to base64
-        const frameData = canvas.toDataURL('image/jpeg', 0.8);
+        const frameData = encodeSource.toDataURL('image/jpeg', jpegQualityRef.current);
         const base64Data = frameData.split(',')[1];
         console.log("Base64 length:", base64Data.length);
       
@@ -193,6 +236,7 @@ const VideoPrediction: React.FC = () => {
       };
       
       if (websocketRef.current?.readyState === WebSocket.OPEN) {
+        lastSentTimeRef.current = sendTime;
         console.log("Sending frame message:", message); 
         websocketRef.current.send(JSON.stringify(message));
         frameCountRef.current++;